@@ -1,72 +1,149 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.http import Http404
+from django.conf import settings
 from django.utils import timezone
 from asgiref.sync import sync_to_async
-from django.db import connection
-from django.shortcuts import get_object_or_404
+from django.db import DatabaseError, connection, transaction
+from django.utils.module_loading import import_string
+import asyncio
+import datetime
+import logging
+import urllib.parse
 from abc import ABC, abstractmethod
 
+from config.metrics import (channel_layer_seconds, command_seconds, open_sockets, rate_limited, repository_seconds,
+                            slow_consumers, timed)
+from config.wire import PROTOCOL_ERROR_CLOSE_CODE, WireCodec
 from components.accounts.models import ProfilePicture
+from components.accounts.services.presence import presence
+from components.accounts.services.profile_cache import profile_cache
+from components.ChatApp.models import SUMMARY_PREVIEW_LENGTH
+from components.ChatApp.services import attachments, chat_queries, message_archive
+from components.ChatApp.services.ephemeral import ephemeral_coalescer
+from components.ChatApp.services.history_cache import history_cache
+from components.ChatApp.services.membership import membership_cache
+from components.ChatApp.services.message_writer import QueueFull, message_writer
+from components.ChatApp.services.rate_limit import rate_limiter
+from components.ChatApp.services.read_receipts import read_receipts
+from components.ChatApp.services.room_events import room_events
+from components.ChatApp.services.room_summary import refresh_last_message
+
+
+logger = logging.getLogger(__name__)
 
 
 class ChatRepository:
+    @staticmethod
+    @timed(repository_seconds, method='get_messages')
+    async def get_messages(room_id, before_id=None, limit=None, before_timestamp=None):
+        """Страница истории комнаты: не более limit сообщений с id < before_id (или самые новые).
+
+        Сообщения сразу соединяются с автором и его аватаркой, так что страница
+        читается одним запросом. Если живых партиций не хватает, страница
+        дополняется из архивных сегментов. Возвращает строки
+        (id, content, timestamp, room_id, user_id, edited, username, profile_picture, avatar_id)
+        в хронологическом порядке. Запрос идёт по индексу (room_id, id);
+        before_timestamp (время сообщения before_id) сужает его до нужных партиций.
+        """
+        if room_id is None:
+            return []
+        limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+        messages = await ChatRepository._fetch_page(room_id, before_id, before_timestamp, limit)
+        if len(messages) < limit:
+            # Страница упёрлась в начало живых партиций — продолжаем по архивным сегментам
+            oldest_id = messages[0][0] if messages else before_id
+            messages = await message_archive.read_messages(room_id, oldest_id, limit - len(messages)) + messages
+        return messages
+
     @staticmethod
     @database_sync_to_async
-    def get_messages(room_id):
-        # room_id = Room.objects.filter(name=self.room_name).values_list('id', flat=True).first()
-        if room_id is not None:
-            # DB_Message.objects.filter(room_id=room_id)
-            with connection.cursor() as cursor:
-                cursor.execute('SELECT * FROM "ChatApp_db_message" WHERE room_id = %s ORDER BY id;', [room_id])
+    def _fetch_page(room_id, before_id, before_timestamp, limit):
+        with connection.cursor() as cursor:
+            for query, params in chat_queries.page_queries(room_id, before_id, before_timestamp, limit,
+                                                           timezone.now()):
+                cursor.execute(query, params)
                 messages = cursor.fetchall()
-            return messages
+                if len(messages) == limit:
+                    break
+        return messages
 
     @staticmethod
+    @timed(repository_seconds, method='get_attachments')
     @database_sync_to_async
-    def get_username(user_id):
-        print(user_id)
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT username FROM "auth_user" WHERE id = %s', [user_id])
-            username = cursor.fetchone()
-            username = username[0]
-            return username
+    def get_attachments(message_ids):
+        return attachments.for_messages(message_ids)
 
     @staticmethod
+    @timed(repository_seconds, method='attach_files')
     @database_sync_to_async
-    def get_avatar(user_id):
-        try:
-            avatar_url = get_object_or_404(ProfilePicture, user_id=user_id)
-            return avatar_url.get_avatar_url()
-        except Http404:
-            return None
+    def attach_files(attachment_ids, user_id, room_id, message_id):
+        return attachments.attach_to_message(attachment_ids, user_id, room_id, message_id)
+
+    @staticmethod
+    @timed(repository_seconds, method='delete_attachments')
+    @database_sync_to_async
+    def delete_attachments(message_id):
+        return attachments.delete_for_message(message_id)
+
+    @staticmethod
+    @timed(repository_seconds, method='get_profile')
+    async def get_profile(user_id):
+        """(username, avatar_url) пользователя; из кэша воркера, при промахе — одним запросом."""
+        profile = profile_cache.get(user_id)
+        if profile is None:
+            profile = await ChatRepository._fetch_profile(user_id)
+            profile_cache.set(user_id, *profile)
+        return profile
+
+    @staticmethod
+    @database_sync_to_async
+    def _fetch_profile(user_id):
+        with connection.cursor() as cursor:
+            cursor.execute(chat_queries.PROFILE, [user_id])
+            username, picture, avatar_id = cursor.fetchone()
+        return username, ProfilePicture.build_avatar_url(picture, avatar_id, settings.AVATARS['chat_size'])
 
     @staticmethod
+    @timed(repository_seconds, method='insert_message')
     @sync_to_async
     def insert_message(msg_content, timestamp, user_id, msg_room_id):
+        # Сообщение и сводка комнаты пишутся одним запросом
         with connection.cursor() as cursor:
-            cursor.execute('INSERT INTO "ChatApp_db_message" (content, timestamp, user_id, room_id, edited)'
-                           'VALUES (%s, %s, %s, %s, FALSE)',
-                           (msg_content, timestamp, user_id, msg_room_id)
-                           )
+            cursor.execute(chat_queries.INSERT_MESSAGE,
+                           (msg_content, timestamp, user_id, msg_room_id, SUMMARY_PREVIEW_LENGTH))
+            return cursor.fetchone()[0]
 
     @staticmethod
+    @timed(repository_seconds, method='update_message')
     @sync_to_async
-    def update_message(new_msg, msg_id):
+    def update_message(new_msg, msg_id, room_id, user_id):
+        """True, если сообщение автора в этой комнате нашлось и изменено."""
         edited = True
         with connection.cursor() as cursor:
-            cursor.execute('UPDATE "ChatApp_db_message"'
-                           'SET content = %s,'
-                           'edited = %s '
-                           'WHERE id = %s', [new_msg, edited, msg_id])
+            cursor.execute(chat_queries.UPDATE_MESSAGE,
+                           [new_msg, edited, msg_id, int(room_id), user_id, SUMMARY_PREVIEW_LENGTH])
+            return cursor.fetchone() is not None
 
     @staticmethod
+    @timed(repository_seconds, method='delete_message')
     @sync_to_async
-    def delete_message(msg_id):
-        with connection.cursor() as cursor:
-            cursor.execute('DELETE FROM "ChatApp_db_message"'
-                           'WHERE id = %s', [msg_id])
+    def delete_message(msg_id, room_id, user_id):
+        """True, если сообщение автора в этой комнате нашлось и удалено."""
+        # Удаление и пересчёт последнего сообщения сводки — одна транзакция
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(chat_queries.DELETE_MESSAGE, [msg_id, int(room_id), user_id])
+            row = cursor.fetchone()
+            if row and row[1]:
+                refresh_last_message(cursor, row[0])
+            return row is not None
+
+
+# Реализации по значению CHAT_REPOSITORY; импортируются при первом подключении,
+# чтобы psycopg и его пул не были обязательны при CHAT_REPOSITORY = 'sync'
+REPOSITORIES = {
+    'sync': 'components.ChatApp.consumers.ChatRepository',
+    'async': 'components.ChatApp.services.async_repository.AsyncChatRepository',
+}
 
 
 class Command(ABC):
@@ -88,8 +165,50 @@ class SaveMessageCommand(Command):
         now = timezone.now()
         if self.consumer.room_id is not None:
             user_instance_id = self.consumer.user.id
-            await self.repository.insert_message(self.data['message'], now, user_instance_id, self.consumer.room_id)
-            await self.consumer.broadcast(self.data)
+            if message_writer.enabled:
+                # id берём из sequence сразу, INSERT уйдёт пачкой позже
+                try:
+                    message_id = await message_writer.next_id()
+                except DatabaseError:
+                    logger.exception("Не удалось получить id сообщения (комната %s)", self.consumer.room_id)
+                    await self.consumer.send_frame({
+                        'type': 'error',
+                        'error': 'unavailable',
+                    })
+                    return
+                try:
+                    await message_writer.submit(message_id, self.data['message'], now, user_instance_id,
+                                                self.consumer.room_id)
+                except QueueFull:
+                    await self.consumer.send_frame({
+                        'type': 'error',
+                        'error': 'overloaded',
+                    })
+                    return
+            else:
+                message_id = await self.repository.insert_message(self.data['message'], now, user_instance_id,
+                                                                  self.consumer.room_id)
+            await read_receipts.record_message(self.consumer.room_id, message_id)
+            username, avatar_url = await self.repository.get_profile(user_instance_id)
+            message = {
+                'id': message_id,
+                'message': self.data['message'],
+                'user': username,
+                'datetime': now.isoformat(),
+                'avatar_url': avatar_url,
+                'edited': False,
+            }
+            attachment_ids = self.data.get('attachments')
+            if attachment_ids and isinstance(attachment_ids, list):
+                # В кадре только метаданные; сами файлы клиент берёт по url
+                attached = await self.repository.attach_files(
+                    attachment_ids[:settings.CHAT_ATTACHMENTS['max_per_message']],
+                    user_instance_id, self.consumer.room_id, message_id)
+                if attached:
+                    message['attachments'] = attached
+            frame = await room_events.publish(self.consumer.room_id, {'type': 'chat_message', **message})
+            await history_cache.append(self.consumer.room_id, message)
+            await self.consumer.broadcast(frame)
 
 
 class EditCommand(Command):
@@ -100,11 +219,29 @@ class EditCommand(Command):
 
     async def execute(self, data: dict):
         self.data = data
-        await self.repository.update_message(self.data['new_text'], self.data['message_id'])
-        await self.consumer.send(text_data=json.dumps({
+        try:
+            message_id = int(self.data['message_id'])
+            new_text = self.data['new_text']
+        except (KeyError, TypeError, ValueError):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'message_id and new_text are required',
+            })
+            return
+        await message_writer.flush()  # правка не должна обогнать отложенный INSERT
+        # Править можно только своё сообщение в этой комнате
+        if not await self.repository.update_message(new_text, message_id, self.consumer.room_id,
+                                                    self.consumer.user.id):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'message not found',
+            })
+            return
+        await history_cache.update(self.consumer.room_id, message_id, message=new_text, edited=True)
+        await self.consumer.broadcast(await room_events.publish(self.consumer.room_id, {
             'type': 'edit',
-            'message_id': self.data['message_id'],
-            'new_text': self.data['new_text']
+            'message_id': message_id,
+            'new_text': new_text
         }))
 
 
@@ -116,13 +253,99 @@ class DeleteCommand(Command):
 
     async def execute(self, data: dict):
         self.data = data
-        await self.repository.delete_message(self.data['message_id'])
-        await self.consumer.send(text_data=json.dumps({
+        try:
+            message_id = int(self.data['message_id'])
+        except (KeyError, TypeError, ValueError):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'message_id is required',
+            })
+            return
+        await message_writer.flush()
+        if not await self.repository.delete_message(message_id, self.consumer.room_id, self.consumer.user.id):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'message not found',
+            })
+            return
+        await self.repository.delete_attachments(message_id)
+        await history_cache.remove(self.consumer.room_id, message_id)
+        await self.consumer.broadcast(await room_events.publish(self.consumer.room_id, {
             'type': 'delete',
-            'message_id': self.data['message_id'],
+            'message_id': message_id,
         }))
 
 
+class LoadMoreCommand(Command):
+    def __init__(self, consumer: 'ChatConsumer', repository: 'ChatRepository'):
+        self.consumer = consumer
+        self.data = None
+        self.repository = repository
+
+    async def execute(self, data: dict):
+        self.data = data
+        try:
+            before_id = int(self.data['before_id'])
+        except (KeyError, TypeError, ValueError):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'before_id is required',
+            })
+            return
+        await self.consumer.load_messages(before_id)
+
+
+class ReadCommand(Command):
+    def __init__(self, consumer: 'ChatConsumer', repository: 'ChatRepository'):
+        self.consumer = consumer
+        self.data = None
+        self.repository = repository
+
+    async def execute(self, data: dict):
+        self.data = data
+        try:
+            message_id = int(self.data['message_id'])
+        except (KeyError, TypeError, ValueError):
+            await self.consumer.send_frame({
+                'type': 'error',
+                'error': 'message_id is required',
+            })
+            return
+        user_id = self.consumer.user.id
+        # Повторные и устаревшие отметки отсекаются в Redis и никуда не рассылаются;
+        # позиция не уходит дальше последнего сообщения комнаты
+        message_id = await read_receipts.advance(self.consumer.room_id, user_id, message_id)
+        if message_id is not None:
+            username, _avatar_url = await self.repository.get_profile(user_id)
+            with channel_layer_seconds.time(operation='group_send'):
+                await self.consumer.channel_layer.group_send(self.consumer.room_group_id, {
+                    'type': 'read_receipt',
+                    'user_id': user_id,
+                    'user': username,
+                    'message_id': message_id,
+                })
+
+
+class EphemeralCommand(Command):
+    """Эфемерное событие (набор текста, просмотр комнаты): без БД, журнала событий и кэша истории.
+
+    Событие уходит в склейку ephemeral_coalescer и доставляется участникам
+    пачкой раз в CHAT_EPHEMERAL['window'] секунд.
+    """
+
+    def __init__(self, consumer: 'ChatConsumer', repository: 'ChatRepository', kind: str):
+        self.consumer = consumer
+        self.repository = repository
+        self.kind = kind
+
+    async def execute(self, data: dict):
+        user = self.consumer.user
+        event = {'kind': self.kind, 'user_id': user.id, 'user': user.username}
+        if self.kind == 'typing':
+            event['active'] = bool(data.get('active', True))
+        ephemeral_coalescer.add(self.consumer.channel_layer, self.consumer.room_group_id, event)
+
+
 class ChatCommandHandler:
     def __init__(self, consumer: 'ChatConsumer', repository: 'ChatRepository'):
         self.consumer = consumer
@@ -131,75 +354,278 @@ class ChatCommandHandler:
             "message": SaveMessageCommand(consumer, repository),
             "edit": EditCommand(consumer, repository),
             "delete": DeleteCommand(consumer, repository),
+            "load_more": LoadMoreCommand(consumer, repository),
+            "read": ReadCommand(consumer, repository),
+            "typing": EphemeralCommand(consumer, repository, 'typing'),
+            "viewing": EphemeralCommand(consumer, repository, 'viewing'),
         }
+        # Эфемерные события не расходуют лимит частоты: склейка и так ограничивает их рассылку
+        self.ephemeral = {"typing", "viewing"}
 
     async def handle(self, data):
         command = data.get("type")
         if command in self.commands:
-            await self.commands[command].execute(data)  # Вызываем метод execute()
+            # Состав комнаты берётся из кэша воркера, поэтому проверка на каждую команду почти бесплатна
+            if not await membership_cache.is_member(self.consumer.room_id, self.consumer.user.id):
+                await self.consumer.close(code=self.consumer.FORBIDDEN_CLOSE_CODE)
+                return
+            retry_after = 0 if command in self.ephemeral else await self.throttle()
+            if retry_after:
+                await self.consumer.send_frame({
+                    'type': 'error',
+                    'error': 'rate_limited',
+                    'retry_after': round(retry_after, 3),
+                })
+                return
+            with command_seconds.time(consumer='chat', command=command):
+                await self.commands[command].execute(data)  # Вызываем метод execute()
+
+    async def throttle(self):
+        """0, если лимиты пользователя и комнаты позволяют команду, иначе пауза в секундах.
+
+        Токен списывается из обоих бакетов или ни из одного: если комната
+        отказала, токен пользователя возвращается.
+        """
+        taken = []
+        for scope, key in (('user', self.consumer.user.id), ('room', self.consumer.room_id)):
+            retry_after = await rate_limiter.check(scope, key)
+            if retry_after:
+                rate_limited.inc(consumer='chat', scope=scope)
+                for taken_scope, taken_key in taken:
+                    await rate_limiter.refund(taken_scope, taken_key)
+                return retry_after
+            taken.append((scope, key))
+        return 0
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Код закрытия для клиента, который не успевает принимать кадры
+    SLOW_CONSUMER_CLOSE_CODE = 4008
+    # Код закрытия для пользователя, не состоящего в комнате
+    FORBIDDEN_CLOSE_CODE = 4003
+
     async def connect(self):
         self.user = self.scope['user']  # Получение аутентифицированного пользователя
         self.room_id = self.scope['url_route']['kwargs']['room_name']
         self.room_group_id = f'{self.room_id}'
-        self.repository = ChatRepository()
+        self.repository = import_string(REPOSITORIES[settings.CHAT_REPOSITORY])()
         self.command_handler = ChatCommandHandler(self, self.repository)  # Обработчик команд
-        await self.channel_layer.group_add(self.room_group_id, self.channel_name)
-        await self.accept()
-        await self.load_messages()
+        self.wire = WireCodec.negotiate(self.scope)  # JSON или бинарный формат кадров
+        self.page_cursor = (None, None)  # (id, время) самого старого отправленного сообщения истории
+        profile_cache.start_listener()
+        membership_cache.start_listener()
+        message_archive.archive_index.start_listener()
+        if not await membership_cache.is_member(self.room_id, self.user.id):
+            await self.close(code=self.FORBIDDEN_CLOSE_CODE)
+            return
+        if self.query_param('acks') != '1':
+            # Без подтверждений отставание клиента не измерить (см. lag) — такие клиенты не принимаются
+            await self.close(code=PROTOCOL_ERROR_CLOSE_CODE)
+            return
+        with channel_layer_seconds.time(operation='group_add'):
+            await self.channel_layer.group_add(self.room_group_id, self.channel_name)
+        await self.accept(subprotocol=self.wire.subprotocol)
+        # Кадры уходят клиенту через очередь, чтобы медленный клиент не задерживал обработку событий
+        self.outbox = asyncio.Queue()
+        self.dropped = False
+        # Кадры, отданные серверу ASGI, и подтверждённые клиентом (ack)
+        self.sent = 0
+        self.acked = 0
+        self.writer = asyncio.create_task(self.drain_outbox())
+        open_sockets.inc(consumer='chat')
+        await presence.join(self.presence_room, self.user.id, self.channel_name)
+        since_seq = self.since_seq()
+        if since_seq is not None:
+            await self.resume(since_seq)
+        else:
+            await self.load_messages()
+
+    @property
+    def presence_room(self):
+        return f'chat:{self.room_id}'
+
+    def query_param(self, name):
+        params = urllib.parse.parse_qs(self.scope.get('query_string', b'').decode('utf-8'))
+        return params.get(name, [None])[0]
+
+    def since_seq(self):
+        """Последний seq, который клиент видел до обрыва (?since_seq=), или None."""
+        try:
+            return int(self.query_param('since_seq'))
+        except (TypeError, ValueError):
+            return None
+
+    async def resume(self, since_seq):
+        """Досылает пропущенные события; если журнал их уже не хранит — полную страницу."""
+        events = await room_events.since(self.room_id, since_seq)
+        if events is None:
+            await self.load_messages()
+            return
+        await self.send_frame({
+            'type': 'sync',
+            'events': [attachments.sign_message(event) for event in events],
+            'seq': events[-1]['seq'] if events else since_seq,
+        })
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_group_id, self.channel_name)
+        if not getattr(self, 'writer', None):
+            return  # подключение отклонено до accept
+        self.writer.cancel()
+        # Сообщения клиента не должны зависнуть в очереди, если воркер вскоре остановят
+        await message_writer.flush()
+        await presence.leave(self.presence_room, self.user.id, self.channel_name)
+        open_sockets.dec(consumer='chat')
+        with channel_layer_seconds.time(operation='group_discard'):
+            await self.channel_layer.group_discard(self.room_group_id, self.channel_name)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.wire.decode(text_data, bytes_data)
+        except ValueError:
+            await self.close(code=PROTOCOL_ERROR_CLOSE_CODE)
+            return
+        if data.get('type') == 'ack':
+            # Подтверждения не команды: без проверки членства и лимитов частоты
+            try:
+                received = int(data['received'])
+            except (KeyError, TypeError, ValueError):
+                await self.close(code=PROTOCOL_ERROR_CLOSE_CODE)
+                return
+            self.acked = min(max(self.acked, received), self.sent)
+            return
         await self.command_handler.handle(data)
 
-    async def load_messages(self):
-        messages = await self.repository.get_messages(self.room_id)
-        for message in messages:
-            message_id = message[0]
-            user_id = message[4]
-            print(message)
-            print(user_id)
-            username = await self.repository.get_username(user_id)
-            timestamp = str(message[2])
-            avatar_url = await self.repository.get_avatar(user_id)
-            edited = bool(message[5])
-            await self.send(text_data=json.dumps({
+    @property
+    def lag(self):
+        """Кадры, которые клиент ещё не получил: очередь плюс отправленные, но не подтверждённые.
+
+        Сервер ASGI (daphne) принимает кадры без ожидания сети, поэтому одна
+        очередь почти всегда пуста и время send ничего не говорит; настоящее
+        отставание видно только по ack, поэтому ?acks=1 обязателен.
+        """
+        return self.outbox.qsize() + self.sent - self.acked
+
+    async def send_frame(self, data, ephemeral=False):
+        """Ставит кадр в очередь на отправку.
+
+        Если отставание клиента (lag) растёт, эфемерные кадры (ephemeral=True)
+        пропускаются, а клиент, отставший на CHAT_OUTBOX['max_queue'] кадров,
+        отключается: после переподключения он досинхронизируется по since_seq.
+        """
+        if self.dropped:
+            return
+        depth = self.lag
+        if depth >= settings.CHAT_OUTBOX['max_queue']:
+            self.dropped = True
+            slow_consumers.inc(consumer='chat', action='drop')
+            self.writer.cancel()
+            await self.close(code=self.SLOW_CONSUMER_CLOSE_CODE)
+            return
+        if ephemeral and depth >= settings.CHAT_OUTBOX['shed_threshold']:
+            slow_consumers.inc(consumer='chat', action='shed')
+            return
+        self.outbox.put_nowait(self.wire.encode(data))
+
+    async def drain_outbox(self):
+        while True:
+            frame = await self.outbox.get()
+            await self.send(**frame)
+            self.sent += 1
+
+    async def load_messages(self, before_id=None):
+        """Отправляет одной пачкой страницу истории (самую новую или предшествующую before_id).
+
+        Самая новая страница берётся из кэша истории в Redis; при промахе
+        читается из Postgres и прогревает кэш.
+        """
+        page_size = settings.CHAT_HISTORY_PAGE_SIZE
+        warming = False
+        seq = None
+        if before_id is None:
+            # seq берётся до чтения страницы: всё, что новее, клиент получит из группы
+            seq = await room_events.current(self.room_id)
+            cached = await history_cache.get(self.room_id)
+            if cached is not None:
+                messages, has_more = cached
+                await self.send_history(messages[-page_size:], has_more or len(messages) > page_size, seq)
+                return
+            warming = await history_cache.begin_warm(self.room_id)
+        await message_writer.flush()
+        # Время сообщения-курсора известно, если клиент листает дальше от отправленной ему страницы
+        before_timestamp = None
+        if before_id is not None and before_id == self.page_cursor[0]:
+            before_timestamp = datetime.datetime.fromisoformat(self.page_cursor[1])
+        # Берём на одну строку больше, чтобы узнать, есть ли что грузить дальше
+        messages = await self.repository.get_messages(self.room_id, before_id, page_size + 1, before_timestamp)
+        has_more = len(messages) > page_size
+        if has_more:
+            messages = messages[1:]
+        page = self.serialize_messages(messages, await self.repository.get_attachments([row[0] for row in messages]))
+        if warming:
+            await history_cache.finish_warm(self.room_id, page, has_more)
+        await self.send_history(page, has_more, seq)
+
+    async def send_history(self, messages, has_more, seq=None):
+        frame = {
+            'type': 'history',
+            # Ссылки на вложения подписываются при отправке: в кэше истории лежат ключи
+            'messages': [attachments.sign_message(message) for message in messages],
+            'has_more': has_more,
+            'before_id': messages[0]['id'] if messages else None,
+        }
+        if seq is not None:
+            frame['seq'] = seq  # только у самой новой страницы: с него клиент продолжит после обрыва
+        if messages:
+            self.page_cursor = messages[0]['id'], messages[0]['datetime']
+        await self.send_frame(frame)
+
+    @staticmethod
+    def serialize_messages(messages, message_attachments=None):
+        authors = {}
+        message_attachments = message_attachments or {}
+        result = []
+        for message_id, content, timestamp, _room_id, user_id, edited, username, picture, avatar_id in messages:
+            if user_id not in authors:
+                authors[user_id] = (username, ProfilePicture.build_avatar_url(picture, avatar_id,
+                                                                              settings.AVATARS['chat_size']))
+                profile_cache.set(user_id, *authors[user_id])
+            username, avatar_url = authors[user_id]
+            message = {
                 'id': message_id,
-                'message': message[1],
+                'message': content,
                 'user': username,
-                'datetime': timestamp,
+                'datetime': str(timestamp),
                 'avatar_url': avatar_url,
-                'edited': edited,
-            }))
+                'edited': bool(edited),
+            }
+            if message_id in message_attachments:
+                message['attachments'] = message_attachments[message_id]
+            result.append(message)
+        return result
 
-    async def broadcast(self, message):
-        now = timezone.now()
-        username = self.user.username
-        user_id = self.user.id
-        avatar_url = await self.repository.get_avatar(user_id)
-        await self.channel_layer.group_send(self.room_group_id,
-                                            {
-                                                'type': 'chat_message',
-                                                'message': message['message'],
-                                                'user': username,
-                                                'datetime': now.isoformat(),
-                                                'avatar_url': avatar_url,
-                                                'edited': False,
-                                            })
-
-    async def chat_message(self, event):
-        message = event['message']
-        user = event['user']
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': message,
-            'user': user,
-            'datetime': event['datetime'],
-            'avatar_url': event['avatar_url'],
-            'edited': False,
-        }))
+    async def broadcast(self, frame):
+        """Рассылает всем в комнате кадр события (с seq из журнала событий)."""
+        with channel_layer_seconds.time(operation='group_send'):
+            await self.channel_layer.group_send(self.room_group_id, {'type': 'room_event', 'frame': frame})
+
+    async def room_event(self, event):
+        await self.send_frame(attachments.sign_message(event['frame']))
+
+    async def read_receipt(self, event):
+        await self.send_frame({
+            'type': 'read_receipt',
+            'user_id': event['user_id'],
+            'user': event['user'],
+            'message_id': event['message_id'],
+        }, ephemeral=True)
+
+    async def members_removed(self, event):
+        # Удалённого из комнаты участника отключаем сразу, не дожидаясь его следующей команды
+        if self.user.id in event['user_ids']:
+            await self.close(code=self.FORBIDDEN_CLOSE_CODE)
+
+    async def ephemeral_batch(self, event):
+        # Свои события клиенту не нужны; остальное при перегрузке сокета можно пропустить
+        events = [item for item in event['events'] if item['user_id'] != self.user.id]
+        if events:
+            await self.send_frame({'type': 'ephemeral', 'events': events}, ephemeral=True)
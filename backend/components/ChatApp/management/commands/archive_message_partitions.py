@@ -0,0 +1,28 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from components.ChatApp.services.message_archive import archive_partition
+from components.ChatApp.services.partitions import add_months, list_partitions, month_start, partition_name
+
+
+class Command(BaseCommand):
+    help = ('Выгружает партиции сообщений старше --keep-months месяцев в сжатые сегменты '
+            'в хранилище CHAT_ARCHIVE и удаляет их из БД. История из них остаётся доступна через load_more.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=settings.CHAT_ARCHIVE['keep_months'],
+                            help='Сколько последних месяцев оставить в БД.')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет выгружено.')
+
+    def handle(self, *args, **options):
+        cutoff = add_months(month_start(datetime.date.today()), -options['keep_months'])
+        for month in list_partitions():
+            if month >= cutoff:
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Будет выгружена {partition_name(month)}')
+                continue
+            segments = archive_partition(month)
+            self.stdout.write(self.style.SUCCESS(f'{partition_name(month)}: выгружено сегментов — {segments}'))
@@ -0,0 +1,21 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from components.ChatApp.services.partitions import add_months, create_partition, month_start, partition_name
+
+
+class Command(BaseCommand):
+    help = 'Создаёт помесячные партиции сообщений на текущий и следующие месяцы (запускать по cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.CHAT_PARTITIONS_MONTHS_AHEAD,
+                            help='Сколько месяцев вперёд должно быть покрыто партициями.')
+
+    def handle(self, *args, **options):
+        current = month_start(datetime.date.today())
+        for offset in range(options['months_ahead'] + 1):
+            month = add_months(current, offset)
+            if create_partition(month):
+                self.stdout.write(self.style.SUCCESS(f'Создана партиция {partition_name(month)}'))
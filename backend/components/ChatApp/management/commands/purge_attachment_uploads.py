@@ -0,0 +1,16 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from components.ChatApp.services.attachments import purge_abandoned
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные незавершённые загрузки вложений вместе с их частями (запускать по cron).'
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - datetime.timedelta(seconds=settings.CHAT_ATTACHMENTS['abandoned_after'])
+        purged = purge_abandoned(older_than)
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {purged}'))
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from components.ChatApp.management.commands.ws_benchmark import Command as WsBenchmark, percentiles
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк репозиториев чата: ChatRepository (поток БД) против AsyncChatRepository '
+            '(асинхронный пул). Параллельные клиенты в M комнатах читают историю, пишут и правят '
+            'сообщения; замеряются p50/p95/p99 вызовов и пропускная способность. Использует '
+            'временную тестовую БД, результат пишет в JSON.')
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=20, help='Число комнат.')
+        parser.add_argument('--clients', type=int, default=5, help='Параллельных клиентов на комнату.')
+        parser.add_argument('--operations', type=int, default=20, help='Циклов чтение/запись/правка на клиента.')
+        parser.add_argument('--history', type=int, default=200, help='Сообщений в истории каждой комнаты.')
+        parser.add_argument('--output', default='repository_benchmark.json', help='Файл с результатами.')
+
+    def handle(self, *args, **options):
+        from components.ChatApp.consumers import REPOSITORIES
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            fixtures = self.create_fixtures(options)
+            results = {name: asyncio.run(self.run(import_string(path)(), fixtures, options))
+                       for name, path in REPOSITORIES.items()}
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'commit': WsBenchmark.git_revision(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'params': {key: options[key] for key in ('rooms', 'clients', 'operations', 'history')},
+            'results': {
+                name: {
+                    'throughput': result['throughput'],
+                    **{operation: percentiles(samples) for operation, samples in result['samples'].items()},
+                }
+                for name, result in results.items()
+            },
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        for name, stats in report['results'].items():
+            self.stdout.write(f"{name}: {stats['throughput']} операций/с")
+            for operation, operation_stats in stats.items():
+                if operation != 'throughput':
+                    self.stdout.write(f"{operation:>20}: {operation_stats}")
+        self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+
+    def create_fixtures(self, options):
+        from components.ChatApp.models import DB_Message, Room, Room_users
+
+        users = User.objects.bulk_create([
+            User(username=f'bench-{index}') for index in range(options['rooms'] * options['clients'])
+        ])
+        rooms = Room.objects.bulk_create([Room(name=f'bench-{index}') for index in range(options['rooms'])])
+        Room_users.objects.bulk_create([
+            Room_users(room=rooms[index % len(rooms)], user=user) for index, user in enumerate(users)
+        ])
+        for room in rooms:
+            DB_Message.objects.bulk_create([
+                DB_Message(room=room, user=users[0], content=f'history {index}')
+                for index in range(options['history'])
+            ], batch_size=1000)
+        return [(rooms[index % len(rooms)].id, user.id) for index, user in enumerate(users)]
+
+    async def run(self, repository, fixtures, options):
+        from components.ChatApp.services.async_repository import chat_db_pool
+
+        samples = {'get_messages': [], 'insert_message': [], 'update_message': []}
+
+        async def measure(operation, call):
+            started = time.perf_counter()
+            result = await call
+            samples[operation].append(time.perf_counter() - started)
+            return result
+
+        async def client(room_id, user_id):
+            for index in range(options['operations']):
+                await measure('get_messages', repository.get_messages(room_id))
+                message_id = await measure('insert_message', repository.insert_message(
+                    f'bench {user_id} {index}', timezone.now(), user_id, room_id))
+                await measure('update_message', repository.update_message(
+                    f'edited {user_id} {index}', message_id, room_id, user_id))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(room_id, user_id) for room_id, user_id in fixtures))
+        elapsed = time.perf_counter() - started
+        await chat_db_pool.close()
+        # Соединения потока БД мешают удалить тестовую базу
+        await database_sync_to_async(connections.close_all)()
+        operations = sum(len(operation_samples) for operation_samples in samples.values())
+        return {'throughput': round(operations / elapsed, 1), 'samples': samples}
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import subprocess
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def percentiles(samples):
+    """p50/p95/p99 (в миллисекундах) по списку замеров в секундах."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50': pick(50),
+        'p95': pick(95),
+        'p99': pick(99),
+        'max': round(ordered[-1] * 1000, 3),
+    }
+
+
+class Client:
+    """Симулированный клиент: держит WebSocket и фиксирует время прихода кадров."""
+
+    def __init__(self, application, path, timeout, ack_every=None):
+        self.communicator = WebsocketCommunicator(application, path)
+        self.timeout = timeout
+        self.ack_every = ack_every  # чат требует подтверждений каждые N кадров, как фронтенд
+        self.received = 0
+        self.frames = asyncio.Queue()
+        self.reader = None
+
+    async def connect(self):
+        started = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise RuntimeError(f'handshake rejected: {self.communicator.scope["path"]}')
+        handshake = time.perf_counter() - started
+        self.reader = asyncio.create_task(self._read())
+        return started, handshake
+
+    async def _read(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] == 'websocket.close':
+                return
+            await self.frames.put((time.perf_counter(), json.loads(output['text'])))
+            self.received += 1
+            if self.ack_every and self.received % self.ack_every == 0:
+                await self.send({'type': 'ack', 'received': self.received})
+
+    async def next_frame(self, frame_type):
+        while True:
+            received_at, frame = await asyncio.wait_for(self.frames.get(), self.timeout)
+            if frame.get('type') == frame_type:
+                return received_at, frame
+
+    async def send(self, data):
+        await self.communicator.send_to(text_data=json.dumps(data))
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный бенчмарк WebSocket: N клиентов в M комнатах ws/chat/<room>/ и пары '
+            'в сигналинге звонков. Замеряет p50/p95/p99 рукопожатия, загрузки истории и '
+            'рассылки, результат пишет в JSON. Использует временную тестовую БД, '
+            'in-memory channel layer и отдельную базу Redis (--redis-db).')
+
+    # Проверки грузят urls и создают Redis-клиенты до переключения на --redis-db
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50, help='Число клиентов чата.')
+        parser.add_argument('--rooms', type=int, default=5, help='Число комнат.')
+        parser.add_argument('--messages', type=int, default=5, help='Сообщений от каждого клиента.')
+        parser.add_argument('--history', type=int, default=500, help='Сообщений в истории каждой комнаты.')
+        parser.add_argument('--call-pairs', type=int, default=10, help='Пар клиентов сигналинга звонков.')
+        parser.add_argument('--signals', type=int, default=5, help='ICE-кандидатов от каждого звонящего.')
+        parser.add_argument('--redis-db', type=int, default=15, help='База Redis для кэшей на время прогона.')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут ожидания кадра, секунды.')
+        parser.add_argument('--output', default='ws_benchmark.json', help='Файл с результатами.')
+
+    def handle(self, *args, **options):
+        redis_config = {**settings.REDIS_CONFIG, 'db': options['redis_db']}
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, REDIS_CONFIG=redis_config):
+                channel_layers.backends.clear()
+                rooms = self.create_fixtures(options)
+                application = import_string(settings.ASGI_APPLICATION)
+                results = asyncio.run(self.run(application, rooms, options))
+                channel_layers.backends.clear()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            'commit': self.git_revision(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'params': {key: options[key] for key in ('clients', 'rooms', 'messages', 'history',
+                                                     'call_pairs', 'signals')},
+            'results': {name: percentiles(samples) for name, samples in results.items()},
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        for name, stats in report['results'].items():
+            self.stdout.write(f"{name:>20}: {stats}")
+        self.stdout.write(self.style.SUCCESS(f"Результаты записаны в {options['output']}"))
+
+    def create_fixtures(self, options):
+        from components.ChatApp.models import DB_Message, Room, Room_users
+        from components.accounts.services.ws_tickets import issue_ticket
+
+        users = User.objects.bulk_create([
+            User(username=f'bench-{index}') for index in range(max(options['clients'], options['call_pairs'] * 2))
+        ])
+        rooms = Room.objects.bulk_create([Room(name=f'bench-{index}') for index in range(options['rooms'])])
+        Room_users.objects.bulk_create([
+            Room_users(room=rooms[index % len(rooms)], user=user) for index, user in enumerate(users)
+        ])
+        for room in rooms:
+            DB_Message.objects.bulk_create([
+                DB_Message(room=room, user=users[0], content=f'history {index}')
+                for index in range(options['history'])
+            ], batch_size=1000)
+        return {
+            'rooms': [room.id for room in rooms],
+            'tickets': [(user.username, issue_ticket(user)) for user in users],
+        }
+
+    async def run(self, application, fixtures, options):
+        from components.ChatApp.services.history_cache import history_cache
+
+        for room_id in fixtures['rooms']:
+            await history_cache.client.delete(history_cache.key(room_id), history_cache.complete_key(room_id))
+        results = {}
+        results.update(await self.run_chat(application, fixtures, options))
+        results.update(await self.run_calls(application, fixtures, options))
+        # Соединения потока БД консьюмеров мешают удалить тестовую базу
+        await database_sync_to_async(connections.close_all)()
+        return results
+
+    async def run_chat(self, application, fixtures, options):
+        rooms = fixtures['rooms']
+        clients = [
+            (rooms[index % len(rooms)],
+             Client(application, f'/ws/chat/{rooms[index % len(rooms)]}/?acks=1&ticket={ticket}',
+                    options['timeout'], ack_every=25))
+            for index, (_username, ticket) in enumerate(fixtures['tickets'][:options['clients']])
+        ]
+        handshake, history, broadcast = [], [], []
+
+        async def connect(client):
+            started, elapsed = await client.connect()
+            handshake.append(elapsed)
+            received_at, _frame = await client.next_frame('history')
+            history.append(received_at - started - elapsed)
+
+        # Все подключаются одновременно — как после деплоя
+        await asyncio.gather(*(connect(client) for _room, client in clients))
+
+        members = {}
+        for room_id, client in clients:
+            members.setdefault(room_id, []).append(client)
+
+        async def collect(client, expected):
+            for _ in range(expected):
+                received_at, frame = await client.next_frame('chat_message')
+                broadcast.append(received_at - sent_at[frame['message']])
+
+        sent_at = {}
+        for _round in range(options['messages']):
+            receivers = []
+            for room_id, room_clients in members.items():
+                receivers.extend(collect(client, len(room_clients)) for client in room_clients)
+            receiving = asyncio.gather(*receivers)
+            for room_clients in members.values():
+                for client in room_clients:
+                    text = f'bench {uuid.uuid4()}'
+                    sent_at[text] = time.perf_counter()
+                    await client.send({'type': 'message', 'message': text})
+            await receiving
+
+        await asyncio.gather(*(client.close() for _room, client in clients))
+        return {
+            'chat_handshake': handshake,
+            'chat_history_load': history,
+            'chat_broadcast_latency': broadcast,
+        }
+
+    async def run_calls(self, application, fixtures, options):
+        tickets = fixtures['tickets'][:options['call_pairs'] * 2]
+        clients = [
+            (username, Client(application, f'/ws/call/?ticket={ticket}', options['timeout']))
+            for username, ticket in tickets
+        ]
+        handshake, signal = [], []
+
+        async def connect(client):
+            _started, elapsed = await client.connect()
+            handshake.append(elapsed)
+
+        await asyncio.gather(*(connect(client) for _username, client in clients))
+
+        async def exchange(caller, callee_name, callee):
+            await caller.send({'type': 'create-call', 'target': callee_name})
+            _received_at, created = await caller.next_frame('call-created')
+            await caller.send({'type': 'call-invite', 'target': callee_name, 'callId': created['callId']})
+            await callee.next_frame('call-invite')
+            for _ in range(options['signals']):
+                sent = time.perf_counter()
+                await caller.send({'type': 'ice-candidate', 'target': callee_name, 'candidate': 'bench'})
+                received_at, _frame = await callee.next_frame('ice-candidate')
+                signal.append(received_at - sent)
+
+        await asyncio.gather(*(
+            exchange(clients[index][1], clients[index + 1][0], clients[index + 1][1])
+            for index in range(0, len(clients) - 1, 2)
+        ))
+        await asyncio.gather(*(client.close() for _username, client in clients))
+        return {
+            'call_handshake': handshake,
+            'call_signal_latency': signal,
+        }
+
+    @staticmethod
+    def git_revision():
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
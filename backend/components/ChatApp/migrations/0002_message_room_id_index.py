@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='db_message',
+            index=models.Index(fields=['room', 'id'], name='chatapp_msg_room_id_idx'),
+        ),
+    ]
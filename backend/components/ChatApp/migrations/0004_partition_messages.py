@@ -0,0 +1,76 @@
+# Перевод "ChatApp_db_message" на помесячное партиционирование по timestamp.
+#
+# Первичный ключ партиционированной таблицы обязан включать ключ партиционирования,
+# поэтому он становится (id, timestamp); уникальность id по-прежнему обеспечивает
+# identity-последовательность. Данные копируются в новую таблицу целиком — на
+# больших базах миграцию стоит запускать в окно обслуживания.
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations
+
+
+TABLE = 'ChatApp_db_message'
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return datetime.date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def partition_messages(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s',
+                       [TABLE, f'{TABLE}_pkey'])
+        index_definitions = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+                       'WHERE conrelid = %s::regclass AND contype = %s', [f'"{TABLE}"', 'f'])
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT min("timestamp"), max(id) FROM "{TABLE}"')
+        oldest, max_id = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{TABLE}_legacy"')
+        cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{TABLE}_legacy" '
+                       f'INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY) '
+                       f'PARTITION BY RANGE ("timestamp")')
+        # Страховка на случай, если партиция месяца не создана заранее
+        cursor.execute(f'CREATE TABLE "{TABLE}_default" PARTITION OF "{TABLE}" DEFAULT')
+
+        month = month_start(oldest) if oldest else month_start(datetime.date.today())
+        last = month_start(datetime.date.today())
+        # Столько же месяцев вперёд, сколько держит create_message_partitions
+        for _ in range(settings.CHAT_PARTITIONS_MONTHS_AHEAD):
+            last = next_month(last)
+        while month <= last:
+            cursor.execute(f'CREATE TABLE "{TABLE}_p{month:%Y%m}" PARTITION OF "{TABLE}" '
+                           f'FOR VALUES FROM (%s) TO (%s)', [month, next_month(month)])
+            month = next_month(month)
+
+        cursor.execute(f'INSERT INTO "{TABLE}" (id, content, "timestamp", edited, user_id, room_id) '
+                       f'SELECT id, content, "timestamp", edited, user_id, room_id FROM "{TABLE}_legacy"')
+        cursor.execute(f'DROP TABLE "{TABLE}_legacy"')
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id, "timestamp")')
+        for definition in index_definitions:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+        if max_id is not None:
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('\"{TABLE}\"', 'id'), %s)", [max_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0003_message_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_messages),
+    ]
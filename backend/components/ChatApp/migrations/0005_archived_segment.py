@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0004_partition_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('min_id', models.BigIntegerField()),
+                ('max_id', models.BigIntegerField()),
+                ('message_count', models.IntegerField()),
+                ('path', models.CharField(max_length=512)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ChatApp.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'max_id'], name='chatapp_segment_room_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.4 on 2026-10-18 17:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0005_archived_segment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room_users',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='RoomSummary',
+            fields=[
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='ChatApp.room')),
+                ('last_message_id', models.BigIntegerField(null=True)),
+                ('last_message', models.CharField(blank=True, max_length=200)),
+                ('last_timestamp', models.DateTimeField(null=True)),
+                ('message_count', models.IntegerField(default=0)),
+                ('last_user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        # Сводка по уже существующим сообщениям; старую историю считаем прочитанной
+        migrations.RunSQL(
+            sql=[
+                'INSERT INTO "ChatApp_roomsummary" '
+                '(room_id, last_message_id, last_message, last_user_id, last_timestamp, message_count) '
+                'SELECT DISTINCT ON (room_id) room_id, id, left(content, 200), user_id, "timestamp", '
+                '       count(*) OVER (PARTITION BY room_id) '
+                'FROM "ChatApp_db_message" ORDER BY room_id, id DESC',
+                'UPDATE "ChatApp_room_users" ru SET last_read_id = s.last_message_id '
+                'FROM "ChatApp_roomsummary" s WHERE s.room_id = ru.room_id',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
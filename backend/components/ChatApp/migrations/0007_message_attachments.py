@@ -0,0 +1,46 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:03
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0006_room_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('message_id', models.BigIntegerField(db_index=True, null=True)),
+                ('file_name', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('chunk_size', models.IntegerField()),
+                ('status', models.CharField(choices=[('uploading', 'uploading'), ('complete', 'complete')], default='uploading', max_length=16)),
+                ('path', models.CharField(blank=True, max_length=512)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ChatApp.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AttachmentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('size', models.IntegerField()),
+                ('attachment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='ChatApp.attachment')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentchunk',
+            constraint=models.UniqueConstraint(fields=('attachment', 'index'), name='chatapp_attachment_chunk_uniq'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.4 on 2026-10-18 18:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChatApp', '0007_message_attachments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Дубли, накопившиеся без ограничения (повторные add_user), схлопываются в самую раннюю строку
+        migrations.RunSQL(
+            '''
+            DELETE FROM "ChatApp_room_users" duplicate
+            USING "ChatApp_room_users" original
+            WHERE duplicate.room_id = original.room_id
+              AND duplicate.user_id = original.user_id
+              AND duplicate.id > original.id
+            ''',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='room_users',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='chatapp_room_user_unique'),
+        ),
+    ]
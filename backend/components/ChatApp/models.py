@@ -1,5 +1,15 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+
+# Конфигурация полнотекстового поиска по сообщениям (и для колонки, и для запросов)
+SEARCH_CONFIG = 'russian'
+
+# Длина превью последнего сообщения в списке чатов
+SUMMARY_PREVIEW_LENGTH = 200
 
 
 class Room(models.Model):
@@ -16,9 +26,14 @@ class Room(models.Model):
 class Room_users(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    last_read_id = models.BigIntegerField(default=0)  # id последнего прочитанного сообщения
 
     class Meta:
         app_label = 'ChatApp'
+        constraints = [
+            # Нужен bulk_create(ignore_conflicts=True) при массовом добавлении участников
+            models.UniqueConstraint(fields=['room', 'user'], name='chatapp_room_user_unique'),
+        ]
 
 class DB_Message(models.Model):
     content = models.TextField()  # Содержимое сообщения
@@ -26,11 +41,94 @@ class DB_Message(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
     edited = models.BooleanField(default=False)
+    # Вычисляется самим Postgres при INSERT/UPDATE content, поэтому правки не требуют отдельной записи
+    search_vector = models.GeneratedField(
+        expression=SearchVector('content', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     def __str__(self):
         return self.content
 
     class Meta:
         app_label = 'ChatApp'
+        indexes = [
+            # Keyset-пагинация истории: WHERE room_id = %s AND id < %s ORDER BY id DESC
+            models.Index(fields=['room', 'id'], name='chatapp_msg_room_id_idx'),
+            GinIndex(fields=['search_vector'], name='chatapp_msg_search_idx'),
+        ]
+
+
+class RoomSummary(models.Model):
+    """Денормализованная сводка комнаты для списка чатов; обновляется командами чата."""
+    room = models.OneToOneField(Room, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    last_message_id = models.BigIntegerField(null=True)
+    last_message = models.CharField(max_length=SUMMARY_PREVIEW_LENGTH, blank=True)
+    last_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    last_timestamp = models.DateTimeField(null=True)
+    message_count = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = 'ChatApp'
+
+
+class ArchivedSegment(models.Model):
+    """Сообщения комнаты за месяц, выгруженные из старой партиции в сжатый файл."""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    month = models.DateField()
+    min_id = models.BigIntegerField()
+    max_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    path = models.CharField(max_length=512)
+
+    class Meta:
+        app_label = 'ChatApp'
+        indexes = [
+            models.Index(fields=['room', 'max_id'], name='chatapp_segment_room_idx'),
+        ]
 
 
+class Attachment(models.Model):
+    """Файл, прикреплённый к сообщению; загружается частями через сессию загрузки."""
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [(STATUS_UPLOADING, 'uploading'), (STATUS_COMPLETE, 'complete')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Без внешнего ключа: у партиционированной таблицы сообщений составной первичный ключ (id, timestamp)
+    message_id = models.BigIntegerField(null=True, db_index=True)
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    path = models.CharField(max_length=512, blank=True)  # итоговый файл в хранилище вложений
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def expected_chunk_size(self, index):
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+
+    class Meta:
+        app_label = 'ChatApp'
+
+
+class AttachmentChunk(models.Model):
+    """Принятая часть загрузки; по списку частей клиент продолжает оборванную загрузку."""
+    attachment = models.ForeignKey(Attachment, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+
+    class Meta:
+        app_label = 'ChatApp'
+        constraints = [
+            models.UniqueConstraint(fields=['attachment', 'index'], name='chatapp_attachment_chunk_uniq'),
+        ]
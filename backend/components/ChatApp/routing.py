@@ -2,5 +2,5 @@ from django.urls import re_path
 from . import consumers
 
 application = [
-    re_path(r'ws/chat/(?P<room_name>\d+)/', consumers.ChatConsumer.as_asgi())
+    re_path(r'^ws/chat/(?P<room_name>\d+)/$', consumers.ChatConsumer.as_asgi())
 ]
@@ -9,6 +9,38 @@ class RoomSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'users']
 
 
+class RoomListSerializer(serializers.ModelSerializer):
+    """Комната в списке чатов: сводка, непрочитанные и кто онлайн.
+
+    context: 'unread' = {room_id: count}, 'online' = {room_id: [user_id, ...]}.
+    """
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
+    online = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'users', 'last_message', 'unread_count', 'online']
+
+    def get_last_message(self, room):
+        summary = getattr(room, 'summary', None)
+        if summary is None or summary.last_message_id is None:
+            return None
+        return {
+            'id': summary.last_message_id,
+            'message': summary.last_message,
+            'user': summary.last_user.username if summary.last_user else None,
+            'datetime': summary.last_timestamp.isoformat(),
+            'message_count': summary.message_count,
+        }
+
+    def get_unread_count(self, room):
+        return self.context.get('unread', {}).get(room.id, 0)
+
+    def get_online(self, room):
+        return [int(user_id) for user_id in self.context.get('online', {}).get(room.id, [])]
+
+
 class DBMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = DB_Message
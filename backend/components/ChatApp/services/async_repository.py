@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import contextlib
+
+import psycopg
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from config.metrics import Gauge, registry, repository_seconds, timed
+from components.accounts.models import ProfilePicture
+from components.accounts.services.profile_cache import profile_cache
+from components.ChatApp.models import SUMMARY_PREVIEW_LENGTH
+from components.ChatApp.services import attachments, chat_queries, message_archive
+from components.ChatApp.services.room_summary import REFRESH_LAST_MESSAGE
+
+
+pool_busy = registry.register(Gauge(
+    'chat_db_pool_busy_connections', 'Занятые соединения асинхронного пула БД чата.'))
+
+
+class AsyncConnectionPool:
+    """Ограниченный пул асинхронных соединений psycopg.
+
+    Соединения привязаны к event loop, поэтому у каждого loop свой набор
+    (как у channel layer). Больше max_size соединений одновременно не
+    открывается: остальные запросы ждут свободное до timeout секунд.
+    Соединения в autocommit; простаивающие переиспользуются вместе с
+    подготовленными на них запросами.
+    """
+
+    def __init__(self, max_size=10, timeout=5.0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._loops = {}  # loop -> (asyncio.Semaphore, deque простаивающих соединений)
+
+    def _get_loop_pool(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._loops[loop] = (asyncio.Semaphore(self.max_size), collections.deque())
+        return self._loops[loop]
+
+    @staticmethod
+    async def _connect():
+        # Параметры берутся при подключении: тестовая БД подменяет NAME уже после импорта
+        params = connections['default'].get_connection_params()
+        for key in ('cursor_factory', 'context', 'prepare_threshold'):
+            params.pop(key, None)  # у Django свои классы курсора и адаптеры, подготовка у пула своя
+        return await psycopg.AsyncConnection.connect(**params, autocommit=True, options='-c TimeZone=UTC')
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        slots, idle = self._get_loop_pool()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'нет свободного соединения с БД за {self.timeout} с') from None
+        conn = None
+        try:
+            while idle and conn is None:
+                conn = idle.pop()
+                if conn.closed:
+                    conn = None
+            if conn is None:
+                conn = await self._connect()
+            pool_busy.inc()
+            try:
+                yield conn
+            finally:
+                pool_busy.dec()
+            if not conn.closed and conn.info.transaction_status == psycopg.pq.TransactionStatus.IDLE:
+                idle.append(conn)
+                conn = None
+        finally:
+            if conn is not None and not conn.closed:
+                await conn.close()  # соединение в неизвестном состоянии в пул не возвращается
+            slots.release()
+
+    async def close(self):
+        """Закрывает простаивающие соединения текущего loop."""
+        _slots, idle = self._loops.pop(asyncio.get_running_loop(), (None, ()))
+        for conn in idle:
+            await conn.close()
+
+
+class AsyncChatRepository:
+    """Репозиторий чата на асинхронном драйвере (CHAT_REPOSITORY = 'async').
+
+    Те же методы и строки, что у ChatRepository, но горячие запросы идут
+    прямо из event loop через пул chat_db_pool и выполняются как
+    подготовленные, без перехода в пул потоков. Вложения и архивные
+    сегменты по-прежнему читаются через ORM и хранилище.
+    """
+
+    @staticmethod
+    @timed(repository_seconds, method='get_messages')
+    async def get_messages(room_id, before_id=None, limit=None, before_timestamp=None):
+        if room_id is None:
+            return []
+        limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+        async with chat_db_pool.connection() as conn:
+            for query, params in chat_queries.page_queries(int(room_id), before_id, before_timestamp, limit,
+                                                           timezone.now()):
+                cursor = await conn.execute(query, params, prepare=True)
+                messages = await cursor.fetchall()
+                if len(messages) == limit:
+                    break
+        if len(messages) < limit:
+            # Страница упёрлась в начало живых партиций — продолжаем по архивным сегментам
+            oldest_id = messages[0][0] if messages else before_id
+            messages = await message_archive.read_messages(room_id, oldest_id, limit - len(messages)) + messages
+        return messages
+
+    @staticmethod
+    @timed(repository_seconds, method='get_attachments')
+    @database_sync_to_async
+    def get_attachments(message_ids):
+        return attachments.for_messages(message_ids)
+
+    @staticmethod
+    @timed(repository_seconds, method='attach_files')
+    @database_sync_to_async
+    def attach_files(attachment_ids, user_id, room_id, message_id):
+        return attachments.attach_to_message(attachment_ids, user_id, room_id, message_id)
+
+    @staticmethod
+    @timed(repository_seconds, method='delete_attachments')
+    @database_sync_to_async
+    def delete_attachments(message_id):
+        return attachments.delete_for_message(message_id)
+
+    @staticmethod
+    @timed(repository_seconds, method='get_profile')
+    async def get_profile(user_id):
+        """(username, avatar_url) пользователя; из кэша воркера, при промахе — одним запросом."""
+        profile = profile_cache.get(user_id)
+        if profile is None:
+            async with chat_db_pool.connection() as conn:
+                cursor = await conn.execute(chat_queries.PROFILE, [user_id], prepare=True)
+                username, picture, avatar_id = await cursor.fetchone()
+            # URL строится через storage, который может ходить в сеть
+            avatar_url = await sync_to_async(ProfilePicture.build_avatar_url)(
+                picture, avatar_id, settings.AVATARS['chat_size'])
+            profile = username, avatar_url
+            profile_cache.set(user_id, *profile)
+        return profile
+
+    @staticmethod
+    @timed(repository_seconds, method='insert_message')
+    async def insert_message(msg_content, timestamp, user_id, msg_room_id):
+        async with chat_db_pool.connection() as conn:
+            cursor = await conn.execute(chat_queries.INSERT_MESSAGE,
+                                        (msg_content, timestamp, user_id, msg_room_id, SUMMARY_PREVIEW_LENGTH),
+                                        prepare=True)
+            return (await cursor.fetchone())[0]
+
+    @staticmethod
+    @timed(repository_seconds, method='update_message')
+    async def update_message(new_msg, msg_id, room_id, user_id):
+        """True, если сообщение автора в этой комнате нашлось и изменено."""
+        async with chat_db_pool.connection() as conn:
+            cursor = await conn.execute(chat_queries.UPDATE_MESSAGE,
+                                        [new_msg, True, msg_id, int(room_id), user_id, SUMMARY_PREVIEW_LENGTH],
+                                        prepare=True)
+            return await cursor.fetchone() is not None
+
+    @staticmethod
+    @timed(repository_seconds, method='delete_message')
+    async def delete_message(msg_id, room_id, user_id):
+        """True, если сообщение автора в этой комнате нашлось и удалено."""
+        async with chat_db_pool.connection() as conn, conn.transaction():
+            cursor = await conn.execute(chat_queries.DELETE_MESSAGE, [msg_id, int(room_id), user_id], prepare=True)
+            row = await cursor.fetchone()
+            if row and row[1]:
+                await conn.execute(REFRESH_LAST_MESSAGE, [SUMMARY_PREVIEW_LENGTH, row[0]])
+            return row is not None
+
+
+chat_db_pool = AsyncConnectionPool(**settings.CHAT_ASYNC_DB)
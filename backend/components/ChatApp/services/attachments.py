@@ -0,0 +1,249 @@
+import io
+import logging
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django.utils.text import get_valid_filename
+
+from components.ChatApp.models import Attachment, AttachmentChunk
+
+
+logger = logging.getLogger(__name__)
+
+# Размер кусков, которыми части читаются из запроса и из хранилища
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class AttachmentError(Exception):
+    """Некорректная часть или сессия загрузки; текст уходит клиенту."""
+
+
+@lru_cache(maxsize=None)
+def get_attachment_storage():
+    """Хранилище вложений (Django storage API, как у аватарок и архива)."""
+    return import_string(settings.CHAT_ATTACHMENTS['storage'])(**settings.CHAT_ATTACHMENTS['options'])
+
+
+def chunk_path(attachment, index):
+    return f"{settings.CHAT_ATTACHMENTS['prefix']}/{attachment.id}/chunks/{index:06d}"
+
+
+def file_path(attachment):
+    name = get_valid_filename(os.path.basename(attachment.file_name)) or 'file'
+    return f"{settings.CHAT_ATTACHMENTS['prefix']}/{attachment.id}/{name}"
+
+
+class CountingReader(io.RawIOBase):
+    """Поток запроса, отдающий не больше limit байт и считающий прочитанное."""
+
+    def __init__(self, stream, limit):
+        super().__init__()
+        self.stream = stream
+        self.limit = limit
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self.limit - self.read_bytes
+        if remaining <= 0:
+            return 0
+        data = self.stream.read(min(len(buffer), remaining))
+        buffer[:len(data)] = data
+        self.read_bytes += len(data)
+        return len(data)
+
+
+class ConcatenatedReader(io.RawIOBase):
+    """Последовательное чтение частей из хранилища как одного файла (по одной части в памяти за раз)."""
+
+    def __init__(self, storage, names):
+        super().__init__()
+        self.storage = storage
+        self.names = list(names)
+        self.current = None
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self.current is None:
+                if not self.names:
+                    return 0
+                self.current = self.storage.open(self.names.pop(0), 'rb')
+            data = self.current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self.read_bytes += len(data)
+                return len(data)
+            self.current.close()
+            self.current = None
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        super().close()
+
+
+def save_chunk(attachment, index, stream, length):
+    """Пишет часть из потока запроса в хранилище, не буферизуя её целиком.
+
+    Повторная отправка той же части (продолжение загрузки) её перезаписывает.
+    """
+    if attachment.status != Attachment.STATUS_UPLOADING:
+        raise AttachmentError('Загрузка уже завершена.')
+    if not 0 <= index < attachment.chunk_count:
+        raise AttachmentError('Некорректный номер части.')
+    expected = attachment.expected_chunk_size(index)
+    if length != expected:
+        raise AttachmentError(f'Ожидалась часть размером {expected} байт.')
+    storage = get_attachment_storage()
+    name = chunk_path(attachment, index)
+    if storage.exists(name):
+        storage.delete(name)
+    reader = CountingReader(stream, length)
+    saved = storage.save(name, File(reader, name=name))
+    if reader.read_bytes != expected:
+        storage.delete(saved)
+        raise AttachmentError('Часть получена не полностью.')
+    AttachmentChunk.objects.update_or_create(attachment=attachment, index=index, defaults={'size': expected})
+
+
+def complete(attachment):
+    """Склеивает принятые части в итоговый файл и удаляет их.
+
+    Склейка (долгое чтение и запись в хранилище) идёт без блокировки строки;
+    под блокировкой только проверка частей и смена статуса. Если две склейки
+    совпали по времени, остаётся файл первой, вторая удаляет свой.
+    """
+    attachment = Attachment.objects.get(pk=attachment.pk)
+    if attachment.status == Attachment.STATUS_COMPLETE:
+        return attachment
+    received = set(attachment.chunks.values_list('index', flat=True))
+    missing = sorted(set(range(attachment.chunk_count)) - received)
+    if missing:
+        raise AttachmentError(f'Не хватает частей: {missing[:20]}')
+    storage = get_attachment_storage()
+    names = [chunk_path(attachment, index) for index in range(attachment.chunk_count)]
+    reader = ConcatenatedReader(storage, names)
+    try:
+        path = storage.save(file_path(attachment), File(reader, name=attachment.file_name))
+    except Exception:
+        # Части могла удалить параллельная склейка, успевшая раньше
+        attachment = Attachment.objects.get(pk=attachment.pk)
+        if attachment.status == Attachment.STATUS_COMPLETE:
+            return attachment
+        raise
+    finally:
+        reader.close()
+    if reader.read_bytes != attachment.size:
+        storage.delete(path)
+        raise AttachmentError('Части не совпадают с размером файла.')
+    with transaction.atomic():
+        attachment = Attachment.objects.select_for_update().get(pk=attachment.pk)
+        if attachment.status == Attachment.STATUS_COMPLETE:
+            storage.delete(path)
+            return attachment
+        attachment.path = path
+        attachment.status = Attachment.STATUS_COMPLETE
+        attachment.save(update_fields=['path', 'status'])
+        attachment.chunks.all().delete()
+    for name in names:
+        storage.delete(name)
+    return attachment
+
+
+def describe(attachment):
+    """Метаданные вложения для кадров чата (без содержимого файла).
+
+    Вместо ссылки хранится ключ в хранилище: кадры лежат в кэше истории и
+    журнале событий дольше, чем живёт подписанная ссылка S3. Ссылку
+    подставляет sign при отправке клиенту.
+    """
+    return {
+        'id': str(attachment.id),
+        'name': attachment.file_name,
+        'content_type': attachment.content_type,
+        'size': attachment.size,
+        'key': attachment.path,
+    }
+
+
+def sign(item):
+    """Метаданные для клиента: ключ заменён свежей ссылкой на файл."""
+    if 'key' not in item:
+        return item
+    item = dict(item)
+    item['url'] = get_attachment_storage().url(item.pop('key'))
+    return item
+
+
+def sign_message(message):
+    """Сообщение или кадр с подписанными ссылками на вложения."""
+    if not message.get('attachments'):
+        return message
+    return {**message, 'attachments': [sign(item) for item in message['attachments']]}
+
+
+def attach_to_message(attachment_ids, user_id, room_id, message_id):
+    """Привязывает завершённые вложения пользователя к сообщению; возвращает их метаданные.
+
+    Чужие, незавершённые, из другой комнаты и уже привязанные вложения пропускаются.
+    """
+    with transaction.atomic():
+        attachments = list(Attachment.objects.select_for_update().filter(
+            id__in=attachment_ids, user_id=user_id, room_id=room_id,
+            status=Attachment.STATUS_COMPLETE, message_id__isnull=True,
+        ).order_by('created_at'))
+        Attachment.objects.filter(id__in=[attachment.id for attachment in attachments]).update(message_id=message_id)
+    return [describe(attachment) for attachment in attachments]
+
+
+def for_messages(message_ids):
+    """{message_id: [метаданные вложений]} для страницы истории одним запросом."""
+    result = {}
+    attachments = Attachment.objects.filter(message_id__in=message_ids).order_by('created_at')
+    for attachment in attachments:
+        result.setdefault(attachment.message_id, []).append(describe(attachment))
+    return result
+
+
+def delete_for_message(message_id):
+    """Удаляет вложения удалённого сообщения вместе с файлами; возвращает их число.
+
+    Внешнего ключа на сообщение нет, поэтому без этого строки и файлы остались бы навсегда.
+    """
+    storage = get_attachment_storage()
+    with transaction.atomic():
+        attachments = list(Attachment.objects.select_for_update().filter(message_id=message_id))
+        Attachment.objects.filter(id__in=[attachment.id for attachment in attachments]).delete()
+    # Файлы — после коммита: при сбое хранилища остаётся лишний файл, а не битая ссылка
+    for attachment in attachments:
+        if not attachment.path:
+            continue
+        try:
+            storage.delete(attachment.path)
+        except Exception:
+            logger.exception("Не удалось удалить файл вложения %s", attachment.path)
+    return len(attachments)
+
+
+def purge_abandoned(older_than):
+    """Удаляет незавершённые загрузки, начатые раньше older_than; возвращает их число."""
+    storage = get_attachment_storage()
+    abandoned = Attachment.objects.filter(status=Attachment.STATUS_UPLOADING, created_at__lt=older_than)
+    count = 0
+    for attachment in abandoned.prefetch_related('chunks'):
+        for chunk in attachment.chunks.all():
+            storage.delete(chunk_path(attachment, chunk.index))
+        attachment.delete()
+        count += 1
+    return count
@@ -0,0 +1,102 @@
+import datetime
+
+from components.ChatApp.services.room_summary import SUMMARY_UPSERT
+
+
+# SQL команд чата, общий для обоих репозиториев (ChatRepository и AsyncChatRepository).
+# Тексты неизменны, поэтому асинхронный репозиторий держит их подготовленными на соединениях.
+
+# Страница истории сначала ищется в партициях за последние HISTORY_WINDOW от курсора
+HISTORY_WINDOW = datetime.timedelta(days=31)
+# id и timestamp сообщению назначаются не одновременно, соседние сообщения могут идти не строго по времени
+CURSOR_SLACK = datetime.timedelta(minutes=1)
+# Границы "без ограничения" — тоже даты, чтобы подготовленные запросы не зависели от типа параметра
+EARLIEST = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+LATEST = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+
+def _messages_page(cursor_filter):
+    # Сообщения сразу соединяются с автором и его аватаркой, так что страница читается одним запросом.
+    # Границы по timestamp (ключу партиционирования) отсекают партиции, где страницы быть не может
+    return ('WITH page AS ('
+            '    SELECT id, content, timestamp, room_id, user_id, edited '
+            '    FROM "ChatApp_db_message" WHERE room_id = %s AND "timestamp" >= %s ' + cursor_filter +
+            '    ORDER BY id DESC LIMIT %s'
+            '), authors AS ('
+            '    SELECT u.id, u.username, p.profile_picture, p.avatar_id '
+            '    FROM "auth_user" u LEFT JOIN LATERAL ('
+            '        SELECT profile_picture, avatar_id FROM "accounts_profilepicture" '
+            '        WHERE user_id = u.id ORDER BY id DESC LIMIT 1'
+            '    ) p ON TRUE '
+            '    WHERE u.id IN (SELECT DISTINCT user_id FROM page)'
+            ') '
+            'SELECT page.id, page.content, page.timestamp, page.room_id, page.user_id, '
+            '       page.edited, authors.username, authors.profile_picture, authors.avatar_id '
+            'FROM page JOIN authors ON authors.id = page.user_id '
+            'ORDER BY page.id')
+
+
+# (room_id, нижняя граница timestamp, limit) и (room_id, нижняя граница, before_id, верхняя граница, limit)
+MESSAGES_LATEST = _messages_page('')
+MESSAGES_BEFORE = _messages_page('AND id < %s AND "timestamp" < %s ')
+
+
+def page_queries(room_id, before_id, before_timestamp, limit, now):
+    """Запросы страницы истории с параметрами: сначала в окне последних партиций, затем без нижней границы.
+
+    before_timestamp — время сообщения before_id, если оно известно; тогда
+    партиции новее курсора тоже не читаются. Второй запрос нужен, только если
+    первый вернул меньше limit строк.
+    """
+    start = (before_timestamp or now) - HISTORY_WINDOW
+    if before_id is None:
+        return [(MESSAGES_LATEST, [room_id, bound, limit]) for bound in (start, EARLIEST)]
+    end = before_timestamp + CURSOR_SLACK if before_timestamp is not None else LATEST
+    return [(MESSAGES_BEFORE, [room_id, bound, before_id, end, limit]) for bound in (start, EARLIEST)]
+
+
+# (user_id)
+PROFILE = ('SELECT u.username, p.profile_picture, p.avatar_id '
+           'FROM "auth_user" u LEFT JOIN LATERAL ('
+           '    SELECT profile_picture, avatar_id FROM "accounts_profilepicture" '
+           '    WHERE user_id = u.id ORDER BY id DESC LIMIT 1'
+           ') p ON TRUE WHERE u.id = %s')
+
+# (список user_id) -> (id, username, profile_picture, avatar_id)
+PROFILES = ('SELECT u.id, u.username, p.profile_picture, p.avatar_id '
+            'FROM "auth_user" u LEFT JOIN LATERAL ('
+            '    SELECT profile_picture, avatar_id FROM "accounts_profilepicture" '
+            '    WHERE user_id = u.id ORDER BY id DESC LIMIT 1'
+            ') p ON TRUE WHERE u.id = ANY(%s)')
+
+# (content, timestamp, user_id, room_id, длина превью); сообщение и сводка комнаты пишутся одним запросом
+INSERT_MESSAGE = ('WITH inserted AS ('
+                  '    INSERT INTO "ChatApp_db_message" (content, timestamp, user_id, room_id, edited)'
+                  '    VALUES (%s, %s, %s, %s, FALSE) RETURNING id, content, timestamp, user_id, room_id'
+                  '), summary AS ('
+                  '    INSERT INTO "ChatApp_roomsummary" AS s '
+                  '    (room_id, last_message_id, last_message, last_user_id, last_timestamp, message_count) '
+                  '    SELECT room_id, id, left(content, %s), user_id, timestamp, 1 FROM inserted '
+                  '    ' + SUMMARY_UPSERT +
+                  ') SELECT id FROM inserted')
+
+# (content, edited, message_id, room_id, user_id, длина превью) -> (id,), если сообщение автора нашлось
+UPDATE_MESSAGE = ('WITH updated AS ('
+                  '    UPDATE "ChatApp_db_message" '
+                  '    SET content = %s, edited = %s '
+                  '    WHERE id = %s AND room_id = %s AND user_id = %s RETURNING id, room_id, content'
+                  '), summary AS ('
+                  '    UPDATE "ChatApp_roomsummary" s SET last_message = left(updated.content, %s) '
+                  '    FROM updated WHERE s.room_id = updated.room_id AND s.last_message_id = updated.id'
+                  ') SELECT id FROM updated')
+
+# (message_id, room_id, user_id) -> (room_id, удалено ли последнее сообщение комнаты), если сообщение автора нашлось
+DELETE_MESSAGE = ('WITH deleted AS ('
+                  '    DELETE FROM "ChatApp_db_message" WHERE id = %s AND room_id = %s AND user_id = %s '
+                  '    RETURNING id, room_id'
+                  '), summary AS ('
+                  '    UPDATE "ChatApp_roomsummary" s '
+                  '    SET message_count = greatest(s.message_count - 1, 0) '
+                  '    FROM deleted WHERE s.room_id = deleted.room_id '
+                  '    RETURNING s.last_message_id = deleted.id AS was_last'
+                  ') SELECT deleted.room_id, coalesce((SELECT bool_or(was_last) FROM summary), FALSE) FROM deleted')
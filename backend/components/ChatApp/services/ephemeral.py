@@ -0,0 +1,51 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+from config.metrics import Counter, channel_layer_seconds, registry
+
+
+logger = logging.getLogger(__name__)
+
+ephemeral_events = registry.register(Counter(
+    'chat_ephemeral_events_total', 'Эфемерные события чата: received — от клиентов, sent — ушло в пачках.'))
+
+
+class EphemeralCoalescer:
+    """Склейка эфемерных событий комнаты (набор текста, просмотр) в один кадр за тик.
+
+    События не сохраняются и не трогают БД. За окно window секунд от одного
+    пользователя остаётся только последнее событие каждого вида, и воркер
+    отправляет в группу комнаты одну пачку вместо group_send на каждое нажатие
+    клавиши. Тик запускается первым событием и не крутится в простаивающих комнатах.
+    """
+
+    def __init__(self, window=0.25):
+        self.window = window
+        self._pending = {}  # группа -> {(kind, user_id): событие}
+        self._ticks = {}  # группа -> задача отправки пачки
+
+    def add(self, channel_layer, group, event):
+        ephemeral_events.inc(kind=event['kind'], action='received')
+        self._pending.setdefault(group, {})[(event['kind'], event['user_id'])] = event
+        if group not in self._ticks:
+            self._ticks[group] = asyncio.get_running_loop().create_task(self._tick(channel_layer, group))
+
+    async def _tick(self, channel_layer, group):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            del self._ticks[group]
+            events = list(self._pending.pop(group, {}).values())
+        for event in events:
+            ephemeral_events.inc(kind=event['kind'], action='sent')
+        try:
+            with channel_layer_seconds.time(operation='group_send'):
+                await channel_layer.group_send(group, {'type': 'ephemeral_batch', 'events': events})
+        except Exception:
+            # Потеря пачки эфемерных событий безвредна: следующая придёт через тик
+            logger.exception("Не удалось отправить эфемерные события группы %s", group)
+
+
+ephemeral_coalescer = EphemeralCoalescer(window=settings.CHAT_EPHEMERAL['window'])
@@ -0,0 +1,167 @@
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Маркер "кэш комнаты прогревается": пока он стоит первым, список не отдаётся читателям
+WARMING = '__warming__'
+WARMING_TTL = 10
+
+_BEGIN_WARM = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Дописывает сообщение в уже прогретый список; при обрезке истории снимает флаг полноты
+_APPEND = """
+local length = redis.call('RPUSHX', KEYS[1], ARGV[1])
+if length > tonumber(ARGV[2]) then
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+    redis.call('DEL', KEYS[2])
+end
+return length
+"""
+
+
+class HistoryCache:
+    """Ограниченный список последних отрендеренных сообщений комнаты в Redis.
+
+    Сообщения хранятся JSON-строками в хронологическом порядке, как их
+    отдаёт ChatConsumer. Ошибки Redis не пробрасываются: вызывающий код
+    просто идёт в Postgres.
+    """
+
+    def __init__(self, size=50, ttl=86400):
+        self.size = size
+        self.ttl = ttl
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+
+    @staticmethod
+    def key(room_id):
+        return f'chat:history:{room_id}'
+
+    @staticmethod
+    def complete_key(room_id):
+        # Флаг "в списке вся история комнаты" — тогда грузить раньше нечего
+        return f'chat:history:{room_id}:complete'
+
+    async def get(self, room_id):
+        """(сообщения, has_more) из кэша или None, если кэш пуст или ещё прогревается."""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.lrange(self.key(room_id), 0, -1)
+                pipe.exists(self.complete_key(room_id))
+                items, complete = await pipe.execute()
+        except redis.RedisError:
+            logger.exception("Кэш истории недоступен (комната %s)", room_id)
+            return None
+        if not items or items[0] == WARMING:
+            return None
+        return [json.loads(item) for item in items], not complete
+
+    async def begin_warm(self, room_id):
+        """Ставит маркер прогрева; True, если прогревать должен именно этот вызов."""
+        try:
+            return bool(await self.client.eval(_BEGIN_WARM, 1, self.key(room_id), WARMING, WARMING_TTL))
+        except redis.RedisError:
+            logger.exception("Кэш истории недоступен (комната %s)", room_id)
+            return False
+
+    async def finish_warm(self, room_id, messages, has_more):
+        """Заменяет маркер прогрева страницей из БД.
+
+        Сообщения, дописанные в список во время прогрева, сохраняются (без
+        дублей). Если прогрев был отменён правкой или удалением, ничего не пишет.
+        """
+        last_id = messages[-1]['id'] if messages else 0
+
+        def rebuild(items):
+            if not items or items[0] != WARMING:
+                return None
+            appended = [item for item in items[1:] if json.loads(item)['id'] > last_id]
+            return [json.dumps(message) for message in messages] + appended
+
+        await self._rewrite(room_id, rebuild, complete=not has_more)
+
+    async def append(self, room_id, message):
+        try:
+            # RPUSHX: не создаём неполный список для непрогретой комнаты
+            await self.client.eval(_APPEND, 2, self.key(room_id), self.complete_key(room_id),
+                                   json.dumps(message), self.size)
+        except redis.RedisError:
+            logger.exception("Не удалось дописать сообщение в кэш истории (комната %s)", room_id)
+
+    async def update(self, room_id, message_id, **changes):
+        def apply(items):
+            if items and items[0] == WARMING:
+                return []  # прогрев мог прочитать старую версию — отменяем его
+            result = []
+            for item in items:
+                message = json.loads(item)
+                if message['id'] == message_id:
+                    item = json.dumps({**message, **changes})
+                result.append(item)
+            return result
+
+        await self._rewrite(room_id, apply)
+
+    async def remove(self, room_id, message_id):
+        def apply(items):
+            if items and items[0] == WARMING:
+                return []
+            return [item for item in items if json.loads(item)['id'] != message_id]
+
+        await self._rewrite(room_id, apply)
+
+    async def _rewrite(self, room_id, fn, complete=None):
+        """Оптимистично (WATCH/MULTI) переписывает список результатом fn(items).
+
+        fn возвращает None, если менять ничего не нужно, и пустой список, чтобы
+        сбросить кэш комнаты. complete, если задан, выставляет флаг полноты.
+        """
+        key = self.key(room_id)
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                while True:
+                    try:
+                        await pipe.watch(key)
+                        items = await pipe.lrange(key, 0, -1)
+                        if not items:
+                            await pipe.unwatch()
+                            return
+                        new_items = fn(items)
+                        if new_items is None:
+                            await pipe.unwatch()
+                            return
+                        pipe.multi()
+                        pipe.delete(key)
+                        if new_items:
+                            pipe.rpush(key, *new_items)
+                            pipe.ltrim(key, -self.size, -1)
+                            pipe.expire(key, self.ttl)
+                            if complete is not None and len(new_items) > self.size:
+                                complete = False
+                            if complete:
+                                pipe.set(self.complete_key(room_id), 1, ex=self.ttl)
+                            elif complete is not None:
+                                pipe.delete(self.complete_key(room_id))
+                        else:
+                            pipe.delete(self.complete_key(room_id))
+                        await pipe.execute()
+                        return
+                    except redis.WatchError:
+                        continue
+        except redis.RedisError:
+            logger.exception("Не удалось обновить кэш истории (комната %s)", room_id)
+
+
+history_cache = HistoryCache(**settings.CHAT_HISTORY_CACHE)
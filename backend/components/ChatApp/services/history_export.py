@@ -0,0 +1,126 @@
+import datetime
+import gzip
+import itertools
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from components.ChatApp.models import ArchivedSegment
+from components.ChatApp.services import attachments
+from components.ChatApp.services.message_archive import get_archive_storage
+
+
+# Выгрузка истории комнаты в NDJSON: одна строка — одно сообщение, в порядке id.
+# Сначала идут архивные сегменты, затем живые партиции; и те и другие читаются
+# потоком (gzip-сегменты построчно, партиции — серверным курсором), так что память
+# не зависит от размера комнаты.
+
+
+def export_batches(room_id, after_id=None, before_id=None, since=None, until=None, compress=False):
+    """Генератор кусков выгрузки (bytes) по CHAT_EXPORT['batch_size'] сообщений.
+
+    after_id/before_id и since/until — исключающие и [since, until) границы,
+    для инкрементальной выгрузки достаточно передать after_id последней строки
+    предыдущей. При compress куски образуют один gzip-поток.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    usernames = {}
+    bounds = (after_id, before_id, since, until)
+    for batch in itertools.chain(_archived_batches(room_id, *bounds), _live_batches(room_id, *bounds)):
+        data = _encode(batch, usernames)
+        if compressor is not None:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+async def aiter_batches(batches):
+    """Асинхронный итератор над export_batches для StreamingHttpResponse под ASGI.
+
+    Куски вычисляются в потоке БД запроса; синхронный итератор StreamingHttpResponse
+    под ASGI сначала собрал бы всю выгрузку в список.
+    """
+    next_batch = sync_to_async(next)
+    try:
+        while (chunk := await next_batch(batches, None)) is not None:
+            yield chunk
+    finally:
+        # Серверный курсор закрывается в том же потоке, где открыт (и при обрыве клиента)
+        await sync_to_async(batches.close)()
+
+
+def _archived_batches(room_id, after_id, before_id, since, until):
+    segments = ArchivedSegment.objects.filter(room_id=room_id)
+    if after_id is not None:
+        segments = segments.filter(max_id__gt=after_id)
+    if before_id is not None:
+        segments = segments.filter(min_id__lt=before_id)
+    if since is not None:
+        segments = segments.filter(month__gte=since.date().replace(day=1))
+    if until is not None:
+        segments = segments.filter(month__lte=until.date())
+    batch = []
+    for path in segments.order_by('min_id').values_list('path', flat=True):
+        with get_archive_storage().open(path, 'rb') as raw, gzip.GzipFile(fileobj=raw) as segment:
+            for line in segment:
+                message = json.loads(line)
+                if after_id is not None and message['id'] <= after_id:
+                    continue
+                if before_id is not None and message['id'] >= before_id:
+                    continue
+                if since is not None or until is not None:
+                    timestamp = datetime.datetime.fromisoformat(message['timestamp'])
+                    if since is not None and timestamp < since or until is not None and timestamp >= until:
+                        continue
+                batch.append((message['id'], message['user_id'], message['content'],
+                              message['timestamp'], message['edited']))
+                if len(batch) == settings.CHAT_EXPORT['batch_size']:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def _live_batches(room_id, after_id, before_id, since, until):
+    conditions, params = ['room_id = %s'], [room_id]
+    for condition, value in (('id > %s', after_id), ('id < %s', before_id),
+                             ('"timestamp" >= %s', since), ('"timestamp" < %s', until)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    # Именованный курсор: строки приходят пачками по мере отправки, а не целиком
+    with connection.chunked_cursor() as cursor:
+        cursor.execute('SELECT id, user_id, content, "timestamp", edited FROM "ChatApp_db_message" '
+                       'WHERE ' + ' AND '.join(conditions) + ' ORDER BY id', params)
+        while batch := cursor.fetchmany(settings.CHAT_EXPORT['batch_size']):
+            yield [(message_id, user_id, content, timestamp.isoformat(), edited)
+                   for message_id, user_id, content, timestamp, edited in batch]
+
+
+def _encode(batch, usernames):
+    unknown = {row[1] for row in batch} - usernames.keys()
+    if unknown:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, username FROM "auth_user" WHERE id = ANY(%s)', [list(unknown)])
+            usernames.update(cursor.fetchall())
+    message_attachments = attachments.for_messages([row[0] for row in batch])
+    lines = []
+    for message_id, user_id, content, timestamp, edited in batch:
+        message = {
+            'id': message_id,
+            'user_id': user_id,
+            'user': usernames.get(user_id),
+            'content': content,
+            'timestamp': timestamp,
+            'edited': bool(edited),
+        }
+        if message_id in message_attachments:
+            message['attachments'] = [attachments.sign(item) for item in message_attachments[message_id]]
+        lines.append(json.dumps(message, ensure_ascii=False))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+import redis.asyncio as aioredis
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from config.metrics import registry
+from components.ChatApp.models import Room_users
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'membership:invalidate'
+
+
+class MembershipCache:
+    """Процессный LRU+TTL кэш участников комнат: room_id -> frozenset(user_id).
+
+    Проверка доступа на connect и на каждую команду чата обходится без
+    запроса к БД. Любое изменение Room_users сбрасывает комнату локально и
+    рассылает инвалидацию остальным воркерам через Redis pub/sub, как у
+    кэша профилей; пропущенную инвалидацию покрывает TTL.
+    """
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # room_id -> (expires_at, frozenset(user_id))
+        self._versions = {}  # room_id -> число инвалидаций; защищает от записи устаревшей выборки
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, room_id):
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[room_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(room_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, room_id, members, version=None):
+        with self._lock:
+            if version is not None and self._versions.get(room_id, 0) != version:
+                return  # пока шла выборка, состав комнаты изменился
+            self._entries[room_id] = (time.monotonic() + self.ttl, frozenset(members))
+            self._entries.move_to_end(room_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, room_id):
+        with self._lock:
+            self._entries.pop(room_id, None)
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+
+    async def is_member(self, room_id, user_id):
+        if user_id is None:
+            return False
+        try:
+            room_id = int(room_id)
+        except (TypeError, ValueError):
+            return False
+        members = self.get(room_id)
+        if members is None:
+            version = self._versions.get(room_id, 0)
+            members = await self._load(room_id)
+            self.set(room_id, members, version)
+        return user_id in members
+
+    @staticmethod
+    @database_sync_to_async
+    def _load(room_id):
+        return frozenset(Room_users.objects.filter(room_id=room_id).values_list('user_id', flat=True))
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def collect_metrics(self):
+        stats = self.stats()
+        return [
+            ('membership_cache_size', 'gauge', 'Комнат в кэше участников.', {(): stats['size']}),
+            ('membership_cache_hits_total', 'counter', 'Попадания в кэш участников.', {(): stats['hits']}),
+            ('membership_cache_misses_total', 'counter', 'Промахи кэша участников.', {(): stats['misses']}),
+        ]
+
+    def publish_invalidation(self, room_id):
+        """Сбрасывает комнату локально и рассылает инвалидацию остальным воркерам."""
+        self.invalidate(int(room_id))
+        try:
+            client = redis.StrictRedis(**settings.REDIS_CONFIG)
+            client.publish(INVALIDATION_CHANNEL, str(room_id))
+        except redis.RedisError:
+            logger.exception("Не удалось опубликовать инвалидацию участников комнаты %s", room_id)
+
+    def start_listener(self):
+        """Запускает (один раз на event loop) подписку на инвалидации из Redis."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.invalidate(int(message['data']))
+            except (redis.RedisError, OSError):
+                logger.warning("Подписка на инвалидации участников потеряна, переподключение")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+def add_members(room, usernames):
+    """Добавляет пользователей в комнату одним bulk_create.
+
+    Возвращает (добавленные, уже состоявшие, не найденные) имена.
+    """
+    usernames = set(usernames)
+    users = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    with transaction.atomic():
+        existing = set(Room_users.objects.filter(room=room, user_id__in=users.values())
+                       .values_list('user__username', flat=True))
+        added = sorted(set(users) - existing)
+        Room_users.objects.bulk_create([Room_users(room=room, user_id=users[username]) for username in added],
+                                       ignore_conflicts=True)
+    if added:
+        membership_cache.publish_invalidation(room.id)
+    return added, sorted(existing), sorted(usernames - set(users))
+
+
+def remove_members(room_id, user_ids):
+    """Удаляет пользователей из комнаты одним DELETE и закрывает их сокеты; возвращает id удалённых."""
+    with transaction.atomic():
+        removed = list(Room_users.objects.filter(room_id=room_id, user_id__in=user_ids)
+                       .values_list('user_id', flat=True))
+        Room_users.objects.filter(room_id=room_id, user_id__in=removed).delete()
+    if removed:
+        membership_cache.publish_invalidation(room_id)
+        # Открытые сокеты удалённых закрываются сразу; на остальных воркерах
+        # их следующую команду всё равно отсечёт проверка членства
+        async_to_sync(get_channel_layer().group_send)(str(room_id), {'type': 'members_removed', 'user_ids': removed})
+    return removed
+
+
+membership_cache = MembershipCache(**settings.CHAT_MEMBERSHIP_CACHE)
+registry.add_collector(membership_cache.collect_metrics)
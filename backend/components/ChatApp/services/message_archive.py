@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import datetime
+import gzip
+import io
+import json
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from functools import lru_cache
+
+import redis
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+from components.ChatApp.models import ArchivedSegment
+from components.ChatApp.services import chat_queries
+from components.ChatApp.services.partitions import drop_partition, partition_name
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'archive:invalidate'
+
+@lru_cache(maxsize=None)
+def get_archive_storage():
+    """Хранилище сегментов (Django storage API: локальная ФС или S3-совместимое)."""
+    return import_string(settings.CHAT_ARCHIVE['storage'])(**settings.CHAT_ARCHIVE['options'])
+
+
+def segment_path(month, room_id):
+    return f"{settings.CHAT_ARCHIVE['prefix']}/{month:%Y-%m}/room-{room_id}.ndjson.gz"
+
+
+def archive_partition(month):
+    """Выгружает партицию месяца в сжатые NDJSON-сегменты (по файлу на комнату) и удаляет её.
+
+    Строки читаются серверным курсором, отсортированными по (room_id, id), так что
+    в памяти держится только текущий сегмент во временном файле. Возвращает число
+    записанных сегментов.
+    """
+    storage = get_archive_storage()
+    segments = []
+    with transaction.atomic():
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(f'SELECT id, room_id, user_id, content, "timestamp", edited '
+                           f'FROM "{partition_name(month)}" ORDER BY room_id, id')
+            writer = None
+            for message_id, room_id, user_id, content, timestamp, edited in cursor:
+                if writer is None or writer.room_id != room_id:
+                    if writer is not None:
+                        segments.append(writer.save(storage))
+                    writer = _SegmentWriter(month, room_id)
+                writer.write(message_id, user_id, content, timestamp, edited)
+            if writer is not None:
+                segments.append(writer.save(storage))
+        ArchivedSegment.objects.bulk_create(segments)
+        drop_partition(month)
+    archive_index.publish_invalidation()
+    return len(segments)
+
+
+class _SegmentWriter:
+    def __init__(self, month, room_id):
+        self.month = month
+        self.room_id = room_id
+        self.min_id = None
+        self.max_id = None
+        self.count = 0
+        self.file = tempfile.TemporaryFile()
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode='wb')
+
+    def write(self, message_id, user_id, content, timestamp, edited):
+        if self.min_id is None:
+            self.min_id = message_id
+        self.max_id = message_id
+        self.count += 1
+        line = json.dumps({'id': message_id, 'user_id': user_id, 'content': content,
+                           'timestamp': timestamp.isoformat(), 'edited': edited}, ensure_ascii=False)
+        self.gzip.write(line.encode('utf-8') + b'\n')
+
+    def save(self, storage):
+        self.gzip.close()
+        self.file.seek(0)
+        path = segment_path(self.month, self.room_id)
+        if storage.exists(path):
+            storage.delete(path)  # повторный прогон после сбоя
+        storage.save(path, File(self.file))
+        self.file.close()
+        return ArchivedSegment(room_id=self.room_id, month=self.month, min_id=self.min_id, max_id=self.max_id,
+                               message_count=self.count, path=path)
+
+
+Segment = namedtuple('Segment', 'min_id max_id path')
+
+
+class ArchiveIndex:
+    """Процессный LRU+TTL кэш архивных сегментов комнат: room_id -> (Segment, ...) по убыванию max_id.
+
+    Короткая страница истории (комната целиком помещается в живые партиции)
+    не ходит в ArchivedSegment: для большинства комнат здесь лежит пустой
+    кортеж. После архивации партиции индекс сбрасывается на всех воркерах
+    через Redis pub/sub, как у MembershipCache: иначе до истечения ttl
+    страница упиралась бы в удалённую партицию и не находила её сегментов.
+    ttl остаётся страховкой на случай потерянной инвалидации.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # room_id -> (expires_at, сегменты)
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, room_id):
+        with self._lock:
+            entry = self._entries.get(room_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(room_id)
+            return entry[1]
+
+    def load(self, room_id):
+        """Сегменты комнаты из БД (синхронно, в потоке БД); результат кладётся в кэш."""
+        segments = tuple(Segment(*row) for row in ArchivedSegment.objects.filter(room_id=room_id)
+                         .order_by('-max_id').values_list('min_id', 'max_id', 'path'))
+        with self._lock:
+            self._entries[room_id] = (time.monotonic() + self.ttl, segments)
+            self._entries.move_to_end(room_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return segments
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def publish_invalidation(self):
+        """Сбрасывает индекс локально и рассылает инвалидацию остальным воркерам."""
+        self.clear()
+        try:
+            client = redis.StrictRedis(**settings.REDIS_CONFIG)
+            client.publish(INVALIDATION_CHANNEL, 'all')
+        except redis.RedisError:
+            logger.exception("Не удалось опубликовать инвалидацию индекса архива")
+
+    def start_listener(self):
+        """Запускает (один раз на event loop) подписку на инвалидации из Redis."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.clear()
+            except (redis.RedisError, OSError):
+                logger.warning("Подписка на инвалидации индекса архива потеряна, переподключение")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+class SegmentCache:
+    """Сжатые сегменты в памяти воркера, LRU с ограничением по суммарному размеру в байтах.
+
+    Сегменты больше max_item_bytes не кэшируются и каждый раз читаются из
+    хранилища потоком.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes // 4
+        self.size = 0
+        self._entries = OrderedDict()  # path -> bytes
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            data = self._entries.get(path)
+            if data is not None:
+                self._entries.move_to_end(path)
+            return data
+
+    def put(self, path, data):
+        with self._lock:
+            if path in self._entries:
+                return
+            self._entries[path] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _path, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+@contextlib.contextmanager
+def _open_segment(path):
+    """Распакованный поток сегмента: из кэша воркера или прямо из хранилища."""
+    data = segment_cache.get(path)
+    if data is None:
+        with get_archive_storage().open(path, 'rb') as raw:
+            if raw.size > segment_cache.max_item_bytes:
+                with gzip.GzipFile(fileobj=raw) as segment:
+                    yield segment
+                return
+            data = raw.read()
+        segment_cache.put(path, data)
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as segment:
+        yield segment
+
+
+def _segment_tail(path, before_id, limit):
+    """Последние limit сообщений сегмента с id < before_id; в памяти не больше limit строк."""
+    tail = deque(maxlen=limit)
+    with _open_segment(path) as segment:
+        for line in segment:
+            message = json.loads(line)
+            if before_id is not None and message['id'] >= before_id:
+                break  # строки сегмента упорядочены по id
+            tail.append(message)
+    return list(tail)
+
+
+def _collect(segments, before_id, limit):
+    messages = []
+    for segment in segments:
+        messages = _segment_tail(segment.path, before_id, limit - len(messages)) + messages
+        if len(messages) == limit:
+            break
+    return messages
+
+
+def _hydrate(room_id, messages):
+    user_ids = list({message['user_id'] for message in messages})
+    with connection.cursor() as cursor:
+        cursor.execute(chat_queries.PROFILES, [user_ids])
+        authors = {user_id: author for user_id, *author in cursor.fetchall()}
+    rows = []
+    for message in messages:
+        username, picture, avatar_id = authors.get(message['user_id'], (None, None, None))
+        rows.append((message['id'], message['content'], datetime.datetime.fromisoformat(message['timestamp']),
+                     room_id, message['user_id'], message['edited'], username, picture, avatar_id))
+    return rows
+
+
+async def read_messages(room_id, before_id, limit):
+    """До limit архивных сообщений комнаты с id < before_id, в хронологическом порядке.
+
+    Строки того же вида, что и у ChatRepository.get_messages:
+    (id, content, timestamp, room_id, user_id, edited, username, profile_picture, avatar_id).
+    Список сегментов берётся из archive_index, файлы читаются вне потока БД.
+    """
+    room_id = int(room_id)
+    segments = archive_index.get(room_id)
+    if segments is None:
+        segments = await database_sync_to_async(archive_index.load)(room_id)
+    segments = [segment for segment in segments if before_id is None or segment.min_id < before_id]
+    if not segments:
+        return []
+    messages = await sync_to_async(_collect, thread_sensitive=False)(segments, before_id, limit)
+    if not messages:
+        return []
+    return await database_sync_to_async(_hydrate)(room_id, messages)
+
+
+archive_index = ArchiveIndex(**settings.CHAT_ARCHIVE['index'])
+segment_cache = SegmentCache(settings.CHAT_ARCHIVE['segment_cache_bytes'])
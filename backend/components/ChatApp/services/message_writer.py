@@ -0,0 +1,233 @@
+import asyncio
+import atexit
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, connection, transaction
+
+from config.lifespan import on_shutdown
+from config.metrics import registry
+from components.ChatApp.services.room_summary import record_messages
+
+
+logger = logging.getLogger(__name__)
+
+# Строки, которые Postgres отверг (например, комната уже удалена): JSON для ручного разбора
+DEAD_LETTER_KEY = 'chat:write_behind:dead_letter'
+
+
+class QueueFull(Exception):
+    """Очередь отложенной записи заполнена: сообщение не принято."""
+
+
+class MessageWriter:
+    """Отложенная (write-behind) запись сообщений чата пачками.
+
+    id сообщения берётся из sequence таблицы в момент постановки в очередь
+    (nextval на каждое сообщение), поэтому порядок id совпадает с порядком
+    отправки, сообщение можно разослать сразу, а INSERT выполнить позже —
+    одним многострочным запросом на batch_size строк или раз в flush_interval
+    секунд. Одна очередь на воркер; при max_pending новые сообщения
+    отклоняются. Остаток сбрасывается при отключении клиента и остановке
+    воркера (ASGI lifespan, в крайнем случае atexit).
+    """
+
+    def __init__(self, enabled=False, batch_size=200, flush_interval=0.05, max_pending=10000):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+        self._pending = []  # (id, content, timestamp, user_id, room_id)
+        self._id_waiters = []  # futures вызовов next_id в порядке поступления
+        self._id_task = None
+        self._task = None
+        self._loop = None  # event loop, к которому привязаны _wake и _flush_lock
+        self._wake = None
+        self._flush_lock = None
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+        self.dead_letters = 0
+        atexit.register(self._flush_on_exit)
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'queue_depth': self.depth,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'dead_letters': self.dead_letters,
+        }
+
+    def collect_metrics(self):
+        return [
+            ('chat_write_behind_queue_depth', 'gauge', 'Сообщений в очереди отложенной записи.', {(): self.depth}),
+            ('chat_write_behind_flushed_total', 'counter', 'Записано сообщений отложенной записью.',
+             {(): self.flushed}),
+            ('chat_write_behind_failures_total', 'counter', 'Неудачные сбросы очереди.', {(): self.failures}),
+            ('chat_write_behind_rejected_total', 'counter', 'Сообщений отклонено при полной очереди.',
+             {(): self.rejected}),
+            ('chat_write_behind_dead_letters_total', 'counter', 'Строк, отвергнутых Postgres.',
+             {(): self.dead_letters}),
+        ]
+
+    async def next_id(self):
+        """id нового сообщения.
+
+        Одновременные вызовы воркера склеиваются в один запрос к sequence и
+        получают id по возрастанию в порядке вызова.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._id_waiters.append(future)
+        if self._id_task is None or self._id_task.done():
+            self._id_task = asyncio.get_running_loop().create_task(self._fetch_ids())
+        return await future
+
+    async def _fetch_ids(self):
+        while self._id_waiters:
+            waiters, self._id_waiters = self._id_waiters, []
+            try:
+                ids = await self._reserve_ids(len(waiters))
+            except DatabaseError as error:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+                continue
+            for waiter, message_id in zip(waiters, ids):
+                if not waiter.done():  # вызвавший мог отключиться, id просто пропадёт
+                    waiter.set_result(message_id)
+
+    async def submit(self, message_id, content, timestamp, user_id, room_id):
+        """Ставит сообщение в очередь; QueueFull, если Postgres не успевает и очередь заполнена."""
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull
+        self._ensure_task()
+        self._pending.append((message_id, content, timestamp, user_id, room_id))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        """Записывает всё накопленное.
+
+        Если БД недоступна, строки остаются в очереди до следующего сброса.
+        Пачку, которую Postgres отвергает, делит пополам, пока не найдёт
+        виноватые строки; они уходят в dead letter, остальные записываются.
+        """
+        if not self._pending:
+            return
+        self._ensure_task()
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                try:
+                    written = await self._write(batch)
+                except (OperationalError, InterfaceError):
+                    self.failures += 1
+                    logger.exception("Не удалось записать пачку из %s сообщений", len(batch))
+                    return
+                del self._pending[:len(batch)]
+                self.flushed += written
+                self.batches += 1
+
+    async def _write(self, rows):
+        """Число записанных строк; отвергнутые Postgres строки уходят в dead letter."""
+        try:
+            await self._insert(rows)
+            return len(rows)
+        except (OperationalError, InterfaceError):
+            raise
+        except DatabaseError:
+            if len(rows) == 1:
+                await self._dead_letter(rows[0])
+                return 0
+            # Уже записанные половины при повторе отсекает ON CONFLICT
+            middle = len(rows) // 2
+            return await self._write(rows[:middle]) + await self._write(rows[middle:])
+
+    async def _dead_letter(self, row):
+        self.dead_letters += 1
+        message_id, content, timestamp, user_id, room_id = row
+        entry = json.dumps({'id': message_id, 'content': content, 'timestamp': timestamp.isoformat(),
+                            'user_id': user_id, 'room_id': room_id})
+        logger.error("Сообщение %s отвергнуто Postgres и отложено в %s", message_id, DEAD_LETTER_KEY,
+                     exc_info=True)
+        try:
+            await self.client.rpush(DEAD_LETTER_KEY, entry)
+        except redis.RedisError:
+            logger.exception("Потеряно сообщение %s: %s", message_id, entry)
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Один раз на loop: если фоновая задача упала, идущий flush может держать
+            # блокировку, и новая блокировка пустила бы второй flush по той же пачке
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _flush_on_exit(self):
+        # Запасной путь без lifespan: event loop уже остановлен, поэтому пишем синхронно
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            try:
+                self._insert_rows(batch)
+            except DatabaseError:
+                logger.exception("Потеряно %s сообщений при остановке воркера", len(self._pending))
+                return
+            del self._pending[:len(batch)]
+
+    @staticmethod
+    @database_sync_to_async
+    def _reserve_ids(count):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(\'"ChatApp_db_message"\', \'id\')) '
+                           'FROM generate_series(1, %s) ORDER BY 1', [count])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def _insert_rows(rows):
+        values = ', '.join(['(%s, %s, %s, %s, %s, FALSE)'] * len(rows))
+        params = [value for row in rows for value in row]
+        with transaction.atomic(), connection.cursor() as cursor:
+            # ON CONFLICT: повтор пачки после обрыва соединения не создаёт дублей
+            cursor.execute('INSERT INTO "ChatApp_db_message" (id, content, timestamp, user_id, room_id, edited) '
+                           'VALUES ' + values + ' ON CONFLICT DO NOTHING '
+                           'RETURNING id, content, timestamp, user_id, room_id', params)
+            # В сводках учитываются только реально вставленные строки
+            inserted = cursor.fetchall()
+            if inserted:
+                record_messages(cursor, inserted)
+
+    @staticmethod
+    @database_sync_to_async
+    def _insert(rows):
+        MessageWriter._insert_rows(rows)
+
+
+message_writer = MessageWriter(**settings.CHAT_WRITE_BEHIND)
+registry.add_collector(message_writer.collect_metrics)
+on_shutdown(message_writer.flush)
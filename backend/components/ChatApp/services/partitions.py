@@ -0,0 +1,61 @@
+import datetime
+
+from django.db import connection, transaction
+
+
+TABLE = 'ChatApp_db_message'
+DEFAULT_PARTITION = f'{TABLE}_default'
+COLUMNS = 'id, content, "timestamp", edited, user_id, room_id'
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def list_partitions():
+    """Месяцы, для которых существуют партиции сообщений (без партиции по умолчанию)."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT child.relname FROM pg_inherits '
+                       'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                       'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                       'WHERE parent.relname = %s', [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f'{TABLE}_p'
+    return sorted(datetime.datetime.strptime(name[len(prefix):], '%Y%m').date()
+                  for name in names if name.startswith(prefix))
+
+
+@transaction.atomic
+def create_partition(month):
+    """Создаёт партицию месяца; строки этого месяца из партиции по умолчанию переносятся в неё.
+
+    Возвращает False, если партиция уже есть.
+    """
+    if month in list_partitions():
+        return False
+    bounds = [month, add_months(month, 1)]
+    with connection.cursor() as cursor:
+        # Postgres не даст создать партицию, пока в DEFAULT есть строки из её диапазона
+        cursor.execute(f'CREATE TEMP TABLE moved_messages ON COMMIT DROP AS '
+                       f'SELECT {COLUMNS} FROM "{DEFAULT_PARTITION}" WHERE "timestamp" >= %s AND "timestamp" < %s',
+                       bounds)
+        cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE "timestamp" >= %s AND "timestamp" < %s', bounds)
+        cursor.execute(f'CREATE TABLE "{partition_name(month)}" PARTITION OF "{TABLE}" '
+                       f'FOR VALUES FROM (%s) TO (%s)', bounds)
+        cursor.execute(f'INSERT INTO "{TABLE}" ({COLUMNS}) SELECT {COLUMNS} FROM moved_messages')
+    return True
+
+
+def drop_partition(month):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{partition_name(month)}"')
+        cursor.execute(f'DROP TABLE "{partition_name(month)}"')
@@ -0,0 +1,116 @@
+import logging
+import time
+from collections import OrderedDict
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Токен-бакет в Redis-хэше: {tokens, updated}; возвращает 0 или сколько секунд ждать токена
+_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# Возврат токена, списанного _TAKE: не больше burst; истёкший бакет и так полон
+_REFUND = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + 1))
+end
+"""
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate, burst, now):
+        """Забирает токен; 0 при успехе, иначе сколько секунд ждать следующего."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / rate
+
+    def refund(self, burst):
+        self.tokens = min(burst, self.tokens + 1)
+
+
+class RateLimiter:
+    """Ограничение частоты команд по токен-бакетам (на пользователя и на комнату).
+
+    По умолчанию бакеты живут в памяти воркера, то есть лимит действует на
+    каждый воркер отдельно. В режиме shared бакеты хранятся в Redis и общие
+    для всех воркеров; если Redis недоступен, проверка идёт по локальным.
+    """
+
+    def __init__(self, limits, shared=False, max_buckets=100000):
+        self.limits = limits  # {scope: {'rate': токенов в секунду, 'burst': ёмкость}}
+        self.shared = shared
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True) if shared else None
+
+    async def check(self, scope, key):
+        """0, если команду можно выполнить, иначе рекомендуемая пауза в секундах."""
+        limit = self.limits.get(scope)
+        if not limit:
+            return 0
+        now = time.time()
+        if self.shared:
+            try:
+                return float(await self.client.eval(_TAKE, 1, f'ratelimit:{scope}:{key}',
+                                                    limit['rate'], limit['burst'], now))
+            except redis.RedisError:
+                logger.exception("Общие лимиты недоступны, проверяем локально")
+        return self._take_local(scope, key, limit, now)
+
+    async def refund(self, scope, key):
+        """Возвращает токен, списанный check (команду отклонил другой лимит)."""
+        limit = self.limits.get(scope)
+        if not limit:
+            return
+        if self.shared:
+            try:
+                await self.client.eval(_REFUND, 1, f'ratelimit:{scope}:{key}', limit['burst'])
+                return
+            except redis.RedisError:
+                logger.exception("Общие лимиты недоступны, возвращаем локально")
+        bucket = self._buckets.get((scope, key))
+        if bucket is not None:
+            bucket.refund(limit['burst'])
+
+    def _take_local(self, scope, key, limit, now):
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = TokenBucket(limit['burst'], now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end((scope, key))
+        return bucket.take(limit['rate'], limit['burst'], now)
+
+
+rate_limiter = RateLimiter(**settings.CHAT_RATE_LIMIT)
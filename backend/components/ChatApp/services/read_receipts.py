@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+
+import redis
+import redis.asyncio as aioredis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from config.metrics import registry
+from components.ChatApp.models import RoomSummary
+
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = 'chat:read:dirty'
+# Пары, взятые воркером на запись: score — время захвата
+PROCESSING_KEY = 'chat:read:processing'
+
+# Двигает позицию прочтения только вперёд, не дальше последнего сообщения комнаты,
+# и помечает её к записи в Postgres. -1 — последний id комнаты в Redis неизвестен.
+_ADVANCE = """
+local latest = redis.call('GET', KEYS[3])
+if not latest then
+    return -1
+end
+local position = math.min(tonumber(ARGV[2]), tonumber(latest))
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if position <= current then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], position)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SADD', KEYS[2], ARGV[4])
+return position
+"""
+
+# Последний id сообщения комнаты только растёт
+_RECORD_LATEST = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+# Забирает пачку пар на запись. Пары, которые другой воркер взял раньше
+# ARGV[3] и так и не подтвердил (упал), сначала возвращаются в очередь.
+_CLAIM = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+for _, member in ipairs(stale) do
+    redis.call('SADD', KEYS[1], member)
+end
+if #stale > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+end
+local members = redis.call('SPOP', KEYS[1], ARGV[1])
+for _, member in ipairs(members) do
+    redis.call('ZADD', KEYS[2], ARGV[2], member)
+end
+return members
+"""
+
+# Снимает свой захват (score совпадает с ARGV[1]); при ARGV[2] = 1 возвращает пары в очередь
+_ACK = """
+for i = 3, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[2], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[1]) then
+        redis.call('ZREM', KEYS[2], ARGV[i])
+        if ARGV[2] == '1' then
+            redis.call('SADD', KEYS[1], ARGV[i])
+        end
+    end
+end
+"""
+
+
+class ReadReceipts:
+    """Позиции прочтения (id последнего прочитанного сообщения) по комнатам.
+
+    Актуальное значение живёт в Redis-хэше комнаты, в Room_users.last_read_id
+    оно попадает пачками раз в flush_interval секунд. Изменённые пары
+    (комната, пользователь) копятся в общем множестве. Воркер забирает пачку
+    в множество «в обработке» и снимает её оттуда только после записи в БД;
+    пары упавшего воркера через claim_timeout секунд возвращаются в очередь
+    и записываются повторно (запись идемпотентна).
+    """
+
+    def __init__(self, flush_interval=5.0, batch_size=500, ttl=7 * 86400, claim_timeout=60):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+        self._task = None
+        self.flushed = 0
+        self.failures = 0
+
+    @staticmethod
+    def key(room_id):
+        return f'chat:read:{room_id}'
+
+    @staticmethod
+    def latest_key(room_id):
+        return f'chat:read:latest:{room_id}'
+
+    def collect_metrics(self):
+        return [
+            ('chat_read_receipts_flushed_total', 'counter', 'Позиций прочтения записано в Postgres.',
+             {(): self.flushed}),
+            ('chat_read_receipts_failures_total', 'counter', 'Неудачные сбросы позиций прочтения.',
+             {(): self.failures}),
+        ]
+
+    async def record_message(self, room_id, message_id):
+        """Запоминает id нового сообщения комнаты: дальше него позиция прочтения не сдвигается."""
+        try:
+            await self.client.eval(_RECORD_LATEST, 1, self.latest_key(room_id), message_id, self.ttl)
+        except redis.RedisError:
+            logger.exception("Не удалось запомнить последнее сообщение (комната %s)", room_id)
+
+    async def advance(self, room_id, user_id, message_id):
+        """Новая позиция пользователя (не дальше последнего сообщения комнаты) или None, если она не сдвинулась."""
+        self._ensure_task()
+        try:
+            position = await self._advance(room_id, user_id, message_id)
+            if position == -1:
+                # Redis не знает последний id комнаты (ключ истёк) — берём его из сводки
+                latest = await self._latest_message_id(room_id)
+                if latest is None:
+                    return None
+                await self.record_message(room_id, latest)
+                position = await self._advance(room_id, user_id, message_id)
+        except redis.RedisError:
+            logger.exception("Не удалось сохранить позицию прочтения (комната %s)", room_id)
+            return None
+        return position if position > 0 else None
+
+    async def _advance(self, room_id, user_id, message_id):
+        return await self.client.eval(_ADVANCE, 3, self.key(room_id), DIRTY_KEY, self.latest_key(room_id),
+                                      user_id, message_id, self.ttl, f'{room_id}:{user_id}')
+
+    async def get(self, room_id):
+        """{user_id: last_read_id} для комнаты (только то, что есть в Redis)."""
+        try:
+            positions = await self.client.hgetall(self.key(room_id))
+        except redis.RedisError:
+            logger.exception("Позиции прочтения недоступны (комната %s)", room_id)
+            return {}
+        return {int(user_id): int(message_id) for user_id, message_id in positions.items()}
+
+    async def flush(self):
+        """Переносит изменённые позиции в Postgres; возвращает число записанных строк."""
+        claimed_at = time.time()
+        try:
+            members = await self.client.eval(_CLAIM, 2, DIRTY_KEY, PROCESSING_KEY, self.batch_size, claimed_at,
+                                             claimed_at - self.claim_timeout)
+            if not members:
+                return 0
+            async with self.client.pipeline(transaction=False) as pipe:
+                for member in members:
+                    room_id, user_id = member.split(':')
+                    pipe.hget(self.key(room_id), user_id)
+                positions = await pipe.execute()
+        except redis.RedisError:
+            logger.exception("Не удалось прочитать позиции прочтения из Redis")
+            return 0  # взятые пары вернутся в очередь через claim_timeout
+        rows = [(*map(int, member.split(':')), int(position))
+                for member, position in zip(members, positions) if position is not None]
+        try:
+            if rows:
+                await self._update(rows)
+        except DatabaseError:
+            self.failures += 1
+            logger.exception("Не удалось записать %s позиций прочтения", len(rows))
+            await self._ack(claimed_at, members, requeue=True)  # попробуем на следующем круге
+            return 0
+        await self._ack(claimed_at, members)
+        self.flushed += len(rows)
+        return len(rows)
+
+    async def _ack(self, claimed_at, members, requeue=False):
+        try:
+            await self.client.eval(_ACK, 2, DIRTY_KEY, PROCESSING_KEY, claimed_at, int(requeue), *members)
+        except redis.RedisError:
+            # Не страшно: захват истечёт и пары запишутся ещё раз
+            logger.exception("Не удалось подтвердить запись %s позиций прочтения", len(members))
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # Большой накопленный хвост разбираем без пауз
+            while await self.flush() >= self.batch_size:
+                pass
+
+    @staticmethod
+    @database_sync_to_async
+    def _latest_message_id(room_id):
+        return RoomSummary.objects.filter(room_id=room_id).values_list('last_message_id', flat=True).first()
+
+    @staticmethod
+    @database_sync_to_async
+    def _update(rows):
+        values = ', '.join(['(%s, %s, %s)'] * len(rows))
+        params = [value for row in rows for value in row]
+        with connection.cursor() as cursor:
+            # greatest: позиция в БД не откатывается, даже если ключ Redis истёк
+            cursor.execute('UPDATE "ChatApp_room_users" ru '
+                           'SET last_read_id = greatest(ru.last_read_id, v.last_read_id) '
+                           'FROM (VALUES ' + values + ') AS v(room_id, user_id, last_read_id) '
+                           'WHERE ru.room_id = v.room_id AND ru.user_id = v.user_id', params)
+
+
+read_receipts = ReadReceipts(**settings.CHAT_READ_RECEIPTS)
+registry.add_collector(read_receipts.collect_metrics)
@@ -0,0 +1,88 @@
+import json
+import logging
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Номер события и запись в журнал одной операцией: порядок в журнале совпадает с seq.
+# Истекает только журнал: счётчик живёт без TTL, иначе тихая комната начала бы
+# нумерацию заново и клиент со старым since_seq пропустил бы новые события.
+_PUBLISH = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, seq .. ':' .. ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+class RoomEventLog:
+    """Монотонные номера (seq) событий комнаты и ограниченный журнал последних событий.
+
+    Журнал — sorted set в Redis со score = seq, хранит последние size кадров.
+    Переподключившийся клиент присылает последний увиденный seq и получает
+    только пропущенные события; если журнал уже не покрывает разрыв
+    (или Redis потерял счётчик), возвращается None и клиенту отдаётся полная
+    страница истории.
+    """
+
+    def __init__(self, size=500, ttl=86400):
+        self.size = size
+        self.ttl = ttl
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+
+    @staticmethod
+    def seq_key(room_id):
+        return f'chat:seq:{room_id}'
+
+    @staticmethod
+    def log_key(room_id):
+        return f'chat:events:{room_id}'
+
+    async def publish(self, room_id, frame):
+        """Присваивает кадру следующий seq комнаты и пишет его в журнал; возвращает кадр с seq."""
+        try:
+            seq = await self.client.eval(_PUBLISH, 2, self.seq_key(room_id), self.log_key(room_id),
+                                         json.dumps(frame), self.size, self.ttl)
+        except redis.RedisError:
+            logger.exception("Журнал событий недоступен (комната %s)", room_id)
+            seq = None  # клиент с таким кадром при переподключении получит полную страницу
+        return {**frame, 'seq': seq}
+
+    async def current(self, room_id):
+        try:
+            return int(await self.client.get(self.seq_key(room_id)) or 0)
+        except redis.RedisError:
+            logger.exception("Журнал событий недоступен (комната %s)", room_id)
+            return None
+
+    async def since(self, room_id, since_seq):
+        """Кадры с seq > since_seq по порядку или None, если разрыв журналом не покрыт."""
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.get(self.seq_key(room_id))
+                pipe.zrange(self.log_key(room_id), 0, 0, withscores=True)
+                pipe.zrangebyscore(self.log_key(room_id), f'({since_seq}', '+inf')
+                current, oldest, entries = await pipe.execute()
+        except redis.RedisError:
+            logger.exception("Журнал событий недоступен (комната %s)", room_id)
+            return None
+        current = int(current or 0)
+        if since_seq > current:
+            return None  # счётчик сброшен — seq клиента ничего не значит
+        if since_seq == current:
+            return []
+        if not oldest or oldest[0][1] > since_seq + 1:
+            return None
+        events = []
+        for entry in entries:
+            seq, payload = entry.split(':', 1)
+            events.append({**json.loads(payload), 'seq': int(seq)})
+        return events
+
+
+room_events = RoomEventLog(**settings.CHAT_EVENT_LOG)
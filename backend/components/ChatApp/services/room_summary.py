@@ -0,0 +1,49 @@
+from components.ChatApp.models import SUMMARY_PREVIEW_LENGTH
+
+
+# Сводка комнаты (RoomSummary) правится тем же запросом, что и сообщения, поэтому
+# список чатов не пересчитывает последние сообщения и счётчики на чтении.
+
+SUMMARY_UPSERT = (
+    'ON CONFLICT (room_id) DO UPDATE SET '
+    'message_count = s.message_count + EXCLUDED.message_count, '
+    # При отложенной записи пачки могут прийти не по порядку id
+    'last_message = CASE WHEN EXCLUDED.last_message_id > coalesce(s.last_message_id, 0) '
+    '                    THEN EXCLUDED.last_message ELSE s.last_message END, '
+    'last_user_id = CASE WHEN EXCLUDED.last_message_id > coalesce(s.last_message_id, 0) '
+    '                    THEN EXCLUDED.last_user_id ELSE s.last_user_id END, '
+    'last_timestamp = CASE WHEN EXCLUDED.last_message_id > coalesce(s.last_message_id, 0) '
+    '                      THEN EXCLUDED.last_timestamp ELSE s.last_timestamp END, '
+    'last_message_id = greatest(EXCLUDED.last_message_id, s.last_message_id)'
+)
+
+
+def record_messages(cursor, rows):
+    """Учитывает в сводках пачку новых сообщений (id, content, timestamp, user_id, room_id)."""
+    rooms = {}
+    for row in rows:
+        count, last = rooms.get(row[4], (0, row))
+        rooms[row[4]] = (count + 1, row if row[0] >= last[0] else last)
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rooms))
+    params = []
+    for room_id, (count, (message_id, content, timestamp, user_id, _room_id)) in rooms.items():
+        params += [room_id, message_id, content[:SUMMARY_PREVIEW_LENGTH], user_id, timestamp, count]
+    cursor.execute('INSERT INTO "ChatApp_roomsummary" AS s '
+                   '(room_id, last_message_id, last_message, last_user_id, last_timestamp, message_count) '
+                   'VALUES ' + values + ' ' + SUMMARY_UPSERT, params)
+
+
+# (длина превью, room_id)
+REFRESH_LAST_MESSAGE = ('UPDATE "ChatApp_roomsummary" s SET '
+                        'last_message_id = m.id, last_message = coalesce(left(m.content, %s), \'\'), '
+                        'last_user_id = m.user_id, last_timestamp = m."timestamp" '
+                        'FROM (SELECT %s::bigint AS room_id) r LEFT JOIN LATERAL ('
+                        '    SELECT id, content, user_id, "timestamp" FROM "ChatApp_db_message" '
+                        '    WHERE room_id = r.room_id ORDER BY id DESC LIMIT 1'
+                        ') m ON TRUE '
+                        'WHERE s.room_id = r.room_id')
+
+
+def refresh_last_message(cursor, room_id):
+    """Пересчитывает последнее сообщение комнаты (после удаления текущего последнего)."""
+    cursor.execute(REFRESH_LAST_MESSAGE, [SUMMARY_PREVIEW_LENGTH, room_id])
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+import shutil
+import tempfile
+
+import redis.asyncio as aioredis
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.test import override_settings
+
+from components.ChatApp.models import ArchivedSegment, DB_Message
+from components.ChatApp.services import message_archive
+from components.ChatApp.services.message_archive import (INVALIDATION_CHANNEL, SegmentCache, archive_index,
+                                                         archive_partition, get_archive_storage, segment_cache)
+from components.ChatApp.services.partitions import create_partition
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+OLD_MONTHS = [datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)]
+
+
+class ArchiveReadTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        archive_settings = override_settings(CHAT_ARCHIVE={
+            **settings.CHAT_ARCHIVE,
+            'storage': 'django.core.files.storage.FileSystemStorage',
+            'options': {'location': location},
+        })
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        get_archive_storage.cache_clear()
+        self.addCleanup(get_archive_storage.cache_clear)
+
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        self.empty_room = self.create_room(self.user, name='empty')
+        for month in OLD_MONTHS:
+            create_partition(month)
+            messages = DB_Message.objects.bulk_create([
+                DB_Message(room=self.room, user=self.user, content=f'{month:%Y-%m} {index}') for index in range(30)
+            ])
+            DB_Message.objects.filter(id__in=[message.id for message in messages]).update(
+                timestamp=datetime.datetime.combine(month, datetime.time(12), datetime.timezone.utc))
+            archive_partition(month)
+        DB_Message.objects.bulk_create([
+            DB_Message(room=self.room, user=self.user, content=f'live {index}') for index in range(10)
+        ])
+
+    async def test_pages_continue_into_archived_segments(self):
+        communicator, page = await self.connect(self.user, self.room)
+        self.assertTrue(page['has_more'])
+        self.assertEqual([message['message'] for message in page['messages']],
+                         [f'2024-01 {index}' for index in range(20, 30)] +
+                         [f'2024-02 {index}' for index in range(30)] +
+                         [f'live {index}' for index in range(10)])
+        await communicator.send_json_to({'type': 'load_more', 'before_id': page['before_id']})
+        older = await communicator.receive_json_from()
+        self.assertFalse(older['has_more'])
+        self.assertEqual([message['message'] for message in older['messages']],
+                         [f'2024-01 {index}' for index in range(20)])
+        self.assertEqual(older['messages'][0]['user'], 'alice')
+        await communicator.disconnect()
+
+    def test_room_without_archive_is_not_queried_twice(self):
+        self.assertEqual(async_to_sync(message_archive.read_messages)(self.empty_room.id, None, 10), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(message_archive.read_messages)(self.empty_room.id, None, 10), [])
+        self.assertEqual(archive_index.get(self.room.id), None)
+
+    async def test_archiving_on_another_worker_resets_index(self):
+        archive_index.start_listener()
+        await asyncio.sleep(0.1)  # подписка
+        await database_sync_to_async(archive_index.load)(self.empty_room.id)
+        self.assertEqual(archive_index.get(self.empty_room.id), ())
+        client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+        await client.publish(INVALIDATION_CHANNEL, 'all')
+        await client.aclose()
+        for _ in range(50):
+            if archive_index.get(self.empty_room.id) is None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(archive_index.get(self.empty_room.id))
+        archive_index._listener.cancel()
+
+    def test_large_segments_are_streamed_not_cached(self):
+        self.addCleanup(setattr, segment_cache, 'max_item_bytes', segment_cache.max_item_bytes)
+        segment_cache.max_item_bytes = 0
+        rows = async_to_sync(message_archive.read_messages)(self.room.id, None, 5)
+        self.assertEqual([row[1] for row in rows], [f'2024-02 {index}' for index in range(25, 30)])
+        self.assertEqual(segment_cache.size, 0)
+
+    def test_segment_cache_is_bounded_by_bytes(self):
+        cache = SegmentCache(max_bytes=100)
+        for index in range(3):
+            cache.put(f'segment-{index}', b'x' * 40)
+        self.assertEqual(cache.size, 80)
+        self.assertIsNone(cache.get('segment-0'))
+        self.assertIsNotNone(cache.get('segment-2'))
+
+    def test_archived_segments_are_listed(self):
+        self.assertEqual(ArchivedSegment.objects.filter(room=self.room).count(), 2)
@@ -0,0 +1,148 @@
+import io
+import shutil
+import tempfile
+
+from asgiref.sync import sync_to_async
+from botocore.stub import Stubber
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import override_settings
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from components.ChatApp.models import Attachment
+from components.ChatApp.services.attachments import ConcatenatedReader, CountingReader, get_attachment_storage
+from components.ChatApp.services.history_cache import history_cache
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+CONTENT = b'0123456789abcdef-tail'
+
+
+class AttachmentUploadTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        storage_settings = override_settings(CHAT_ATTACHMENTS={
+            **settings.CHAT_ATTACHMENTS,
+            'storage': 'django.core.files.storage.FileSystemStorage',
+            'options': {'location': self.location, 'base_url': '/files/'},
+            'chunk_size': 8,
+        })
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        get_attachment_storage.cache_clear()
+        self.addCleanup(get_attachment_storage.cache_clear)
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, chunks=None):
+        session = self.client.post('/chat/attachments/', {
+            'room_id': self.room.id, 'file_name': 'notes.txt', 'size': len(CONTENT), 'content_type': 'text/plain',
+        }, format='json').data
+        for index in chunks if chunks is not None else range(session['chunk_count']):
+            response = self.client.put(f"/chat/attachments/{session['id']}/chunks/{index}/",
+                                       CONTENT[index * 8:(index + 1) * 8], content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 200)
+        return session
+
+    def test_chunks_are_concatenated(self):
+        session = self.upload()
+        response = self.client.post(f"/chat/attachments/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['url'].startswith('/files/'))
+        self.assertNotIn('key', response.data)
+        attachment = Attachment.objects.get(pk=session['id'])
+        self.assertEqual(attachment.status, Attachment.STATUS_COMPLETE)
+        with get_attachment_storage().open(attachment.path) as stored:
+            self.assertEqual(stored.read(), CONTENT)
+        self.assertFalse(attachment.chunks.exists())
+        # Повторное завершение возвращает тот же файл
+        self.assertEqual(self.client.post(f"/chat/attachments/{session['id']}/complete/").data, response.data)
+
+    def test_missing_chunks_are_reported(self):
+        session = self.upload(chunks=[0, 2])
+        response = self.client.post(f"/chat/attachments/{session['id']}/complete/")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('[1]', response.data['error'])
+
+    def test_short_chunk_is_rejected(self):
+        session = self.upload(chunks=[])
+        response = self.client.put(f"/chat/attachments/{session['id']}/chunks/0/", b'0123',
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_frames_carry_fresh_urls_and_cache_keeps_keys(self):
+        session = await self.async_upload()
+        communicator, _history = await self.connect(self.user, self.room)
+        await communicator.send_json_to({'type': 'message', 'message': 'see file', 'attachments': [session['id']]})
+        frame = await communicator.receive_json_from()
+        self.assertEqual([(item['name'], item['url'][:7]) for item in frame['attachments']], [('notes.txt', '/files/')])
+        self.assertNotIn('key', frame['attachments'][0])
+        await communicator.disconnect()
+
+        communicator, history = await self.connect(self.user, self.room)
+        self.assertEqual(history['messages'][-1]['attachments'][0]['url'], frame['attachments'][0]['url'])
+        # В кэше истории — ключ в хранилище, а не ссылка с ограниченным сроком жизни
+        cached, _has_more = await history_cache.get(self.room.id)
+        self.assertEqual(set(cached[-1]['attachments'][0]) - {'id', 'name', 'content_type', 'size'}, {'key'})
+        await communicator.disconnect()
+
+    async def test_deleted_message_takes_its_files(self):
+        session = await self.async_upload()
+        path = (await Attachment.objects.aget(pk=session['id'])).path
+        communicator, _history = await self.connect(self.user, self.room)
+        await communicator.send_json_to({'type': 'message', 'message': 'see file', 'attachments': [session['id']]})
+        frame = await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'delete', 'message_id': frame['id']})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'delete')
+        self.assertFalse(await Attachment.objects.filter(pk=session['id']).aexists())
+        self.assertFalse(get_attachment_storage().exists(path))
+        await communicator.disconnect()
+
+    async def async_upload(self):
+        session = await sync_to_async(self.upload)()
+        await sync_to_async(self.client.post)(f"/chat/attachments/{session['id']}/complete/")
+        return session
+
+
+class S3ReaderTests(ChatTestCase):
+    """Читатели частей должны проходить через S3Boto3Storage (upload_fileobj проверяет closed/readable)."""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = S3Boto3Storage(bucket_name='attachments', access_key='key', secret_key='secret',
+                                      region_name='us-east-1', endpoint_url='http://s3.invalid')
+        client = self.storage.connection.meta.client
+        self.bodies = []
+        client.meta.events.register('before-parameter-build.s3.PutObject', self.capture)
+        self.stubber = Stubber(client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def capture(self, params, **kwargs):
+        body = params['Body']
+        self.bodies.append(body if isinstance(body, bytes) else body.read())
+
+    def test_counting_reader_stops_at_limit(self):
+        self.stubber.add_response('put_object', {})
+        reader = CountingReader(io.BytesIO(CONTENT), 8)
+        self.storage.save('chunks/000000', File(reader, name='chunks/000000'))
+        self.assertEqual(self.bodies, [CONTENT[:8]])
+        self.assertEqual(reader.read_bytes, 8)
+
+    def test_concatenated_reader_streams_chunks(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        chunks = FileSystemStorage(location=location)
+        names = [chunks.save(f'chunk-{index}', ContentFile(CONTENT[index * 8:(index + 1) * 8])) for index in range(3)]
+        self.stubber.add_response('put_object', {})
+        reader = ConcatenatedReader(chunks, names)
+        self.storage.save('notes.txt', File(reader, name='notes.txt'))
+        self.assertEqual(self.bodies, [CONTENT])
+        self.assertEqual(reader.read_bytes, len(CONTENT))
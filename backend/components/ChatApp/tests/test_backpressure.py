@@ -0,0 +1,119 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from components.ChatApp.routing import application
+from components.ChatApp.services.rate_limit import RateLimiter, TokenBucket, rate_limiter
+from components.ChatApp.tests.utils import ChatTestCase
+from config.wire import PROTOCOL_ERROR_CLOSE_CODE
+
+
+@override_settings(CHAT_OUTBOX={'shed_threshold': 5, 'max_queue': 10})
+class SlowConsumerTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.room = self.create_room(self.alice)
+
+    async def publish(self, count):
+        for index in range(count):
+            await get_channel_layer().group_send(str(self.room.id), {
+                'type': 'room_event',
+                'frame': {'type': 'chat_message', 'message': str(index)},
+            })
+
+    async def test_stalled_client_is_dropped(self):
+        # Тестовый транспорт, как и daphne, принимает кадры сразу: очередь пуста, отстаёт только клиент
+        communicator, _history = await self.connect(self.alice, self.room)
+        await self.publish(20)
+        frames = [await communicator.receive_output() for _ in range(10)]
+        self.assertEqual(frames[-1], {'type': 'websocket.close', 'code': 4008})
+
+    async def test_acking_client_keeps_up(self):
+        communicator, _history = await self.connect(self.alice, self.room)
+        received = 1
+        for _ in range(4):
+            await self.publish(5)
+            for _ in range(5):
+                self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+                received += 1
+            await communicator.send_json_to({'type': 'ack', 'received': received})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_client_without_acks_is_rejected(self):
+        communicator = WebsocketCommunicator(URLRouter(application), f'/ws/chat/{self.room.id}/')
+        communicator.scope['user'] = self.alice
+        connected, code = await communicator.connect()
+        self.assertEqual((connected, code), (False, PROTOCOL_ERROR_CLOSE_CODE))
+
+    async def test_stale_ephemeral_frames_are_shed(self):
+        communicator, _history = await self.connect(self.alice, self.room)
+        await self.publish(4)
+        await get_channel_layer().group_send(str(self.room.id), {
+            'type': 'read_receipt', 'user_id': 0, 'user': 'bob', 'message_id': 1,
+        })
+        types = [(await communicator.receive_json_from())['type'] for _ in range(4)]
+        self.assertEqual(types, ['chat_message'] * 4)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+
+class RateLimitTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.room = self.create_room(self.alice)
+
+    def test_bucket_refills_at_rate(self):
+        bucket = TokenBucket(burst=2, now=0)
+        self.assertEqual([bucket.take(1, 2, 0) for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(bucket.take(1, 2, 0), 1)
+        self.assertEqual(bucket.take(1, 2, 1.5), 0)
+
+    async def test_shared_buckets_live_in_redis(self):
+        limiter = RateLimiter({'user': {'rate': 1, 'burst': 2}}, shared=True)
+        self.assertEqual([await limiter.check('user', 1) for _ in range(2)], [0, 0])
+        self.assertGreater(await limiter.check('user', 1), 0)
+        # Другой воркер видит тот же бакет
+        other = RateLimiter({'user': {'rate': 1, 'burst': 2}}, shared=True)
+        self.assertGreater(await other.check('user', 1), 0)
+        self.assertEqual(await other.check('room', 1), 0)
+
+    async def test_command_over_limit_gets_retry_after(self):
+        communicator, _history = await self.connect(self.alice, self.room)
+        self.addCleanup(setattr, rate_limiter, 'limits', rate_limiter.limits)
+        rate_limiter.limits = {'user': {'rate': 1, 'burst': 1}}
+        await communicator.send_json_to({'type': 'message', 'message': 'first'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+        await communicator.send_json_to({'type': 'message', 'message': 'second'})
+        frame = await communicator.receive_json_from()
+        self.assertEqual((frame['type'], frame['error']), ('error', 'rate_limited'))
+        self.assertGreater(frame['retry_after'], 0)
+        # Эфемерные события лимит не расходуют
+        await communicator.send_json_to({'type': 'typing'})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_room_rejection_does_not_charge_user(self):
+        communicator, _history = await self.connect(self.alice, self.room)
+        self.addCleanup(setattr, rate_limiter, 'limits', rate_limiter.limits)
+        rate_limiter.limits = {'user': {'rate': 0.01, 'burst': 1}, 'room': {'rate': 1, 'burst': 1}}
+        await rate_limiter.check('room', str(self.room.id))  # комнату исчерпал кто-то другой
+        await communicator.send_json_to({'type': 'message', 'message': 'first'})
+        self.assertEqual((await communicator.receive_json_from())['error'], 'rate_limited')
+        await asyncio.sleep(1)
+        await communicator.send_json_to({'type': 'message', 'message': 'second'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'chat_message')
+        await communicator.disconnect()
+
+    async def test_shared_refund_is_capped_at_burst(self):
+        limiter = RateLimiter({'user': {'rate': 0.01, 'burst': 2}}, shared=True)
+        await limiter.check('user', 1)
+        await limiter.refund('user', 1)
+        await limiter.refund('user', 1)
+        self.assertEqual([await limiter.check('user', 1) for _ in range(2)], [0, 0])
+        self.assertGreater(await limiter.check('user', 1), 0)
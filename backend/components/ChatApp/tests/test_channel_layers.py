@@ -0,0 +1,38 @@
+from django.test import SimpleTestCase
+
+from config.channel_layers import FanoutChannelLayer, HashRing, fanout_deliveries
+
+
+HOSTS = ['redis://127.0.0.1:6379/15', 'redis://127.0.0.1:6379/14']
+
+
+class HashRingTests(SimpleTestCase):
+    def test_adding_node_moves_few_keys(self):
+        keys = [f'room-{index}' for index in range(2000)]
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        moved = sum(before.get(key) != after.get(key) for key in keys)
+        # При хэше по модулю переехали бы ~3/4 ключей, по кольцу — около 1/4
+        self.assertLess(moved / len(keys), 0.4)
+        self.assertEqual({after.get(key) for key in keys}, {0, 1, 2, 3})
+
+
+class FanoutChannelLayerTests(SimpleTestCase):
+    async def test_group_message_reaches_local_channels(self):
+        layer = FanoutChannelLayer(hosts=HOSTS)
+        channels = [await layer.new_channel() for _ in range(2)]
+        for channel in channels:
+            await layer.group_add('room-1', channel)
+        before = fanout_deliveries._values.get(fanout_deliveries._key({}), 0)
+        await layer.group_send('room-1', {'type': 'room_event', 'frame': {'type': 'chat_message'}})
+        for channel in channels:
+            self.assertEqual((await layer.receive(channel))['type'], 'room_event')
+        self.assertEqual(fanout_deliveries._values.get(fanout_deliveries._key({}), 0) - before, 2)
+        await layer.flush()
+
+    async def test_groups_are_placed_by_ring(self):
+        layer = FanoutChannelLayer(hosts=HOSTS)
+        loop_layer = layer._get_layer()
+        for group in ('room-1', 'room-2', 'room-3', 'room-4'):
+            self.assertIs(loop_layer._get_shard(group), loop_layer._shards[layer.ring.get(group)])
+        await layer.flush()
@@ -0,0 +1,36 @@
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from components.ChatApp.models import DB_Message, Room_users
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class UnreadCountTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice, self.bob)
+        self.quiet_room = self.create_room(self.alice, name='quiet')
+        self.messages = DB_Message.objects.bulk_create([
+            DB_Message(room=self.room, user=self.bob, content=f'bob {index}') for index in range(5)
+        ])
+        DB_Message.objects.create(room=self.room, user=self.alice, content='own message')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def unread(self):
+        return {chat['id']: chat['unread_count'] for chat in self.client.get('/chat/list/').data}
+
+    def test_counts_foreign_messages_after_last_read(self):
+        self.assertEqual(self.unread(), {self.room.id: 5, self.quiet_room.id: 0})
+        Room_users.objects.filter(room=self.room, user=self.alice).update(last_read_id=self.messages[1].id)
+        self.assertEqual(self.unread()[self.room.id], 3)
+        Room_users.objects.filter(room=self.room, user=self.alice).update(last_read_id=self.messages[-1].id)
+        self.assertEqual(self.unread()[self.room.id], 0)
+
+    @override_settings(CHAT_UNREAD_LIMIT=3)
+    def test_count_is_capped(self):
+        self.assertEqual(self.unread()[self.room.id], 3)
+        Room_users.objects.filter(room=self.room, user=self.alice).update(last_read_id=self.messages[2].id)
+        self.assertEqual(self.unread()[self.room.id], 2)
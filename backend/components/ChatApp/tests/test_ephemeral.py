@@ -0,0 +1,40 @@
+import asyncio
+
+from components.ChatApp.services.ephemeral import ephemeral_coalescer
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class EphemeralCoalescingTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice, self.bob)
+        self.addCleanup(setattr, ephemeral_coalescer, 'window', ephemeral_coalescer.window)
+        ephemeral_coalescer.window = 0.05
+
+    async def test_burst_becomes_one_batch_with_latest_state(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        bob, _history = await self.connect(self.bob, self.room)
+        for active in (True, True, True, False):
+            await alice.send_json_to({'type': 'typing', 'active': active})
+        await alice.send_json_to({'type': 'viewing'})
+        frame = await bob.receive_json_from()
+        self.assertEqual(frame['type'], 'ephemeral')
+        self.assertEqual(sorted((event['kind'], event.get('active')) for event in frame['events']),
+                         [('typing', False), ('viewing', None)])
+        self.assertEqual({event['user'] for event in frame['events']}, {'alice'})
+        self.assertTrue(await bob.receive_nothing(timeout=0.2))
+        # Свои события отправителю не возвращаются
+        self.assertTrue(await alice.receive_nothing())
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_idle_room_has_no_tick(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        await alice.send_json_to({'type': 'typing'})
+        await asyncio.sleep(0.01)
+        self.assertIn(str(self.room.id), ephemeral_coalescer._ticks)
+        await asyncio.sleep(0.1)
+        self.assertEqual((ephemeral_coalescer._ticks, ephemeral_coalescer._pending), ({}, {}))
+        await alice.disconnect()
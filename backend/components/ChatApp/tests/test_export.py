@@ -0,0 +1,78 @@
+import datetime
+import gzip
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+
+from components.ChatApp.models import DB_Message
+from components.ChatApp.services.history_export import aiter_batches, export_batches
+from components.ChatApp.services.message_archive import archive_partition, get_archive_storage
+from components.ChatApp.services.partitions import create_partition
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+ARCHIVED_MONTH = datetime.date(2024, 1, 1)
+
+
+@override_settings(CHAT_EXPORT={'batch_size': 4})
+class HistoryExportTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        archive_settings = override_settings(CHAT_ARCHIVE={
+            **settings.CHAT_ARCHIVE,
+            'storage': 'django.core.files.storage.FileSystemStorage',
+            'options': {'location': location},
+        })
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        get_archive_storage.cache_clear()
+        self.addCleanup(get_archive_storage.cache_clear)
+
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        other_room = self.create_room(self.user, name='other')
+        create_partition(ARCHIVED_MONTH)
+        archived = DB_Message.objects.bulk_create(
+            [DB_Message(room=self.room, user=self.user, content=f'archived {index}') for index in range(6)] +
+            [DB_Message(room=other_room, user=self.user, content='elsewhere')]
+        )
+        DB_Message.objects.filter(id__in=[message.id for message in archived]).update(
+            timestamp=datetime.datetime.combine(ARCHIVED_MONTH, datetime.time(12), datetime.timezone.utc))
+        archive_partition(ARCHIVED_MONTH)
+        self.live = DB_Message.objects.bulk_create([
+            DB_Message(room=self.room, user=self.user, content=f'live {index}') for index in range(5)
+        ])
+        self.expected = [f'archived {index}' for index in range(6)] + [f'live {index}' for index in range(5)]
+
+    @staticmethod
+    def parse(data):
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+    def test_archived_rows_come_before_live_rows_in_id_order(self):
+        chunks = list(export_batches(self.room.id))
+        messages = self.parse(b''.join(chunks))
+        self.assertEqual([message['content'] for message in messages], self.expected)
+        ids = [message['id'] for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({message['user'] for message in messages}, {'alice'})
+        self.assertEqual(len(chunks), 4)  # куски не смешивают архив и живые партиции: 4 + 2, 4 + 1
+
+    def test_bounds_cross_the_archive_boundary(self):
+        archived = self.parse(b''.join(export_batches(self.room.id)))[:6]
+        messages = self.parse(b''.join(export_batches(self.room.id, after_id=archived[3]['id'],
+                                                      before_id=self.live[2].id)))
+        self.assertEqual([message['content'] for message in messages],
+                         ['archived 4', 'archived 5', 'live 0', 'live 1'])
+        since = datetime.datetime(2024, 2, 1, tzinfo=datetime.timezone.utc)
+        messages = self.parse(b''.join(export_batches(self.room.id, since=since)))
+        self.assertEqual([message['content'] for message in messages], self.expected[6:])
+
+    async def test_async_stream_matches_sync_export(self):
+        chunks = [chunk async for chunk in aiter_batches(export_batches(self.room.id, compress=True))]
+        messages = self.parse(gzip.decompress(b''.join(chunks)))
+        self.assertEqual([message['content'] for message in messages], self.expected)
@@ -0,0 +1,48 @@
+from components.ChatApp.models import DB_Message
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class HistoryPaginationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        self.messages = DB_Message.objects.bulk_create([
+            DB_Message(room=self.room, user=self.user, content=f'message {index}') for index in range(60)
+        ])
+
+    async def test_connect_sends_newest_page(self):
+        communicator, frame = await self.connect(self.user, self.room)
+        self.assertEqual(frame['type'], 'history')
+        self.assertTrue(frame['has_more'])
+        self.assertEqual([message['message'] for message in frame['messages']],
+                         [f'message {index}' for index in range(10, 60)])
+        self.assertEqual(frame['before_id'], frame['messages'][0]['id'])
+        await communicator.disconnect()
+
+    async def test_load_more_returns_previous_page(self):
+        communicator, frame = await self.connect(self.user, self.room)
+        await communicator.send_json_to({'type': 'load_more', 'before_id': frame['before_id']})
+        page = await communicator.receive_json_from()
+        self.assertEqual(page['type'], 'history')
+        self.assertFalse(page['has_more'])
+        self.assertNotIn('seq', page)
+        self.assertEqual([message['message'] for message in page['messages']],
+                         [f'message {index}' for index in range(10)])
+        await communicator.disconnect()
+
+    async def test_load_more_requires_cursor(self):
+        communicator, _frame = await self.connect(self.user, self.room)
+        await communicator.send_json_to({'type': 'load_more', 'before_id': 'oldest'})
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'error', 'error': 'before_id is required'})
+        await communicator.disconnect()
+
+    async def test_page_is_served_from_history_cache(self):
+        communicator, first = await self.connect(self.user, self.room)
+        await communicator.disconnect()
+        # Строки, удалённые в обход команд, остаются в прогретом кэше
+        await DB_Message.objects.filter(room=self.room).adelete()
+        communicator, second = await self.connect(self.user, self.room)
+        self.assertEqual(second['messages'], first['messages'])
+        await communicator.disconnect()
@@ -0,0 +1,66 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.test import APIClient
+
+from components.ChatApp.services.membership import membership_cache
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class MembershipCacheTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_members_are_cached_until_changed(self):
+        is_member = async_to_sync(membership_cache.is_member)
+        self.assertFalse(is_member(self.room.id, self.bob.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_member(str(self.room.id), self.alice.id))
+        response = self.client.post(f'/chat/{self.room.id}/members/', {'usernames': ['bob', 'nobody']},
+                                    format='json')
+        self.assertEqual(response.data, {'added': ['bob'], 'already_members': [], 'not_found': ['nobody']})
+        self.assertTrue(is_member(self.room.id, self.bob.id))
+
+    def test_malformed_room_id_is_not_a_member(self):
+        self.assertFalse(async_to_sync(membership_cache.is_member)('1; DROP', self.alice.id))
+        self.assertFalse(async_to_sync(membership_cache.is_member)(None, self.alice.id))
+
+    async def test_route_accepts_only_numeric_room(self):
+        for path in ('/ws/chat/abc/', f'/ws/chat/{self.room.id}/extra/'):
+            communicator = self.communicator(self.alice, self.room)
+            communicator.scope['path'] = path
+            with self.assertRaises(ValueError):
+                await communicator.connect()
+
+
+class MemberRemovalTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    async def test_bulk_removal_closes_removed_sockets(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        bob, _history = await self.connect(self.bob, self.room)
+        response = await sync_to_async(self.client.post)(f'/chat/{self.room.id}/members/remove/',
+                                                        {'usernames': ['bob']}, format='json')
+        self.assertEqual(response.data, {'removed': 1})
+        self.assertEqual(await bob.receive_output(), {'type': 'websocket.close', 'code': 4003})
+        self.assertTrue(await alice.receive_nothing())
+        await alice.disconnect()
+
+    async def test_leaving_chat_closes_own_socket(self):
+        bob, _history = await self.connect(self.bob, self.room)
+        alice, _history = await self.connect(self.alice, self.room)
+        response = await sync_to_async(self.client.delete)(f'/chat/delete/{self.room.id}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(await alice.receive_output(), {'type': 'websocket.close', 'code': 4003})
+        self.assertFalse(await membership_cache.is_member(self.room.id, self.alice.id))
+        self.assertTrue(await bob.receive_nothing())
+        await bob.disconnect()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+from unittest import mock
+
+import redis
+from channels.testing import ApplicationCommunicator
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
+
+from config.lifespan import lifespan
+from components.ChatApp.models import DB_Message
+from components.ChatApp.services.message_writer import DEAD_LETTER_KEY, MessageWriter, QueueFull, message_writer
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class MessageWriterTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        # Фоновый сброс не должен мешать: очередь пишется только явным flush
+        self.configure_writer(enabled=True, flush_interval=60)
+
+    def configure_writer(self, **options):
+        previous = {name: getattr(message_writer, name) for name in options}
+        for name, value in options.items():
+            setattr(message_writer, name, value)
+        self.addCleanup(lambda: [setattr(message_writer, name, value) for name, value in previous.items()])
+
+    async def test_ids_follow_call_order(self):
+        with mock.patch.object(MessageWriter, '_reserve_ids', wraps=MessageWriter._reserve_ids) as reserve:
+            ids = await asyncio.gather(*(message_writer.next_id() for _ in range(20)))
+        self.assertEqual(ids, sorted(set(ids)))
+        # Одновременные вызовы склеиваются в один запрос к sequence
+        reserve.assert_called_once_with(20)
+        later = await message_writer.next_id()
+        self.assertGreater(later, ids[-1])
+
+    async def test_rejected_row_is_dead_lettered(self):
+        now = timezone.now()
+        rows = [(await message_writer.next_id(), f'message {index}', now, self.user.id, self.room.id)
+                for index in range(5)]
+        orphan = (rows[2][0], 'orphan', now, self.user.id, self.room.id + 1000)
+        for row in rows[:2] + [orphan] + rows[3:]:
+            await message_writer.submit(*row)
+        with self.assertLogs('components.ChatApp.services.message_writer', 'ERROR'):
+            await message_writer.flush()
+        self.assertEqual(message_writer.depth, 0)
+        saved = [content async for content in DB_Message.objects.order_by('id').values_list('content', flat=True)]
+        self.assertEqual(saved, ['message 0', 'message 1', 'message 3', 'message 4'])
+        entries = redis.StrictRedis(**settings.REDIS_CONFIG).lrange(DEAD_LETTER_KEY, 0, -1)
+        self.assertEqual([json.loads(entry)['content'] for entry in entries], ['orphan'])
+
+    async def test_full_queue_rejects_messages(self):
+        # Подключение сбрасывает очередь перед чтением истории, поэтому заполняем её после
+        communicator, _history = await self.connect(self.user, self.room)
+        self.configure_writer(max_pending=1)
+        await message_writer.submit(await message_writer.next_id(), 'first', timezone.now(), self.user.id,
+                                    self.room.id)
+        with self.assertRaises(QueueFull):
+            await message_writer.submit(await message_writer.next_id(), 'second', timezone.now(), self.user.id,
+                                        self.room.id)
+        await communicator.send_json_to({'type': 'message', 'message': 'third'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'error': 'overloaded'})
+        await communicator.disconnect()
+        self.assertEqual(await DB_Message.objects.acount(), 1)
+
+    async def test_disconnect_flushes_queue(self):
+        communicator, _history = await self.connect(self.user, self.room)
+        await communicator.send_json_to({'type': 'message', 'message': 'hello'})
+        frame = await communicator.receive_json_from()
+        self.assertFalse(await DB_Message.objects.filter(id=frame['id']).aexists())
+        await communicator.disconnect()
+        self.assertTrue(await DB_Message.objects.filter(id=frame['id'], content='hello').aexists())
+
+    async def test_lifespan_shutdown_flushes_queue(self):
+        await message_writer.submit(await message_writer.next_id(), 'pending', timezone.now(), self.user.id,
+                                    self.room.id)
+        communicator = ApplicationCommunicator(lifespan, {'type': 'lifespan'})
+        await communicator.send_input({'type': 'lifespan.startup'})
+        self.assertEqual(await communicator.receive_output(), {'type': 'lifespan.startup.complete'})
+        await communicator.send_input({'type': 'lifespan.shutdown'})
+        self.assertEqual(await communicator.receive_output(), {'type': 'lifespan.shutdown.complete'})
+        self.assertTrue(await DB_Message.objects.filter(content='pending').aexists())
+
+    async def test_dead_task_does_not_start_a_second_flush(self):
+        gate = asyncio.Event()
+        insert = MessageWriter._insert
+
+        async def slow_insert(rows):
+            await gate.wait()
+            await insert(rows)
+
+        now = timezone.now()
+        for index in range(3):
+            await message_writer.submit(await message_writer.next_id(), f'message {index}', now, self.user.id,
+                                        self.room.id)
+        lock = message_writer._flush_lock
+        with mock.patch.object(MessageWriter, '_insert', staticmethod(slow_insert)):
+            first = asyncio.create_task(message_writer.flush())
+            await asyncio.sleep(0.01)
+            # Фоновая задача умерла, пока flush держит блокировку
+            message_writer._task.cancel()
+            await asyncio.sleep(0)
+            await message_writer.submit(await message_writer.next_id(), 'message 3', now, self.user.id,
+                                        self.room.id)
+            second = asyncio.create_task(message_writer.flush())
+            await asyncio.sleep(0.01)
+            self.assertIs(message_writer._flush_lock, lock)
+            gate.set()
+            await asyncio.gather(first, second)
+        self.assertEqual(message_writer.depth, 0)
+        saved = [content async for content in DB_Message.objects.order_by('id').values_list('content', flat=True)]
+        self.assertEqual(saved, [f'message {index}' for index in range(4)])
+
+    async def test_sequence_failure_gets_error_frame(self):
+        communicator, _history = await self.connect(self.user, self.room)
+        with mock.patch.object(MessageWriter, '_reserve_ids', side_effect=OperationalError('down')), \
+                self.assertLogs('components.ChatApp.consumers', 'ERROR'):
+            await communicator.send_json_to({'type': 'message', 'message': 'hello'})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'error': 'unavailable'})
+        await communicator.disconnect()
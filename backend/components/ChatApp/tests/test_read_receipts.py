@@ -0,0 +1,60 @@
+import time
+
+import redis
+from django.conf import settings
+
+from components.ChatApp.models import DB_Message, Room_users, RoomSummary
+from components.ChatApp.services.read_receipts import DIRTY_KEY, PROCESSING_KEY, _CLAIM, read_receipts
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class ReadReceiptTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice, self.bob)
+        self.redis = redis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+
+    async def last_read_id(self, user):
+        return await Room_users.objects.filter(room=self.room, user=user).values_list('last_read_id', flat=True).aget()
+
+    async def test_position_is_clamped_to_latest_message(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        bob, _history = await self.connect(self.bob, self.room)
+        await alice.send_json_to({'type': 'message', 'message': 'hello'})
+        message_id = (await alice.receive_json_from())['id']
+        await bob.receive_json_from()
+
+        await bob.send_json_to({'type': 'read', 'message_id': message_id + 10 ** 6})
+        receipt = await alice.receive_json_from()
+        self.assertEqual((receipt['type'], receipt['user'], receipt['message_id']), ('read_receipt', 'bob', message_id))
+        self.assertEqual(await read_receipts.get(self.room.id), {self.bob.id: message_id})
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_latest_message_falls_back_to_summary(self):
+        message = await DB_Message.objects.acreate(room=self.room, user=self.alice, content='hello')
+        await RoomSummary.objects.acreate(room=self.room, last_message_id=message.id)
+        self.assertEqual(await read_receipts.advance(self.room.id, self.bob.id, message.id + 5), message.id)
+        self.assertIsNone(await read_receipts.advance(self.room.id, self.bob.id, message.id))
+
+    async def test_room_without_messages_accepts_nothing(self):
+        self.assertIsNone(await read_receipts.advance(self.room.id, self.bob.id, 1))
+
+    async def test_batch_of_crashed_worker_is_written_later(self):
+        message = await DB_Message.objects.acreate(room=self.room, user=self.alice, content='hello')
+        await read_receipts.record_message(self.room.id, message.id)
+        await read_receipts.advance(self.room.id, self.bob.id, message.id)
+        # Воркер забрал пачку и упал, не записав её
+        claimed = self.redis.eval(_CLAIM, 2, DIRTY_KEY, PROCESSING_KEY, 100, time.time(), 0)
+        self.assertEqual(claimed, [f'{self.room.id}:{self.bob.id}'])
+        self.assertEqual(await read_receipts.flush(), 0)
+        self.assertEqual(await self.last_read_id(self.bob), 0)
+
+        self.addCleanup(setattr, read_receipts, 'claim_timeout', read_receipts.claim_timeout)
+        read_receipts.claim_timeout = 0
+        self.assertEqual(await read_receipts.flush(), 1)
+        self.assertEqual(await self.last_read_id(self.bob), message.id)
+        self.assertEqual(self.redis.zcard(PROCESSING_KEY), 0)
+        self.assertEqual(self.redis.scard(DIRTY_KEY), 0)
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import DatabaseError
+
+from components.accounts.models import ProfilePicture
+from components.ChatApp.consumers import ChatConsumer, ChatRepository
+from components.ChatApp.models import DB_Message, RoomSummary
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class HistoryHydrationTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.authors = [self.create_user(f'author-{index}') for index in range(5)]
+        ProfilePicture.objects.create(user=self.authors[1], profile_picture='pictures/author-1.png')
+        self.room = self.create_room(*self.authors)
+        DB_Message.objects.bulk_create([
+            DB_Message(room=self.room, user=self.authors[index % 5], content=f'message {index}')
+            for index in range(40)
+        ])
+
+    def test_page_is_one_query_regardless_of_authors(self):
+        with self.assertNumQueries(1):
+            rows = async_to_sync(ChatRepository.get_messages)(self.room.id, None, 30)
+        self.assertEqual(len(rows), 30)
+        self.assertEqual([row[1] for row in rows], [f'message {index}' for index in range(10, 40)])
+
+    def test_page_carries_author_and_avatar(self):
+        rows = async_to_sync(ChatRepository.get_messages)(self.room.id, None, 5)
+        messages = {message['user']: message for message in ChatConsumer.serialize_messages(rows)}
+        self.assertEqual(messages['author-1']['avatar_url'],
+                         f'{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/pictures/author-1.png')
+        self.assertIsNone(messages['author-0']['avatar_url'])
+
+
+class RepositoryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.room = self.create_room(self.alice)
+        self.first = DB_Message.objects.create(room=self.room, user=self.alice, content='first')
+        self.last = DB_Message.objects.create(room=self.room, user=self.alice, content='last')
+        RoomSummary.objects.create(room=self.room, last_message_id=self.last.id, last_message='last', message_count=2)
+
+    def test_failed_summary_refresh_keeps_message(self):
+        with mock.patch('components.ChatApp.consumers.refresh_last_message', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            async_to_sync(ChatRepository.delete_message)(self.last.id, self.room.id, self.alice.id)
+        self.assertTrue(DB_Message.objects.filter(id=self.last.id).exists())
+
+    def test_sync_repository_does_not_import_psycopg_pool(self):
+        code = ('import django, sys; django.setup(); import components.ChatApp.consumers; '
+                'print("components.ChatApp.services.async_repository" in sys.modules)')
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'})
+        self.assertEqual(output.stdout.strip(), 'False')
@@ -0,0 +1,108 @@
+from components.ChatApp.models import DB_Message
+from components.ChatApp.services.room_events import room_events
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class MessageCommandTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.room = self.create_room(self.alice, self.bob)
+        self.other_room = self.create_room(self.alice, name='other')
+        self.message = DB_Message.objects.create(room=self.room, user=self.alice, content='hello')
+        self.foreign = DB_Message.objects.create(room=self.other_room, user=self.alice, content='elsewhere')
+
+    async def test_author_edits_and_deletes_own_message(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        await alice.send_json_to({'type': 'edit', 'message_id': str(self.message.id), 'new_text': 'edited'})
+        frame = await alice.receive_json_from()
+        self.assertEqual((frame['type'], frame['message_id'], frame['new_text']), ('edit', self.message.id, 'edited'))
+        await alice.send_json_to({'type': 'delete', 'message_id': self.message.id})
+        frame = await alice.receive_json_from()
+        self.assertEqual((frame['type'], frame['message_id']), ('delete', self.message.id))
+        self.assertFalse(await DB_Message.objects.filter(id=self.message.id).aexists())
+        await alice.disconnect()
+
+    async def test_foreign_messages_are_not_touched(self):
+        bob, _history = await self.connect(self.bob, self.room)
+        alice, _history = await self.connect(self.alice, self.room)
+        # Чужое сообщение и сообщение из другой комнаты
+        for message_id in (self.message.id, self.foreign.id):
+            await bob.send_json_to({'type': 'delete', 'message_id': message_id})
+            self.assertEqual(await bob.receive_json_from(), {'type': 'error', 'error': 'message not found'})
+        await alice.send_json_to({'type': 'edit', 'message_id': self.foreign.id, 'new_text': 'moved'})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'error', 'error': 'message not found'})
+        self.assertTrue(await alice.receive_nothing())
+        self.assertEqual(await DB_Message.objects.filter(content__in=['hello', 'elsewhere']).acount(), 2)
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_invalid_message_id_gets_error_frame(self):
+        alice, _history = await self.connect(self.alice, self.room)
+        await alice.send_json_to({'type': 'delete', 'message_id': 'abc'})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'error', 'error': 'message_id is required'})
+        await alice.send_json_to({'type': 'edit', 'message_id': self.message.id})
+        self.assertEqual(await alice.receive_json_from(),
+                         {'type': 'error', 'error': 'message_id and new_text are required'})
+        await alice.disconnect()
+
+
+class ReplayTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+        self.room = self.create_room(self.alice)
+
+    async def test_reconnect_replays_missed_events(self):
+        alice, history = await self.connect(self.alice, self.room)
+        seq = history['seq']
+        await alice.disconnect()
+
+        writer, _history = await self.connect(self.alice, self.room)
+        for text in ('one', 'two'):
+            await writer.send_json_to({'type': 'message', 'message': text})
+            await writer.receive_json_from()
+        await writer.disconnect()
+
+        alice, frame = await self.connect(self.alice, self.room, f'since_seq={seq}')
+        self.assertEqual(frame['type'], 'sync')
+        self.assertEqual([event['message'] for event in frame['events']], ['one', 'two'])
+        self.assertEqual(frame['seq'], seq + 2)
+        await alice.disconnect()
+
+        alice, frame = await self.connect(self.alice, self.room, f'since_seq={seq + 2}')
+        self.assertEqual(frame, {'type': 'sync', 'events': [], 'seq': seq + 2})
+        await alice.disconnect()
+
+    async def test_gap_outside_log_gets_full_page(self):
+        self.addCleanup(setattr, room_events, 'size', room_events.size)
+        room_events.size = 1
+        for index in range(3):
+            await room_events.publish(self.room.id, {'type': 'chat_message', 'message': str(index)})
+        alice, frame = await self.connect(self.alice, self.room, 'since_seq=0')
+        self.assertEqual(frame['type'], 'history')
+        self.assertEqual(frame['seq'], 3)
+        await alice.disconnect()
+
+    async def test_quiet_room_keeps_counting_after_log_expires(self):
+        first = await room_events.publish(self.room.id, {'type': 'chat_message', 'message': 'old'})
+        client = room_events.client
+        self.assertEqual(await client.ttl(room_events.seq_key(self.room.id)), -1)
+        await client.delete(room_events.log_key(self.room.id))  # журнал истёк за время тишины
+        second = await room_events.publish(self.room.id, {'type': 'chat_message', 'message': 'new'})
+        self.assertEqual(second['seq'], first['seq'] + 1)
+        self.assertEqual([event['message'] for event in await room_events.since(self.room.id, first['seq'])],
+                         ['new'])
+        # Клиент, отставший дальше журнала, получает полную страницу
+        self.assertIsNone(await room_events.since(self.room.id, first['seq'] - 1))
+
+    async def test_lost_counter_forces_full_page(self):
+        for index in range(3):
+            await room_events.publish(self.room.id, {'type': 'chat_message', 'message': str(index)})
+        await room_events.client.delete(room_events.seq_key(self.room.id), room_events.log_key(self.room.id))
+        await room_events.publish(self.room.id, {'type': 'chat_message', 'message': 'after reset'})
+        alice, frame = await self.connect(self.alice, self.room, 'since_seq=3')
+        self.assertEqual(frame['type'], 'history')
+        self.assertEqual(frame['seq'], 1)
+        await alice.disconnect()
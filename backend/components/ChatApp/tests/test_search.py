@@ -0,0 +1,46 @@
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from components.ChatApp.models import DB_Message
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class SearchTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/chat/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_snippet_escapes_message_html(self):
+        DB_Message.objects.create(room=self.room, user=self.user,
+                                  content='<img src=x onerror=alert(1)> встреча завтра')
+        [result] = self.search(q='встреча')['results']
+        self.assertIn('<b>встреча</b>', result['snippet'])
+        self.assertIn('&gt;', result['snippet'])
+        # Кроме подсветки, в сниппете нет ни одной разметки
+        self.assertNotRegex(result['snippet'].replace('<b>', '').replace('</b>', ''), '[<>]')
+
+    def test_only_member_rooms_are_searched(self):
+        stranger = self.create_user('bob')
+        DB_Message.objects.create(room=self.create_room(stranger), user=stranger, content='секретная встреча')
+        self.assertEqual(self.search(q='встреча')['results'], [])
+
+    @override_settings(CHAT_SEARCH={'page_size': 20, 'max_candidates': 3})
+    def test_truncated_results_continue_with_before_id(self):
+        messages = [DB_Message.objects.create(room=self.room, user=self.user, content=f'встреча {index}')
+                    for index in range(5)]
+        first = self.search(q='встреча')
+        self.assertTrue(first['truncated'])
+        self.assertEqual({result['id'] for result in first['results']}, {message.id for message in messages[2:]})
+        self.assertEqual(first['next_before_id'], messages[2].id)
+        rest = self.search(q='встреча', before_id=first['next_before_id'])
+        self.assertFalse(rest['truncated'])
+        self.assertIsNone(rest['next_before_id'])
+        self.assertEqual({result['id'] for result in rest['results']}, {message.id for message in messages[:2]})
@@ -0,0 +1,51 @@
+import msgpack
+from django.test import SimpleTestCase
+
+from config.wire import BINARY_SUBPROTOCOL, PROTOCOL_ERROR_CLOSE_CODE, WireCodec
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class WireCodecTests(SimpleTestCase):
+    def test_binary_frames_shorten_only_envelope_keys(self):
+        codec = WireCodec(binary=True)
+        frame = {'type': 'history', 'messages': [{'id': 1, 'message': 'hi', 'type': 'text'}], 'has_more': False}
+        packed = msgpack.unpackb(codec.encode(frame)['bytes_data'])
+        self.assertEqual(packed, {'t': 'history', 'ms': [{'id': 1, 'message': 'hi', 'type': 'text'}], 'h': False})
+        self.assertEqual(codec.decode(bytes_data=msgpack.packb(packed)), frame)
+
+    def test_nested_payload_is_passed_as_is(self):
+        codec = WireCodec(binary=True)
+        signal = {'type': 'call-answer', 'answer': {'type': 'answer', 'sdp': 'v=0'}}
+        self.assertEqual(codec.decode(bytes_data=codec.encode(signal)['bytes_data']), signal)
+
+    def test_malformed_frames_raise_value_error(self):
+        for codec, frame in ((WireCodec(), {'bytes_data': msgpack.packb({'t': 'read'})}),
+                             (WireCodec(), {'text_data': '{"type": '}),
+                             (WireCodec(), {'text_data': '[1, 2]'}),
+                             (WireCodec(binary=True), {'bytes_data': b'\xc1'}),
+                             (WireCodec(binary=True), {'bytes_data': msgpack.packb('read')})):
+            with self.subTest(frame=frame), self.assertRaises(ValueError):
+                codec.decode(**frame)
+
+
+class ProtocolErrorTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+
+    async def test_binary_frame_on_json_connection_closes_socket(self):
+        communicator, _history = await self.connect(self.user, self.room)
+        await communicator.send_to(bytes_data=msgpack.packb({'t': 'load_more'}))
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close',
+                                                               'code': PROTOCOL_ERROR_CLOSE_CODE})
+
+    async def test_msgpack_connection_speaks_short_keys(self):
+        communicator = self.communicator(self.user, self.room)
+        communicator.scope['subprotocols'] = [BINARY_SUBPROTOCOL]
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, BINARY_SUBPROTOCOL))
+        history = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual((history['t'], history['ms']), ('history', []))
+        await communicator.send_to(text_data='not json')
+        self.assertEqual((await communicator.receive_output())['code'], PROTOCOL_ERROR_CLOSE_CODE)
@@ -0,0 +1,86 @@
+import redis
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+
+from components.accounts.services.presence import presence
+from components.accounts.services.profile_cache import profile_cache
+from components.accounts.services.ws_tickets import ticket_verifier
+from components.ChatApp.models import Room, Room_users
+from components.ChatApp.routing import application
+from components.ChatApp.services.async_repository import chat_db_pool
+from components.ChatApp.services.ephemeral import ephemeral_coalescer
+from components.ChatApp.services.history_cache import history_cache
+from components.ChatApp.services.membership import membership_cache
+from components.ChatApp.services.message_archive import archive_index, segment_cache
+from components.ChatApp.services.message_writer import message_writer
+from components.ChatApp.services.rate_limit import rate_limiter
+from components.ChatApp.services.read_receipts import read_receipts
+from components.ChatApp.services.room_events import room_events
+from components.video_calls.services import redis_service
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def reset_services():
+    """Сбрасывает состояние синглтонов воркера между тестами.
+
+    Каждый асинхронный тест идёт в своём event loop, а соединения Redis, фоновые
+    задачи и пулы привязаны к loop, в котором созданы.
+    """
+    for service in (history_cache, room_events, read_receipts, presence, ticket_verifier, message_writer):
+        service.client.connection_pool.reset()
+    for service in (read_receipts, presence, message_writer):
+        service._task = None
+    for cache in (profile_cache, membership_cache):
+        cache._listener = None
+        cache._entries.clear()
+    rate_limiter._buckets.clear()
+    ephemeral_coalescer._pending.clear()
+    ephemeral_coalescer._ticks.clear()
+    message_writer._pending.clear()
+    message_writer._id_waiters.clear()
+    message_writer._id_task = None
+    chat_db_pool._loops.clear()
+    archive_index._listener = None
+    archive_index.clear()
+    segment_cache.clear()
+    redis_service._connection_pool = None
+    channel_layers.backends.clear()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatTestCase(TransactionTestCase):
+    """База тестов чата: consumer'ы ходят в БД из своего потока, поэтому данные коммитятся."""
+
+    def setUp(self):
+        redis.StrictRedis(**settings.REDIS_CONFIG).flushdb()
+        reset_services()
+
+    @staticmethod
+    def create_room(*users, name='room'):
+        room = Room.objects.create(name=name)
+        Room_users.objects.bulk_create([Room_users(room=room, user=user) for user in users])
+        return room
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(username=username, password='password')
+
+    @staticmethod
+    def communicator(user, room, query=''):
+        path = f'/ws/chat/{room.id}/?acks=1' + (f'&{query}' if query else '')
+        communicator = WebsocketCommunicator(URLRouter(application), path)
+        communicator.scope['user'] = user
+        return communicator
+
+    async def connect(self, user, room, query=''):
+        """Подключённый communicator и первый кадр (история или sync)."""
+        communicator = self.communicator(user, room, query)
+        connected, _subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator, await communicator.receive_json_from()
@@ -5,5 +5,15 @@ urlpatterns = [
     path('chat/list/', views.chat_list, name='chat-list'),
     path('chat/create/', views.create_chat, name='create-chat'),
     path('chat/add_user/', views.add_user, name='add-user'),
+    path('chat/<int:room_id>/members/', views.add_members_view, name='add-members'),
+    path('chat/<int:room_id>/members/remove/', views.remove_members_view, name='remove-members'),
+    path('chat/<int:room_id>/export/', views.export_history, name='export-history'),
     path('chat/delete/<int:room_id>/', views.delete_chat, name='delete-chat'),
+    path('chat/search/', views.search_messages, name='search-messages'),
+    path('chat/write-behind/stats/', views.write_behind_stats, name='write-behind-stats'),
+    path('chat/attachments/', views.create_attachment, name='create-attachment'),
+    path('chat/attachments/<uuid:attachment_id>/', views.attachment_detail, name='attachment-detail'),
+    path('chat/attachments/<uuid:attachment_id>/chunks/<int:index>/', views.upload_attachment_chunk,
+         name='upload-attachment-chunk'),
+    path('chat/attachments/<uuid:attachment_id>/complete/', views.complete_attachment, name='complete-attachment'),
 ]
@@ -1,12 +1,40 @@
+import datetime
+import os
+
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import connection
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.dateparse import parse_datetime
+
+from components.accounts.services.presence import presence
+from .models import Attachment, Room, Room_users, SEARCH_CONFIG
+from .serializers import RoomSerializer, RoomListSerializer
+from .services import attachments
+from .services.history_export import aiter_batches, export_batches
+from .services.membership import add_members, membership_cache, remove_members
+from .services.message_writer import message_writer
 
-from .models import Room
-from .serializers import RoomSerializer
+
+def unread_counts(user_id):
+    """Непрочитанные сообщения по всем комнатам пользователя одним запросом."""
+    with connection.cursor() as cursor:
+        # Счёт ограничен CHAT_UNREAD_LIMIT: клиенту достаточно «99+», а не полного прохода по индексу
+        cursor.execute('SELECT ru.room_id, ('
+                       '    SELECT count(*) FROM ('
+                       '        SELECT 1 FROM "ChatApp_db_message" m '
+                       '        WHERE m.room_id = ru.room_id AND m.id > ru.last_read_id AND m.user_id <> ru.user_id '
+                       '        LIMIT %s'
+                       '    ) unread'
+                       ') FROM "ChatApp_room_users" ru WHERE ru.user_id = %s',
+                       [settings.CHAT_UNREAD_LIMIT, user_id])
+        return dict(cursor.fetchall())
 
 
 # Представление для списка чатов
@@ -14,8 +42,15 @@ from .serializers import RoomSerializer
 @permission_classes([IsAuthenticated])
 def chat_list(request):
     try:
-        chats = Room.objects.filter(users=request.user)
-        serializer = RoomSerializer(chats, many=True)
+        # Сводка и её автор приходят JOIN-ом, участники одним prefetch-запросом
+        chats = list(Room.objects.filter(users=request.user)
+                     .select_related('summary', 'summary__last_user')
+                     .prefetch_related('users'))
+        online = presence.online_many(f'chat:{chat.id}' for chat in chats)
+        serializer = RoomListSerializer(chats, many=True, context={
+            'unread': unread_counts(request.user.id),
+            'online': {chat.id: online[f'chat:{chat.id}'] for chat in chats},
+        })
         return Response(serializer.data)
     except Room.DoesNotExist:
         return Response({"error": "Чаты не найдены."}, status=status.HTTP_404_NOT_FOUND)
@@ -38,6 +73,7 @@ def create_chat(request):
         # Добавляем текущего пользователя в чат
         user = request.user
         chat.users.add(user)
+        membership_cache.publish_invalidation(chat.id)
 
         serializer = RoomSerializer(chat)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -48,29 +84,259 @@ def create_chat(request):
 @permission_classes([IsAuthenticated])
 def add_user(request):
     if request.method == 'POST':
-        print(request.data)
         data = request.data
         chat_id = data.get('chat_id')
         username = data.get('username')
         if not chat_id or not username:
             return Response({'error': 'Имя чата и имя пользователя обязательны.'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            # Получаем объект комнаты и пользователя
-            room = Room.objects.get(id=chat_id)
-            user = User.objects.get(username=username)
-
-            # Добавляем пользователя в комнату
-            room.users.add(user)
-            return Response({'username': username}, status=status.HTTP_201_CREATED)
-        except Room.DoesNotExist:
+        room = member_room(chat_id, request.user)
+        if room is None:
             return Response({'error': 'Комната не найдена.'}, status=status.HTTP_404_NOT_FOUND)
-        except User.DoesNotExist:
+        _added, _existing, missing = add_members(room, [username])
+        if missing:
             return Response({'error': 'Пользователь не найден.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'username': username}, status=status.HTTP_201_CREATED)
+
+
+# Массовое добавление участников: один bulk_create вместо запроса на каждого
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def add_members_view(request, room_id):
+    usernames = member_usernames(request.data)
+    if usernames is None:
+        return Response({'error': 'Нужен список usernames (не больше '
+                                  f'{settings.CHAT_MEMBERS_BULK_LIMIT}).'}, status=status.HTTP_400_BAD_REQUEST)
+    room = member_room(room_id, request.user)
+    if room is None:
+        return Response({'error': 'Комната не найдена.'}, status=status.HTTP_404_NOT_FOUND)
+    added, existing, missing = add_members(room, usernames)
+    return Response({'added': added, 'already_members': existing, 'not_found': missing},
+                    status=status.HTTP_201_CREATED if added else status.HTTP_200_OK)
+
+
+# Массовое удаление участников одним DELETE; их открытые сокеты закрываются
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def remove_members_view(request, room_id):
+    usernames = member_usernames(request.data)
+    if usernames is None:
+        return Response({'error': 'Нужен список usernames (не больше '
+                                  f'{settings.CHAT_MEMBERS_BULK_LIMIT}).'}, status=status.HTTP_400_BAD_REQUEST)
+    room = member_room(room_id, request.user)
+    if room is None:
+        return Response({'error': 'Комната не найдена.'}, status=status.HTTP_404_NOT_FOUND)
+    user_ids = User.objects.filter(username__in=set(usernames)).values_list('id', flat=True)
+    removed = remove_members(room.id, list(user_ids))
+    return Response({'removed': len(removed)})
+
+
+def member_room(room_id, user):
+    """Комната, если пользователь в ней состоит; управлять составом могут только участники."""
+    return Room.objects.filter(id=room_id, room_users__user=user).first()
+
+
+def member_usernames(data):
+    """Список имён из тела запроса или None, если он пуст, не список или слишком длинный."""
+    usernames = data.get('usernames')
+    if not isinstance(usernames, list) or not 0 < len(usernames) <= settings.CHAT_MEMBERS_BULK_LIMIT:
+        return None
+    return [str(username) for username in usernames]
+
+# Маркеры совпадений в ts_headline: управляющие символы не встречаются в HTML, поэтому
+# сниппет сначала экранируется целиком, а потом маркеры заменяются на <b></b>
+HIGHLIGHT_START, HIGHLIGHT_STOP = '\x02', '\x03'
+HEADLINE_OPTIONS = (f'MaxFragments=2, MaxWords=15, MinWords=5, '
+                    f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}"')
+
+
+def highlight(snippet):
+    return escape(snippet).replace(HIGHLIGHT_START, '<b>').replace(HIGHLIGHT_STOP, '</b>')
+
+
+# Полнотекстовый поиск по сообщениям в комнатах пользователя
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_messages(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'Поисковый запрос обязателен.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        room_id = int(request.query_params['room']) if request.query_params.get('room') else None
+        before_id = int(request.query_params['before_id']) if request.query_params.get('before_id') else None
+    except ValueError:
+        return Response({'error': 'Некорректные параметры.'}, status=status.HTTP_400_BAD_REQUEST)
+    page_size = settings.CHAT_SEARCH['page_size']
+    max_candidates = settings.CHAT_SEARCH['max_candidates']
+
+    filters, filter_params = '', []
+    if room_id is not None:
+        filters += 'AND m.room_id = %s '
+        filter_params.append(room_id)
+    if before_id is not None:
+        filters += 'AND m.id < %s '
+        filter_params.append(before_id)
+    params = [SEARCH_CONFIG, query, request.user.id, *filter_params, max_candidates, page_size + 1,
+              (page - 1) * page_size, SEARCH_CONFIG, HIGHLIGHT_START + HIGHLIGHT_STOP, HEADLINE_OPTIONS]
+    with connection.cursor() as cursor:
+        # Ранжируем только ограниченное число самых свежих совпадений, а сниппеты
+        # (ts_headline — самая дорогая часть) строим лишь для строк страницы
+        cursor.execute('WITH q AS (SELECT websearch_to_tsquery(%s::regconfig, %s) AS query), '
+                       'candidates AS ('
+                       '    SELECT m.id, m.room_id, m.user_id, m.content, m.timestamp, m.search_vector '
+                       '    FROM "ChatApp_db_message" m, q '
+                       '    WHERE m.search_vector @@ q.query '
+                       '    AND m.room_id IN (SELECT room_id FROM "ChatApp_room_users" WHERE user_id = %s) '
+                       + filters +
+                       '    ORDER BY m.id DESC LIMIT %s'
+                       '), ranked AS ('
+                       '    SELECT c.*, ts_rank_cd(c.search_vector, q.query) AS rank, '
+                       '           count(*) OVER () AS candidates, min(c.id) OVER () AS oldest_id '
+                       '    FROM candidates c, q '
+                       '    ORDER BY rank DESC, c.id DESC LIMIT %s OFFSET %s'
+                       ') '
+                       'SELECT r.id, r.room_id, u.username, r.timestamp, r.rank, '
+                       '       ts_headline(%s::regconfig, translate(r.content, %s, \'\'), q.query, %s), '
+                       '       r.candidates, r.oldest_id '
+                       'FROM ranked r JOIN "auth_user" u ON u.id = r.user_id, q '
+                       'ORDER BY r.rank DESC, r.id DESC', params)
+        rows = cursor.fetchall()
+
+    # Совпадений больше, чем ранжируется за раз: более старые доступны по ?before_id=next_before_id
+    truncated = bool(rows) and rows[0][6] >= max_candidates
+    return Response({
+        'results': [{
+            'id': message_id,
+            'room': message_room_id,
+            'user': username,
+            'datetime': timestamp,
+            'rank': rank,
+            'snippet': highlight(snippet),
+        } for message_id, message_room_id, username, timestamp, rank, snippet, _count, _oldest in rows[:page_size]],
+        'page': page,
+        'has_more': len(rows) > page_size,
+        'truncated': truncated,
+        'next_before_id': rows[0][7] if truncated else None,
+    })
+
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_chat(request, room_id):
-    user_id = request.user.id
-    with connection.cursor() as cursor:
-        cursor.execute('DELETE FROM "ChatApp_room_users"  WHERE room_id = %s AND user_id = %s', [room_id, user_id])
-        return Response({'status': 'Done'}, status=status.HTTP_202_ACCEPTED)
+    # Выход из комнаты: сокеты пользователя в ней закрываются так же, как при удалении участников
+    remove_members(room_id, [request.user.id])
+    return Response({'status': 'Done'}, status=status.HTTP_202_ACCEPTED)
+
+
+# Потоковая выгрузка истории комнаты в NDJSON (опционально gzip) для архивов и миграций
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_history(request, room_id):
+    params = request.query_params
+    try:
+        after_id, before_id, since, until = export_bounds(params)
+    except ValueError:
+        return Response({'error': 'Некорректные границы выгрузки.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not Room_users.objects.filter(room_id=room_id, user=request.user).exists():
+        return Response({'error': 'Комната не найдена.'}, status=status.HTTP_404_NOT_FOUND)
+    compress = params.get('compress') == 'gzip'
+    batches = export_batches(room_id, after_id, before_id, since, until, compress=compress)
+    response = StreamingHttpResponse(aiter_batches(batches),
+                                     content_type='application/gzip' if compress else 'application/x-ndjson')
+    file_name = f'room-{room_id}.ndjson' + ('.gz' if compress else '')
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
+
+def export_bounds(params):
+    """(after_id, before_id, since, until) из параметров; время без пояса считается UTC."""
+    bounds = [int(params[key]) if params.get(key) else None for key in ('after_id', 'before_id')]
+    for key in ('since', 'until'):
+        value = None
+        if params.get(key):
+            value = parse_datetime(params[key])
+            if value is None:
+                raise ValueError(key)
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value, datetime.timezone.utc)
+        bounds.append(value)
+    return bounds
+
+
+# Состояние очереди отложенной записи сообщений текущего воркера
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def write_behind_stats(request):
+    return Response(message_writer.stats())
+
+
+# Сессия загрузки вложения: клиент узнаёт размер части и шлёт части по одной
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_attachment(request):
+    data = request.data
+    try:
+        room_id = int(data['room_id'])
+        size = int(data['size'])
+        file_name = os.path.basename(str(data['file_name']))[:255]
+    except (KeyError, TypeError, ValueError):
+        return Response({'error': 'Нужны room_id, file_name и size.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 < size <= settings.CHAT_ATTACHMENTS['max_size']:
+        return Response({'error': 'Недопустимый размер файла.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not Room_users.objects.filter(room_id=room_id, user=request.user).exists():
+        return Response({'error': 'Комната не найдена.'}, status=status.HTTP_404_NOT_FOUND)
+    attachment = Attachment.objects.create(
+        room_id=room_id, user=request.user, file_name=file_name, size=size,
+        content_type=str(data.get('content_type') or 'application/octet-stream')[:255],
+        chunk_size=settings.CHAT_ATTACHMENTS['chunk_size'],
+    )
+    return Response(attachment_status(attachment), status=status.HTTP_201_CREATED)
+
+
+# Состояние загрузки: по списку принятых частей клиент продолжает после обрыва
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def attachment_detail(request, attachment_id):
+    attachment = Attachment.objects.filter(id=attachment_id, user=request.user).first()
+    if attachment is None:
+        return Response({'error': 'Вложение не найдено.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(attachment_status(attachment))
+
+
+# Часть файла: тело запроса (application/octet-stream) пишется в хранилище потоком
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated])
+def upload_attachment_chunk(request, attachment_id, index):
+    attachment = Attachment.objects.filter(id=attachment_id, user=request.user).first()
+    if attachment is None:
+        return Response({'error': 'Вложение не найдено.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        attachments.save_chunk(attachment, index, request.stream, length)
+    except (ValueError, attachments.AttachmentError) as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'index': index}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def complete_attachment(request, attachment_id):
+    attachment = Attachment.objects.filter(id=attachment_id, user=request.user).first()
+    if attachment is None:
+        return Response({'error': 'Вложение не найдено.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        attachment = attachments.complete(attachment)
+    except attachments.AttachmentError as error:
+        return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(attachments.sign(attachments.describe(attachment)))
+
+
+def attachment_status(attachment):
+    return {
+        'id': str(attachment.id),
+        'status': attachment.status,
+        'size': attachment.size,
+        'chunk_size': attachment.chunk_size,
+        'chunk_count': attachment.chunk_count,
+        'received': sorted(attachment.chunks.values_list('index', flat=True)),
+    }
@@ -0,0 +1,35 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from components.accounts.models import ProfilePicture
+from components.accounts.services.avatars import process_upload
+
+
+class Command(BaseCommand):
+    help = ('Обрабатывает загрузки аватарок, ожидающие в очереди. Разово — после перезапуска воркера; '
+            'с --interval — постоянно, как обработчик по умолчанию (AVATARS["in_process"] = False).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Проверять очередь каждые N секунд, не завершаясь.')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.process_pending()
+            if options['interval'] is None:
+                self.stdout.write(self.style.SUCCESS(f'Обработано аватарок: {processed}'))
+                return
+            if processed:
+                self.stdout.write(f'Обработано аватарок: {processed}')
+            connections.close_all()  # между проходами соединение не держим
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def process_pending():
+        pending = (ProfilePicture.objects.filter(status=ProfilePicture.STATUS_PENDING)
+                   .exclude(pending_upload='').values_list('id', 'pending_upload'))
+        # Каталог загрузок у каждой машины свой: чужие файлы оставляем их машинам
+        return sum(process_upload(profile_id) for profile_id, path in pending if os.path.exists(path))
@@ -1,16 +1,77 @@
+from functools import lru_cache
+
 from django.conf import settings
+from django.utils.module_loading import import_string
 from storages.backends.s3boto3 import S3Boto3Storage
 from django.db import models
 from django.contrib.auth.models import User
 
 
+@lru_cache(maxsize=None)
+def get_avatar_storage():
+    """Хранилище превью аватарок (Django storage API: S3 или локальная ФС)."""
+    return import_string(settings.AVATARS['storage'])(**settings.AVATARS['options'])
+
+
+class Avatar(models.Model):
+    """Набор превью одной картинки. Ключ — sha256 содержимого, одинаковые загрузки делят превью."""
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def thumbnail_path(content_hash, size, fmt):
+        return f"{settings.AVATARS['prefix']}/{content_hash[:2]}/{content_hash}/{size}.{fmt}"
+
+    @staticmethod
+    def thumbnail_url(content_hash, size=None, fmt=None):
+        """URL превью наименьшего размера не меньше size (без size — самого большого)."""
+        sizes = sorted(settings.AVATARS['sizes'])
+        size = next((candidate for candidate in sizes if size is not None and candidate >= size), sizes[-1])
+        fmt = fmt if fmt in settings.AVATARS['formats'] else settings.AVATARS['formats'][0]
+        return get_avatar_storage().url(Avatar.thumbnail_path(content_hash, size, fmt))
+
+    class Meta:
+        app_label = 'accounts'
+
+
 class ProfilePicture(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [(STATUS_PENDING, 'pending'), (STATUS_READY, 'ready'), (STATUS_FAILED, 'failed')]
+
+    # Исходные файлы загрузок до появления превью; новые загрузки сюда не пишутся
     profile_picture = models.ImageField(storage=S3Boto3Storage(), null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    avatar = models.ForeignKey(Avatar, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_READY)
+    pending_upload = models.CharField(max_length=255, blank=True)  # файл во временном каталоге, ждёт обработки
+
+    @classmethod
+    def latest(cls, user_id, for_update=False):
+        """Самый новый профиль пользователя или None.
+
+        user — не уникальный ключ, и у старых пользователей бывает несколько
+        строк; как и запросы чата, берём последнюю.
+        """
+        profiles = cls.objects.select_for_update() if for_update else cls.objects
+        return profiles.filter(user_id=user_id).order_by('-id').first()
+
+    def get_avatar_url(self, size=None, fmt=None):
+        return self.build_avatar_url(self.profile_picture.name if self.profile_picture else None,
+                                     self.avatar_id, size, fmt)
+
+    @staticmethod
+    def build_avatar_url(name, avatar_hash=None, size=None, fmt=None):
+        """URL аватарки по полям профиля (для выборок без загрузки модели).
 
-    def get_avatar_url(self):
-        if self.profile_picture:
-            return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{self.profile_picture.name}"
+        Если превью готовы, возвращается превью подходящего размера, иначе —
+        исходный файл старой загрузки.
+        """
+        if avatar_hash:
+            return Avatar.thumbnail_url(avatar_hash, size, fmt)
+        if name:
+            return f"{settings.AWS_S3_ENDPOINT_URL}/{settings.AWS_STORAGE_BUCKET_NAME}/{name}"
         return None
 
     class Meta:
@@ -33,5 +33,4 @@ class ProfilePictureSerializer(serializers.ModelSerializer):
         extra_kwargs = {"profile_picture": {"write_only": True}}  # Не показываем сам файл в ответе
 
     def get_avatar_url(self, obj):
-        print('URLE*RURUKKLRUKj       ', obj.get_avatar_url())
         return obj.get_avatar_url()
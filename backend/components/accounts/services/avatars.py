@@ -0,0 +1,139 @@
+import hashlib
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from components.accounts.models import Avatar, ProfilePicture, get_avatar_storage
+from components.accounts.services.profile_cache import profile_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Параметры кодирования по формату; для форматов без прозрачности фон заливается белым
+ENCODERS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+    'png': {'format': 'PNG', 'optimize': True},
+}
+OPAQUE_FORMATS = {'jpeg'}
+
+
+def spool_upload(uploaded_file):
+    """Сохраняет загрузку во временный каталог (локальный диск) и возвращает путь."""
+    os.makedirs(settings.AVATARS['spool_dir'], exist_ok=True)
+    path = os.path.join(settings.AVATARS['spool_dir'], uuid.uuid4().hex)
+    with open(path, 'wb') as spool:
+        for chunk in uploaded_file.chunks():
+            spool.write(chunk)
+    return path
+
+
+def render_thumbnails(data):
+    """{(size, fmt): bytes} квадратных превью всех настроенных размеров и форматов."""
+    with Image.open(io.BytesIO(data)) as original:
+        original.seek(0)  # у анимированных картинок берём первый кадр
+        image = ImageOps.exif_transpose(original).convert('RGBA')
+    thumbnails = {}
+    for size in settings.AVATARS['sizes']:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        for fmt in settings.AVATARS['formats']:
+            frame = thumbnail
+            if fmt in OPAQUE_FORMATS:
+                frame = Image.new('RGB', thumbnail.size, (255, 255, 255))
+                frame.paste(thumbnail, mask=thumbnail.getchannel('A'))
+            buffer = io.BytesIO()
+            frame.save(buffer, **ENCODERS[fmt])
+            thumbnails[(size, fmt)] = buffer.getvalue()
+    return thumbnails
+
+
+def store_avatar(data):
+    """Создаёт превью картинки (если такой ещё не было) и возвращает её хэш."""
+    content_hash = hashlib.sha256(data).hexdigest()
+    if Avatar.objects.filter(pk=content_hash).exists():
+        return content_hash  # та же картинка уже загружалась — превью переиспользуются
+    storage = get_avatar_storage()
+    for (size, fmt), thumbnail in render_thumbnails(data).items():
+        path = Avatar.thumbnail_path(content_hash, size, fmt)
+        if not storage.exists(path):
+            storage.save(path, ContentFile(thumbnail))
+    # Строка появляется только после всех файлов: её наличие значит «превью готовы»
+    Avatar.objects.get_or_create(pk=content_hash)
+    return content_hash
+
+
+def process_upload(profile_id):
+    """Обрабатывает ожидающую загрузку профиля; True, если превью готовы."""
+    profile = ProfilePicture.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.pending_upload:
+        return False
+    path = profile.pending_upload
+    try:
+        with open(path, 'rb') as spool:
+            data = spool.read()
+        content_hash = store_avatar(data)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        logger.exception("Не удалось обработать аватарку профиля %s", profile_id)
+        ProfilePicture.objects.filter(pk=profile_id, pending_upload=path).update(
+            status=ProfilePicture.STATUS_FAILED, pending_upload='')
+        discard_upload(path)
+        return False
+    # Пока шла обработка, пользователь мог загрузить новую картинку — тогда эта уже не нужна
+    updated = ProfilePicture.objects.filter(pk=profile_id, pending_upload=path).update(
+        avatar_id=content_hash, status=ProfilePicture.STATUS_READY, pending_upload='')
+    discard_upload(path)
+    if updated:
+        profile_cache.publish_invalidation(profile.user_id)
+    return bool(updated)
+
+
+def discard_upload(path):
+    """Удаляет файл загрузки из временного каталога."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class AvatarPipeline:
+    """Фоновая обработка загруженных аватарок в пуле потоков воркера (AVATARS['in_process']).
+
+    Задание — id профиля; всё нужное для него лежит в БД (pending_upload),
+    поэтому без пула, как и после перезапуска, загрузки обрабатывает
+    команда process_avatars.
+    """
+
+    def __init__(self, workers=2, in_process=False):
+        self.workers = workers
+        self.in_process = in_process
+        self._executor = None
+
+    def submit(self, profile_id):
+        """Ставит обработку в очередь после фиксации текущей транзакции (только при in_process)."""
+        if not self.in_process:
+            return
+        transaction.on_commit(lambda: self._get_executor().submit(self._run, profile_id))
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='avatars')
+        return self._executor
+
+    @staticmethod
+    def _run(profile_id):
+        try:
+            process_upload(profile_id)
+        except Exception:
+            logger.exception("Ошибка фоновой обработки аватарки профиля %s", profile_id)
+        finally:
+            connections.close_all()  # соединения потока пула не переживают задание
+
+
+avatar_pipeline = AvatarPipeline(workers=settings.AVATARS['workers'], in_process=settings.AVATARS['in_process'])
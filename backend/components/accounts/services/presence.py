@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Presence:
+    """Присутствие пользователей в комнатах на sorted set'ах со score = время heartbeat.
+
+    Участник — отдельное соединение ("user|connection"), поэтому закрытие одной
+    вкладки не выкидывает пользователя, пока открыта другая. Воркер раз в
+    heartbeat_interval секунд одним пайплайном продлевает все свои соединения;
+    записи, не продлённые дольше ttl (упавший воркер, потерянный disconnect),
+    читатели не видят, а следующий heartbeat комнаты их вычищает.
+    """
+
+    def __init__(self, ttl=60, heartbeat_interval=20):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+        self.sync_client = redis.StrictRedis(**settings.REDIS_CONFIG, decode_responses=True)
+        self._local = set()  # (room, member) соединений этого воркера
+        self._task = None
+
+    @staticmethod
+    def key(room):
+        return f'presence:{room}'
+
+    @staticmethod
+    def member(user, connection):
+        return f'{user}|{connection}'
+
+    async def join(self, room, user, connection):
+        member = self.member(user, connection)
+        self._local.add((room, member))
+        self._ensure_task()
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                self._touch(pipe, room, [member], time.time())
+                await pipe.execute()
+        except redis.RedisError:
+            logger.exception("Не удалось отметить присутствие в %s", room)
+
+    async def leave(self, room, user, connection):
+        member = self.member(user, connection)
+        self._local.discard((room, member))
+        try:
+            await self.client.zrem(self.key(room), member)
+        except redis.RedisError:
+            # Запись сама перестанет считаться живой через ttl
+            logger.exception("Не удалось снять присутствие в %s", room)
+
+    async def aonline(self, room):
+        """Пользователи, присутствующие в комнате."""
+        try:
+            members = await self.client.zrangebyscore(self.key(room), time.time() - self.ttl, '+inf')
+        except redis.RedisError:
+            logger.exception("Присутствие недоступно (%s)", room)
+            return []
+        return self._users(members)
+
+    def online_many(self, rooms):
+        """{room: [пользователи]} для нескольких комнат за один round trip (синхронно, для представлений)."""
+        rooms = list(rooms)
+        since = time.time() - self.ttl
+        try:
+            with self.sync_client.pipeline(transaction=False) as pipe:
+                for room in rooms:
+                    pipe.zrangebyscore(self.key(room), since, '+inf')
+                results = pipe.execute()
+        except redis.RedisError:
+            logger.exception("Присутствие недоступно")
+            return {room: [] for room in rooms}
+        return {room: self._users(members) for room, members in zip(rooms, results)}
+
+    @staticmethod
+    def _users(members):
+        return sorted({member.rsplit('|', 1)[0] for member in members})
+
+    def _touch(self, pipe, room, members, now):
+        key = self.key(room)
+        pipe.zadd(key, {member: now for member in members})
+        pipe.zremrangebyscore(key, '-inf', now - self.ttl)
+        pipe.expire(key, self.ttl)
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            rooms = {}
+            for room, member in self._local:
+                rooms.setdefault(room, []).append(member)
+            if not rooms:
+                continue
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    now = time.time()
+                    for room, members in rooms.items():
+                        self._touch(pipe, room, members, now)
+                    await pipe.execute()
+            except redis.RedisError:
+                logger.exception("Не удалось продлить присутствие %s соединений", len(self._local))
+
+
+presence = Presence(**settings.PRESENCE)
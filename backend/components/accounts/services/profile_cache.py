@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from config.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'profile_cache:invalidate'
+
+
+class ProfileCache:
+    """Процессный LRU+TTL кэш (username, avatar_url) по id пользователя.
+
+    Один экземпляр на воркер, общий для всех консьюмеров. Инвалидация приходит
+    либо локально, либо через Redis pub/sub от других воркеров.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (expires_at, username, avatar_url)
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, user_id, username, avatar_url):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, username, avatar_url)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def collect_metrics(self):
+        stats = self.stats()
+        return [
+            ('profile_cache_size', 'gauge', 'Записей в кэше профилей.', {(): stats['size']}),
+            ('profile_cache_hits_total', 'counter', 'Попадания в кэш профилей.', {(): stats['hits']}),
+            ('profile_cache_misses_total', 'counter', 'Промахи кэша профилей.', {(): stats['misses']}),
+            ('profile_cache_evictions_total', 'counter', 'Вытеснения из кэша профилей.', {(): stats['evictions']}),
+        ]
+
+    def publish_invalidation(self, user_id):
+        """Сбрасывает запись локально и рассылает инвалидацию остальным воркерам."""
+        self.invalidate(user_id)
+        try:
+            client = redis.StrictRedis(**settings.REDIS_CONFIG)
+            client.publish(INVALIDATION_CHANNEL, str(user_id))
+        except redis.RedisError:
+            logger.exception("Не удалось опубликовать инвалидацию профиля %s", user_id)
+
+    def start_listener(self):
+        """Запускает (один раз на event loop) подписку на инвалидации из Redis."""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(INVALIDATION_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.invalidate(int(message['data']))
+            except (redis.RedisError, OSError):
+                # Пропущенные за это время инвалидации покрывает TTL записей
+                logger.warning("Подписка на инвалидации профилей потеряна, переподключение")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+profile_cache = ProfileCache(**settings.PROFILE_CACHE)
+registry.add_collector(profile_cache.collect_metrics)
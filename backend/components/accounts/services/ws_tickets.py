@@ -0,0 +1,66 @@
+import logging
+import time
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.exceptions import PermissionDenied
+
+
+logger = logging.getLogger(__name__)
+
+TICKET_SALT = 'ws-ticket'
+
+
+def _revoked_key(user_id):
+    return f'ws:revoked:{user_id}'
+
+
+def issue_ticket(user):
+    """Короткоживущий HMAC-подписанный билет для подключения к WebSocket.
+
+    Выдаётся только активному пользователю; флаг активности едет в билете,
+    потому что при подключении пользователь из БД не читается.
+    """
+    if not user.is_active:
+        raise PermissionDenied('user is inactive')
+    payload = {'id': user.id, 'username': user.username, 'active': True, 'iat': time.time()}
+    return signing.dumps(payload, salt=TICKET_SALT)
+
+
+def revoke_tickets(user_id):
+    """Отзывает все билеты пользователя, выданные до текущего момента (deny-list в Redis)."""
+    try:
+        client = redis.StrictRedis(**settings.REDIS_CONFIG)
+        client.set(_revoked_key(user_id), time.time(), ex=settings.WS_TICKET_TTL)
+    except redis.RedisError:
+        logger.exception("Не удалось отозвать WebSocket-билеты пользователя %s", user_id)
+
+
+class TicketVerifier:
+    """Проверяет билеты без обращения к БД: подпись и срок — в памяти, отзыв — одним GET в Redis."""
+
+    def __init__(self):
+        self.client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+
+    async def verify(self, ticket):
+        """Активный пользователь из билета (несохранённый экземпляр User с id и username) или None."""
+        try:
+            payload = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.WS_TICKET_TTL)
+        except signing.BadSignature:
+            return None
+        if not payload.get('active'):
+            return None
+        try:
+            revoked_at = await self.client.get(_revoked_key(payload['id']))
+        except redis.RedisError:
+            logger.exception("Deny-list билетов недоступен")
+            return None
+        if revoked_at is not None and payload['iat'] <= float(revoked_at):
+            return None
+        return User(id=payload['id'], username=payload['username'], is_active=True)
+
+
+ticket_verifier = TicketVerifier()
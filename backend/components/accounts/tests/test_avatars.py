@@ -0,0 +1,82 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from components.accounts.models import Avatar, ProfilePicture, get_avatar_storage
+from components.accounts.services.avatars import avatar_pipeline
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class ProfilePictureViewTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir, ignore_errors=True)
+        avatars = override_settings(AVATARS={
+            **settings.AVATARS, 'spool_dir': spool_dir, 'sizes': [32], 'formats': ['png'],
+            'storage': 'django.core.files.storage.FileSystemStorage', 'options': {'location': spool_dir},
+        })
+        avatars.enable()
+        self.addCleanup(avatars.disable)
+        get_avatar_storage.cache_clear()
+        self.addCleanup(get_avatar_storage.cache_clear)
+        self.user = self.create_user('alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_upload_with_duplicate_profiles_updates_latest(self):
+        ProfilePicture.objects.create(user=self.user)
+        latest = ProfilePicture.objects.create(user=self.user)
+        with mock.patch('components.accounts.views.avatar_pipeline.submit') as submit:
+            response = self.client.post('/user/profile/', {
+                'avatar': SimpleUploadedFile('avatar.png', b'not really a png', content_type='image/png'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        submit.assert_called_once_with(latest.id)
+        latest.refresh_from_db()
+        self.assertEqual(latest.status, ProfilePicture.STATUS_PENDING)
+        self.assertTrue(latest.pending_upload.startswith(settings.AVATARS['spool_dir']))
+
+    def test_first_upload_creates_profile(self):
+        with mock.patch('components.accounts.views.avatar_pipeline.submit'):
+            response = self.client.post('/user/profile/', {
+                'avatar': SimpleUploadedFile('avatar.png', b'not really a png', content_type='image/png'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ProfilePicture.objects.filter(user=self.user).count(), 1)
+
+    def test_get_with_duplicate_profiles(self):
+        ProfilePicture.objects.create(user=self.user, status=ProfilePicture.STATUS_FAILED)
+        ProfilePicture.objects.create(user=self.user, status=ProfilePicture.STATUS_PENDING)
+        response = self.client.get('/user/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], ProfilePicture.STATUS_PENDING)
+
+    def test_get_without_profile(self):
+        response = self.client.get('/user/profile/')
+        self.assertEqual(response.data, {'username': 'alice', 'avatar_url': None})
+
+    def test_upload_is_left_to_process_avatars_by_default(self):
+        image = io.BytesIO()
+        Image.new('RGB', (40, 40), (200, 0, 0)).save(image, 'PNG')
+        with mock.patch.object(avatar_pipeline, '_get_executor') as get_executor:
+            response = self.client.post('/user/profile/', {
+                'avatar': SimpleUploadedFile('avatar.png', image.getvalue(), content_type='image/png'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        get_executor.assert_not_called()  # воркер ASGI картинки не рисует
+        profile = ProfilePicture.latest(self.user.id)
+        self.assertEqual(profile.status, ProfilePicture.STATUS_PENDING)
+
+        call_command('process_avatars', stdout=io.StringIO())
+        profile.refresh_from_db()
+        self.assertEqual(profile.status, ProfilePicture.STATUS_READY)
+        self.assertTrue(get_avatar_storage().exists(Avatar.thumbnail_path(profile.avatar_id, 32, 'png')))
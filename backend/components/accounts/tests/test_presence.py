@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from rest_framework.test import APIClient
+
+from components.accounts.services.presence import presence
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class PresenceTests(ChatTestCase):
+    async def test_user_stays_online_until_last_connection_leaves(self):
+        await presence.join('chat:1', 7, 'tab-1')
+        await presence.join('chat:1', 7, 'tab-2')
+        await presence.leave('chat:1', 7, 'tab-1')
+        self.assertEqual(await presence.aonline('chat:1'), ['7'])
+        await presence.leave('chat:1', 7, 'tab-2')
+        self.assertEqual(await presence.aonline('chat:1'), [])
+
+    async def test_stale_connections_expire(self):
+        # Соединение упавшего воркера: disconnect не пришёл, heartbeat больше не продлевает
+        await presence.client.zadd(presence.key('chat:1'), {presence.member(8, 'lost'): time.time() - presence.ttl - 1})
+        await presence.join('chat:1', 7, 'tab-1')
+        self.assertEqual(await presence.aonline('chat:1'), ['7'])
+        self.assertEqual(await presence.client.zcard(presence.key('chat:1')), 1)  # join вычистил устаревшую запись
+        self.assertLessEqual(await presence.client.ttl(presence.key('chat:1')), presence.ttl)
+        await presence.leave('chat:1', 7, 'tab-1')
+
+    async def test_heartbeat_renews_local_connections(self):
+        self.addCleanup(setattr, presence, 'heartbeat_interval', presence.heartbeat_interval)
+        presence.heartbeat_interval = 0.05
+        await presence.join('chat:1', 7, 'tab-1')
+        await presence.client.zadd(presence.key('chat:1'), {presence.member(7, 'tab-1'): time.time() - presence.ttl})
+        await asyncio.sleep(0.2)
+        self.assertEqual(await presence.aonline('chat:1'), ['7'])
+        await presence.leave('chat:1', 7, 'tab-1')
+        presence._task.cancel()
+
+    def test_online_many_reads_several_rooms(self):
+        now = time.time()
+        presence.sync_client.zadd(presence.key('chat:1'), {'7|a': now, '8|b': now, '7|c': now})
+        presence.sync_client.zadd(presence.key('chat:2'), {'9|d': now - presence.ttl - 1})
+        self.assertEqual(presence.online_many(['chat:1', 'chat:2', 'chat:3']),
+                         {'chat:1': ['7', '8'], 'chat:2': [], 'chat:3': []})
+
+    def test_chat_list_reports_online_members(self):
+        alice, bob = self.create_user('alice'), self.create_user('bob')
+        room = self.create_room(alice, bob)
+        presence.sync_client.zadd(presence.key(f'chat:{room.id}'), {f'{bob.id}|tab': time.time()})
+        client = APIClient()
+        client.force_authenticate(alice)
+        self.assertEqual(client.get('/chat/list/').data[0]['online'], [bob.id])
@@ -0,0 +1,64 @@
+import asyncio
+from unittest import mock
+
+import redis.asyncio as aioredis
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from rest_framework.test import APIClient
+
+from components.accounts.services.profile_cache import INVALIDATION_CHANNEL, ProfileCache, profile_cache
+from components.ChatApp.consumers import ChatRepository
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class ProfileCacheTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_user('alice')
+
+    def test_miss_loads_once_then_hits(self):
+        before = profile_cache.stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(async_to_sync(ChatRepository.get_profile)(self.alice.id), ('alice', None))
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(ChatRepository.get_profile)(self.alice.id), ('alice', None))
+        after = profile_cache.stats()
+        self.assertEqual((after['misses'] - before['misses'], after['hits'] - before['hits']), (1, 1))
+
+    def test_entries_expire_and_are_evicted(self):
+        cache = ProfileCache(max_size=2, ttl=60)
+        with mock.patch('components.accounts.services.profile_cache.time.monotonic', return_value=100):
+            for user_id in (1, 2, 3):
+                cache.set(user_id, f'user-{user_id}', None)
+            self.assertIsNone(cache.get(1))  # вытеснена самая старая
+            self.assertEqual(cache.get(3), ('user-3', None))
+        with mock.patch('components.accounts.services.profile_cache.time.monotonic', return_value=161):
+            self.assertIsNone(cache.get(3))
+        self.assertEqual({key: cache.stats()[key] for key in ('size', 'hits', 'misses', 'evictions')},
+                         {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 1})
+
+    async def test_invalidation_from_another_worker(self):
+        profile_cache.start_listener()
+        await asyncio.sleep(0.1)  # подписка
+        profile_cache.set(self.alice.id, 'alice', '/old.png')
+        client = aioredis.StrictRedis(**settings.REDIS_CONFIG)
+        await client.publish(INVALIDATION_CHANNEL, str(self.alice.id))
+        await client.aclose()
+        for _ in range(50):
+            if profile_cache.get(self.alice.id) is None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(profile_cache.get(self.alice.id))
+        profile_cache._listener.cancel()
+
+    def test_stats_view_is_admin_only(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get('/user/profile/cache-stats/').status_code, 403)
+        admin = self.create_user('admin')
+        admin.is_staff = True
+        admin.save(update_fields=['is_staff'])
+        client.force_authenticate(admin)
+        response = client.get('/user/profile/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'size', 'max_size', 'hits', 'misses', 'evictions', 'invalidations'})
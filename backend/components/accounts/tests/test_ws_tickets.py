@@ -0,0 +1,64 @@
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core import signing
+from django.core.exceptions import PermissionDenied
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from config.middleware import TokenAuthMiddleware
+from components.accounts.services.ws_tickets import TICKET_SALT, issue_ticket, revoke_tickets, ticket_verifier
+from components.ChatApp.routing import application
+from components.ChatApp.tests.utils import ChatTestCase
+
+
+class TicketTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+        self.room = self.create_room(self.user)
+
+    def test_view_issues_ticket_for_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        response = client.post('/ws/ticket/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(signing.loads(response.data['ticket'], salt=TICKET_SALT)['id'], self.user.id)
+
+    def test_inactive_user_gets_no_ticket(self):
+        self.user.is_active = False
+        with self.assertRaises(PermissionDenied):
+            issue_ticket(self.user)
+
+    async def test_verify_returns_active_user(self):
+        user = await ticket_verifier.verify(issue_ticket(self.user))
+        self.assertEqual((user.id, user.username, user.is_active), (self.user.id, 'alice', True))
+
+    async def test_rejects_forged_expired_and_inactive_tickets(self):
+        ticket = issue_ticket(self.user)
+        self.assertIsNone(await ticket_verifier.verify(ticket[:-2] + 'xx'))
+        with override_settings(WS_TICKET_TTL=-1):
+            self.assertIsNone(await ticket_verifier.verify(ticket))
+        # Билет без флага активности (или с active=False) не принимается
+        unflagged = signing.dumps({'id': self.user.id, 'username': 'alice', 'iat': time.time()}, salt=TICKET_SALT)
+        self.assertIsNone(await ticket_verifier.verify(unflagged))
+
+    async def test_revoked_ticket_is_rejected(self):
+        ticket = issue_ticket(self.user)
+        revoke_tickets(self.user.id)
+        self.assertIsNone(await ticket_verifier.verify(ticket))
+
+    async def test_websocket_connects_with_ticket(self):
+        app = TokenAuthMiddleware(URLRouter(application))
+        communicator = WebsocketCommunicator(app, f'/ws/chat/{self.room.id}/?acks=1&ticket={issue_ticket(self.user)}')
+        connected, _subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'history')
+        await communicator.disconnect()
+
+        communicator = WebsocketCommunicator(app, f'/ws/chat/{self.room.id}/?acks=1&ticket=forged')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4003)
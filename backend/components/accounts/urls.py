@@ -1,10 +1,13 @@
 from django.urls import path
-from .views import RegisterView, LoginView, LogoutView, ProfilePictureViewSet
+from .views import RegisterView, LoginView, LogoutView, ProfilePictureViewSet, ProfileCacheStatsView, \
+    WebSocketTicketView
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
-    path('user/profile/', ProfilePictureViewSet.as_view(), name='profile')
+    path('ws/ticket/', WebSocketTicketView.as_view(), name='ws-ticket'),
+    path('user/profile/', ProfilePictureViewSet.as_view(), name='profile'),
+    path('user/profile/cache-stats/', ProfileCacheStatsView.as_view(), name='profile-cache-stats'),
 ]
 
@@ -1,18 +1,21 @@
 import logging
+from django.conf import settings
 from rest_framework import generics
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from django.contrib.auth import authenticate
 from rest_framework.permissions import AllowAny
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
-from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.db import transaction
 
 from .models import ProfilePicture
 from .serializers import RegisterSerializer
+from .services.avatars import avatar_pipeline, discard_upload, spool_upload
+from .services.profile_cache import profile_cache
+from .services.ws_tickets import issue_ticket, revoke_tickets
 
 
 logger = logging.getLogger(__name__)
@@ -41,8 +44,7 @@ class LoginView(APIView):
         user = authenticate(username=username, password=password)
         if user is not None:
             token = Token.objects.get_or_create(user=user)
-            print('Вход: ', token)
-            print(user)
+            logger.debug("Вход пользователя %s", user.id)
             return Response({'token': token[0].key})
         return Response({'error': 'Invalid Credentials'}, status=400)
 
@@ -56,11 +58,20 @@ class LogoutView(APIView):
             token = Token.objects.get(user=request.user)
             # Удаляем токен, чтобы завершить сеанс
             token.delete()
+            revoke_tickets(request.user.id)
             return Response({'message': 'Logged out successfully'}, status=200)
         except Token.DoesNotExist:
             return Response({'error': 'Token not found'}, status=400)
 
 
+class WebSocketTicketView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Билет передаётся в ?ticket= при подключении к WebSocket вместо токена
+        return Response({'ticket': issue_ticket(request.user), 'expires_in': settings.WS_TICKET_TTL})
+
+
 class ProfilePictureViewSet(APIView):
     parser_classes = [MultiPartParser]  # Позволяет загружать файлы
     permission_classes = [IsAuthenticated]
@@ -72,27 +83,55 @@ class ProfilePictureViewSet(APIView):
             logger.error("Файл не передан в запросе")
             return Response({"error": "Файл не передан"}, status=status.HTTP_400_BAD_REQUEST)
 
-        profile, created = ProfilePicture.objects.get_or_create(user=user)
-        # Проверяем, передаётся ли файл
         uploaded_file = request.FILES["avatar"]
         logger.info(f"Файл получен: {uploaded_file.name}, размер: {uploaded_file.size} байт")
+        if uploaded_file.size > settings.AVATARS['max_upload_size']:
+            return Response({"error": "Файл слишком большой"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Превью строятся в фоне; до их готовности отдаётся прежняя аватарка
+        path = spool_upload(uploaded_file)
+        with transaction.atomic():
+            profile = ProfilePicture.latest(user.id, for_update=True)
+            if profile is None:
+                profile = ProfilePicture.objects.create(user=user)
+            previous = profile.pending_upload
+            profile.pending_upload = path
+            profile.status = ProfilePicture.STATUS_PENDING
+            profile.save(update_fields=['pending_upload', 'status'])
+            avatar_pipeline.submit(profile.id)
+        if previous:
+            discard_upload(previous)  # предыдущая загрузка ещё не обработана и уже не нужна
 
-        # Сохраняем файл
-        profile.profile_picture = uploaded_file
-        profile.save()
-        logger.info(f"Файл сохранён в S3: {profile.profile_picture.name}")
+        return Response({
+            "status": profile.status,
+            "avatar_url": profile.get_avatar_url(self.requested_size(request)),
+        }, status=status.HTTP_202_ACCEPTED)
 
-        return Response({"avatar_url": profile.get_avatar_url()}, status=status.HTTP_201_CREATED)
+    @staticmethod
+    def requested_size(request):
+        try:
+            return int(request.query_params['size'])
+        except (KeyError, ValueError):
+            return None
 
     def get(self, request):
-        try:
-            profile_picture = get_object_or_404(ProfilePicture, user_id=request.user.id)
-            return Response({
-                'username': request.user.username,
-                "avatar_url": profile_picture.get_avatar_url()
-            })
-        except Http404:
+        profile_picture = ProfilePicture.latest(request.user.id)
+        if profile_picture is None:
             return Response({
                 'username': request.user.username,
                 "avatar_url": None
             })
+        return Response({
+            'username': request.user.username,
+            "avatar_url": profile_picture.get_avatar_url(self.requested_size(request),
+                                                         request.query_params.get('fmt')),
+            "status": profile_picture.status,
+        })
+
+
+class ProfileCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Счётчики кэша профилей текущего воркера
+        return Response(profile_cache.stats())
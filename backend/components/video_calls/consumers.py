@@ -1,9 +1,18 @@
-import json
+import asyncio
+import logging
 import uuid
 from abc import ABC, abstractmethod
+import redis
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 
-from backend.components.video_calls.services.redis_service import RedisService
+from components.accounts.services.presence import presence
+from components.video_calls.services.redis_service import RedisService
+from config.metrics import channel_layer_seconds, command_seconds, open_sockets
+from config.wire import PROTOCOL_ERROR_CLOSE_CODE, WireCodec
+
+
+logger = logging.getLogger(__name__)
 
 
 class Command(ABC):
@@ -16,27 +25,23 @@ class Command(ABC):
 class CreateCallCommand(Command):
     async def execute(self, consumer: 'VideoCallConsumer', data: dict):
         consumer.call_id = str(uuid.uuid4())
-        await consumer.channel_layer.group_add(consumer.call_id, consumer.channel_name)
-        #redis = get_redis_connection("default")
-        #await redis.sadd(f"call_users:{self.room_id}", self.user.id)
-        await consumer.send(text_data=json.dumps({
+        with channel_layer_seconds.time(operation='group_add'):
+            await consumer.channel_layer.group_add(consumer.call_id, consumer.channel_name)
+        await consumer.send_frame({
             'type': 'call-created',
             'target': data.get('target'),
             'from': data.get('from'),
             'callId': consumer.call_id
-        }))
-        consumer.redis_service.add_user_to_room(consumer.room_id, consumer.user.username)
+        })
+        await consumer.join_call_presence()
 
 
 class CallInviteCommand(Command):
     async def execute(self, consumer: 'VideoCallConsumer', data: dict):
-        await consumer.channel_layer.group_send(
-            consumer.room_id,
-            {
-                'type': 'call_invite',
-                'message': data
-            }
-        )
+        await consumer.send_to_user(data.get('target'), {
+            'type': 'call_invite',
+            'message': data
+        })
 
 
 class IceCandidateCommand(Command):
@@ -57,15 +62,14 @@ class CallAnswerCommand(Command):
 class ParticipantLeftCommand(Command):
     async def execute(self, consumer: 'VideoCallConsumer', data: dict):
         await consumer.send_to_group_handler(data)
-        print(type(data.get('form')))
-        print(type(consumer.room_id))
-        consumer.redis_service.remove_user_from_room(consumer.room_id, data.get('form'))
+        # Уходит всегда сам отправитель, поэтому снимаем его соединение, а не data['from']
+        await consumer.leave_call_presence()
 
 
 class ParticipantJoinedCommand(Command):
     async def execute(self, consumer: 'VideoCallConsumer', data: dict):
         await consumer.send_to_group_handler(data)
-        consumer.redis_service.add_user_to_room(consumer.room_id, consumer.user.username)
+        await consumer.join_call_presence()
 
 
 class CallParticipantCommand(Command):
@@ -80,9 +84,8 @@ class CallCreatedCommand(Command):
 
 class GetParticipantCommand(Command):
     async def execute(self, consumer: 'VideoCallConsumer', data: dict):
-        participants = consumer.redis_service.get_users_in_room(consumer.room_id)
-        participants_decoded = [participant.decode("utf-8") for participant in participants]
-        await consumer.send_to_group_handler(data=participants_decoded)
+        participants = await presence.aonline(f'call:{consumer.call_id}') if consumer.call_id else []
+        await consumer.send_to_group_handler(data=participants)
 
 
 class VideoCallCommandHandler:
@@ -105,66 +108,118 @@ class VideoCallCommandHandler:
     async def handle(self, data):
         command = data.get("type")
         if command in self.commands:
-            await self.commands[command].execute(data=data, consumer=self.consumer)
+            with command_seconds.time(consumer='call', command=command):
+                await self.commands[command].execute(data=data, consumer=self.consumer)
         else:
-            print(f"Unhandled message type: {data}")
+            logger.warning("Unhandled message type: %s", command)
 
 
 class VideoCallConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
-        super().__init__(args, kwargs)
+        super().__init__(*args, **kwargs)
         self.user = None
         self.room_id = None
         self.call_id = None
         self.command_handler = VideoCallCommandHandler(consumer=self)
         self.redis_service = RedisService()
+        self.heartbeat = None  # задача продления записи канала в реестре
+        self.presence_room = None  # звонок, в котором отмечено присутствие
+        self.accepted = False
 
     async def connect(self):
         self.user = self.scope['user']
         self.room_id = 'general_group'
         self.call_id = None
-        await self.channel_layer.group_add(self.room_id, self.channel_name)
-        await self.accept()
+        self.wire = WireCodec.negotiate(self.scope)
+        # Адресные сигналы (приглашения, ICE, ответы) идут прямо в каналы получателя
+        await self.redis_service.register_channel(self.user.username, self.channel_name,
+                                                  settings.VIDEO_CALL_CHANNEL_TTL)
+        self.heartbeat = asyncio.create_task(self.keep_channel_registered())
+        await self.accept(subprotocol=self.wire.subprotocol)
+        self.accepted = True
+        open_sockets.inc(consumer='call')
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.room_id, self.channel_name)
-
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if not self.accepted:
+            return  # подключение оборвалось до accept: в счётчике соединения нет
+        open_sockets.dec(consumer='call')
+        await self.leave_call_presence()
+        await self.redis_service.unregister_channel(self.user.username, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.wire.decode(text_data, bytes_data)
+        except ValueError:
+            await self.close(code=PROTOCOL_ERROR_CLOSE_CODE)
+            return
         await self.command_handler.handle(data)
 
+    async def keep_channel_registered(self):
+        """Продлевает запись канала, пока сокет открыт, даже если клиент молчит.
+
+        Без этого молчащий участник выпадал бы из реестра через
+        VIDEO_CALL_CHANNEL_TTL, и приглашения и сигналы к нему терялись бы.
+        """
+        while True:
+            await asyncio.sleep(settings.VIDEO_CALL_CHANNEL_TTL / 2)
+            try:
+                await self.redis_service.register_channel(self.user.username, self.channel_name,
+                                                          settings.VIDEO_CALL_CHANNEL_TTL)
+            except redis.RedisError:
+                logger.exception("Не удалось продлить канал звонков пользователя %s", self.user.username)
+
+    async def join_call_presence(self):
+        room = f'call:{self.call_id}'
+        if self.presence_room != room:
+            await self.leave_call_presence()  # при переходе в другой звонок не оставляем старую запись
+            self.presence_room = room
+            await presence.join(room, self.user.username, self.channel_name)
+
+    async def leave_call_presence(self):
+        if self.presence_room is not None:
+            await presence.leave(self.presence_room, self.user.username, self.channel_name)
+            self.presence_room = None
+
+    async def send_frame(self, data):
+        await self.send(**self.wire.encode(data))
+
+    async def send_to_user(self, username, event):
+        for channel_name in await self.redis_service.get_user_channels(username):
+            with channel_layer_seconds.time(operation='send'):
+                await self.channel_layer.send(channel_name, event)
+
     async def send_to_target_handler(self, data):
-        await self.channel_layer.group_send(
-            self.call_id,
-            {
-                'type': 'send_to_target',
-                'message': data
-            }
-        )
+        await self.send_to_user(data.get('target'), {
+            'type': 'send_to_target',
+            'message': data
+        })
 
     async def send_to_group_handler(self, data):
-        await self.channel_layer.group_send(
-            self.call_id,
-            {
-                'type': 'send_signal',
-                'message': data
-            }
-        )
+        with channel_layer_seconds.time(operation='group_send'):
+            await self.channel_layer.group_send(
+                self.call_id,
+                {
+                    'type': 'send_signal',
+                    'message': data
+                }
+            )
 
     async def send_to_target(self, event):
         data = event['message']
         target = data.get('target')
         if target == self.user.username:
-            await self.send(text_data=json.dumps(event["message"]))
+            await self.send_frame(event["message"])
 
     async def call_invite(self, event):
         data = event['message']
         target = data.get('target')
         if target == self.user.username:
             self.call_id = data.get('callId')
-            await self.channel_layer.group_add(self.call_id, self.channel_name)
-            await self.send(text_data=json.dumps(event["message"]))
+            with channel_layer_seconds.time(operation='group_add'):
+                await self.channel_layer.group_add(self.call_id, self.channel_name)
+            await self.send_frame(event["message"])
 
     async def send_signal(self, event):
-        print(event)
-        await self.send(text_data=json.dumps(event["message"]))
+        await self.send_frame(event["message"])
@@ -1,16 +1,47 @@
 from django.conf import settings
-import redis
+import redis.asyncio as redis
+
+
+_connection_pool = None
+
+
+def get_connection_pool():
+    """Один асинхронный пул соединений на воркер, настроенный из REDIS_CONFIG."""
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = redis.BlockingConnectionPool(**settings.REDIS_CONFIG)
+    return _connection_pool
 
 
 class RedisService:
-    def __init__(self, host='localhost', port=6379, db=0):
-        self.client = redis.StrictRedis(host=host, port=port, db=db)
+    def __init__(self):
+        self.client = redis.StrictRedis(connection_pool=get_connection_pool())
+
+    @staticmethod
+    def user_channels_key(username):
+        return f'call:channels:{username}'
+
+    async def register_channel(self, username, channel_name, ttl):
+        """Запоминает канал пользователя (у одного пользователя может быть несколько вкладок)."""
+        key = self.user_channels_key(username)
+        async with self.pipeline() as pipe:
+            pipe.hset(key, channel_name, 1)
+            pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def unregister_channel(self, username, channel_name):
+        await self.client.hdel(self.user_channels_key(username), channel_name)
 
-    def add_user_to_room(self, room_name, username):
-        self.client.sadd(room_name, username)
+    async def get_user_channels(self, username):
+        channels = await self.client.hkeys(self.user_channels_key(username))
+        return [channel.decode('utf-8') for channel in channels]
 
-    def remove_user_from_room(self, room_name: str, username: str):
-        self.client.srem(room_name, username)
+    def pipeline(self, transaction=True):
+        """Пайплайн для обновления нескольких ключей за один round trip.
 
-    def get_users_in_room(self, room_name):
-        return self.client.smembers(room_name)
+        async with redis_service.pipeline() as pipe:
+            pipe.sadd(...)
+            pipe.srem(...)
+            await pipe.execute()
+        """
+        return self.client.pipeline(transaction=transaction)
@@ -0,0 +1,58 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from config.metrics import open_sockets
+from components.ChatApp.tests.utils import ChatTestCase
+from components.video_calls.consumers import VideoCallConsumer
+from components.video_calls.routing import application
+
+
+def open_call_sockets():
+    return open_sockets._values.get(open_sockets._key({'consumer': 'call'}), 0)
+
+
+class VideoCallConsumerTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('alice')
+
+    async def test_open_sockets_follow_accepted_connections(self):
+        before = open_call_sockets()
+        communicator = WebsocketCommunicator(URLRouter(application), '/ws/call/')
+        communicator.scope['user'] = self.user
+        connected, _subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(open_call_sockets(), before + 1)
+        await communicator.disconnect()
+        self.assertEqual(open_call_sockets(), before)
+
+    async def test_disconnect_before_accept_keeps_gauge(self):
+        before = open_call_sockets()
+        consumer = VideoCallConsumer()
+        consumer.scope = {'type': 'websocket', 'user': self.user}
+        await consumer.disconnect(1006)
+        self.assertEqual(open_call_sockets(), before)
+
+    @override_settings(VIDEO_CALL_CHANNEL_TTL=1)
+    async def test_idle_callee_stays_reachable_after_ttl(self):
+        self.callee = await sync_to_async(self.create_user)('bob')
+        callee = await self.call_socket(self.callee)
+        caller = await self.call_socket(self.user)
+        # Вызываемый молчит дольше TTL реестра каналов
+        await asyncio.sleep(1.6)
+        invite = {'type': 'call-invite', 'target': 'bob', 'from': 'alice', 'callId': 'call-1'}
+        await caller.send_json_to(invite)
+        self.assertEqual(await callee.receive_json_from(), invite)
+        await caller.disconnect()
+        await callee.disconnect()
+
+    async def call_socket(self, user):
+        communicator = WebsocketCommunicator(URLRouter(application), '/ws/call/')
+        communicator.scope['user'] = user
+        connected, _subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
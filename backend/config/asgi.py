@@ -2,15 +2,21 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 
-from backend.config.middleware import TokenAuthMiddleware
-from backend.components.ChatApp import routing as chat_routing
-from backend.components.video_calls import routing as VideoCall_routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Django настраивается до импорта consumer'ов: они тянут модели
+django_asgi_app = get_asgi_application()
+
+from config.lifespan import lifespan  # noqa: E402
+from config.middleware import TokenAuthMiddleware  # noqa: E402
+from config.metrics import MetricsMiddleware  # noqa: E402
+from components.ChatApp import routing as chat_routing  # noqa: E402
+from components.video_calls import routing as VideoCall_routing  # noqa: E402
+
 websocket_urlpatterns = chat_routing.application + VideoCall_routing.application
 
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+    'http': MetricsMiddleware(django_asgi_app),
+    'lifespan': lifespan,
     'websocket': TokenAuthMiddleware(
             URLRouter(
                 websocket_urlpatterns
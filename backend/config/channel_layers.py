@@ -0,0 +1,78 @@
+import bisect
+import hashlib
+
+import channels_redis
+from channels_redis.pubsub import RedisPubSubChannelLayer
+from channels_redis.utils import decode_hosts
+from django.core.exceptions import ImproperlyConfigured
+
+from config.metrics import Counter, registry
+
+
+# Версии channels_redis, с которыми проверена замена выбора узла (_get_layer/_get_shard) ниже.
+# Остальное — публичный API слоя; при обновлении пакета проверить и дополнить.
+SUPPORTED_CHANNELS_REDIS = ('4.3.',)
+
+if not channels_redis.__version__.startswith(SUPPORTED_CHANNELS_REDIS):
+    raise ImproperlyConfigured(
+        f'FanoutChannelLayer проверен с channels_redis {SUPPORTED_CHANNELS_REDIS}, '
+        f'установлен {channels_redis.__version__}; используйте CHANNEL_LAYER_MODE=queue')
+
+fanout_deliveries = registry.register(Counter(
+    'channel_layer_fanout_deliveries_total', 'Сообщения, полученные каналами процесса из channel layer.'))
+
+
+class HashRing:
+    """Консистентное хэширование с виртуальными узлами.
+
+    При добавлении или удалении узла Redis переезжает примерно 1/N групп,
+    а не почти все, как при хэше по модулю числа узлов.
+    """
+
+    def __init__(self, nodes, replicas=128):
+        ring = sorted((self._hash(f'{node}#{replica}'), index)
+                      for index, node in enumerate(nodes) for replica in range(replicas))
+        self._points = [point for point, _index in ring]
+        self._nodes = [index for _point, index in ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key):
+        """Индекс узла, отвечающего за ключ."""
+        position = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[position]
+
+
+class FanoutChannelLayer(RedisPubSubChannelLayer):
+    """Channel layer с раздачей сообщений групп внутри процесса.
+
+    group_send — одна публикация в Redis на событие; каждый процесс один раз
+    подписан на канал группы и сам раскладывает сообщение по своим сокетам,
+    сколько бы участников комнаты на нём ни сидело (это поведение
+    RedisPubSubChannelLayer). Сверху добавлено только распределение групп и
+    каналов по узлам из hosts консистентным хэшированием.
+
+    Доставка pub/sub — не более одного раза: пропущенное при обрыве клиент
+    чата дочитывает по since_seq.
+    """
+
+    def __init__(self, *args, ring_replicas=128, **kwargs):
+        super().__init__(*args, **kwargs)
+        hosts = decode_hosts(kwargs.get('hosts'))
+        # Узлы кольца в том же порядке, в каком channels_redis создаёт соединения
+        self.ring = HashRing([sorted(host.items()) for host in hosts], ring_replicas)
+
+    def _get_layer(self):
+        layer = super()._get_layer()
+        if getattr(layer, 'ring', None) is None:
+            # Единственная замена внутренностей: выбор узла по кольцу вместо хэша по модулю
+            layer.ring = self.ring
+            layer._get_shard = lambda name: layer._shards[layer.ring.get(name)]
+        return layer
+
+    async def receive(self, channel):
+        message = await self._get_layer().receive(channel)
+        fanout_deliveries.inc()
+        return message
@@ -0,0 +1,32 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+_shutdown_handlers = []
+
+
+def on_shutdown(handler):
+    """Регистрирует корутину, которую воркер выполнит при остановке (ASGI lifespan.shutdown)."""
+    _shutdown_handlers.append(handler)
+    return handler
+
+
+async def lifespan(scope, receive, send):
+    """Обработчик протокола ASGI lifespan (uvicorn, hypercorn; daphne его не шлёт).
+
+    При остановке воркера event loop ещё работает, поэтому сервисы успевают
+    дописать накопленное асинхронно, а не из atexit.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for handler in _shutdown_handlers:
+                try:
+                    await handler()
+                except Exception:
+                    logger.exception("Ошибка при остановке воркера в %s", handler)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
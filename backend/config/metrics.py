@@ -0,0 +1,205 @@
+import functools
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in labels)
+    return '{' + pairs + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f'{self.name}{_format_labels(labels)} {value}']
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            value = self._values.get(key, 0) - amount
+            if value:
+                self._values[key] = value
+            else:
+                # Не копим серии для закрытых комнат
+                self._values.pop(key, None)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, labels, value):
+        counts, total, count = value
+        lines = []
+        for bound, bucket_count in zip(self.buckets, counts):
+            lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", bound),))} {bucket_count}')
+        lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class Registry:
+    """Метрики воркера. Коллекторы — функции, отдающие (имя, тип, описание, {labels: значение})."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, metric_type, documentation, values in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in values.items():
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+command_seconds = registry.register(Histogram(
+    'ws_command_seconds', 'Время обработки команды WebSocket-консьюмером.'))
+repository_seconds = registry.register(Histogram(
+    'chat_repository_seconds', 'Время вызова метода ChatRepository (включая переход в поток БД).'))
+channel_layer_seconds = registry.register(Histogram(
+    'channel_layer_seconds', 'Время вызова channel layer.'))
+open_sockets = registry.register(Gauge(
+    'ws_open_sockets', 'Открытые WebSocket-соединения по типу consumer.'))
+rate_limited = registry.register(Counter(
+    'ws_rate_limited_total', 'Команды, отклонённые лимитом частоты.'))
+slow_consumers = registry.register(Counter(
+    'ws_slow_consumer_total', 'Меры против медленных клиентов: shed — пропущено эфемерное событие, drop — отключён.'))
+
+
+def timed(histogram, **labels):
+    """Декоратор корутины: пишет длительность вызова в histogram."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI-обёртка HTTP-приложения: отдаёт /metrics в формате Prometheus.
+
+    Доступ — по токену или адресу сборщика из settings.METRICS, остальным 403.
+    """
+
+    def __init__(self, app, path='/metrics'):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].rstrip('/') != self.path:
+            return await self.app(scope, receive, send)
+        if not self.allowed(scope):
+            return await self.respond(send, 403, b'Forbidden')
+        await self.respond(send, 200, registry.render().encode('utf-8'))
+
+    @staticmethod
+    def allowed(scope):
+        token = settings.METRICS['token']
+        if token:
+            authorization = dict(scope['headers']).get(b'authorization', b'')
+            if hmac.compare_digest(authorization, f'Bearer {token}'.encode()):
+                return True
+        client = scope.get('client')
+        return bool(client) and client[0] in settings.METRICS['allowed_ips']
+
+    @staticmethod
+    async def respond(send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                        (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
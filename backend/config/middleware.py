@@ -4,22 +4,29 @@ from django.contrib.auth.models import AnonymousUser
 from channels.db import database_sync_to_async
 import urllib.parse
 
+from components.accounts.services.ws_tickets import ticket_verifier
+
 @database_sync_to_async
 def get_user_from_token(key):
     try:
-        token = Token.objects.get(key=key)
-        return token.user
+        token = Token.objects.select_related('user').get(key=key)
     except Token.DoesNotExist:
         return AnonymousUser()
+    return token.user if token.user.is_active else AnonymousUser()
 
 class TokenAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
         # Извлекаем токен из параметров URL
         query_string = scope.get('query_string', b'').decode('utf-8')
         params = urllib.parse.parse_qs(query_string)
+        ticket = params.get('ticket', [None])[0]
         token_key = params.get('token', [None])[0]
 
-        if token_key:
+        if ticket:
+            # Подписанный билет проверяется без запроса в БД
+            scope["user"] = await ticket_verifier.verify(ticket) or AnonymousUser()
+        elif token_key:
+            # Старый путь: поиск токена в БД на каждое подключение
             scope["user"] = await get_user_from_token(token_key)
         else:
             scope["user"] = AnonymousUser()
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'rest_framework',
     'rest_framework.authtoken',
@@ -151,11 +152,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+# Channel layer: 'queue' — channels_redis.core (копия сообщения на каждый канал группы);
+# 'fanout' — одна публикация в Redis на событие комнаты и раздача по сокетам внутри
+# процесса, группы разнесены по узлам консистентным хэшированием (доставка не более
+# одного раза, только для проверенных версий channels_redis)
+CHANNEL_LAYER_MODE = os.getenv('CHANNEL_LAYER_MODE', 'queue')
+CHANNEL_LAYER_HOSTS = os.getenv('CHANNEL_LAYER_HOSTS', 'redis://127.0.0.1:6379').split(',')
+
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': {
+            'fanout': 'config.channel_layers.FanoutChannelLayer',
+            'queue': 'channels_redis.core.RedisChannelLayer',
+        }[CHANNEL_LAYER_MODE],
         'CONFIG': {
-            'hosts': [('127.0.0.1', 6379)],
+            'hosts': CHANNEL_LAYER_HOSTS,
         },
     },
 }
@@ -196,9 +207,173 @@ AWS_S3_SIGNATURE_VERSION = "s3v4"  # Поддерживаемая версия 
 # MEDIA настройки
 MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/"
 
+# Размер страницы истории чата (connect и команда load_more)
+CHAT_HISTORY_PAGE_SIZE = 50
+
+# Верхняя граница счётчика непрочитанных в списке чатов
+CHAT_UNREAD_LIMIT = 100
+
+# Кэш последних сообщений комнаты в Redis (size не меньше CHAT_HISTORY_PAGE_SIZE)
+CHAT_HISTORY_CACHE = {
+    'size': CHAT_HISTORY_PAGE_SIZE,
+    'ttl': 24 * 60 * 60,
+}
+
+# Поиск по сообщениям: размер страницы и сколько свежих совпадений ранжировать за запрос
+# (более старые клиент получает следующим запросом с before_id)
+CHAT_SEARCH = {
+    'page_size': 20,
+    'max_candidates': 1000,
+}
+
+# Отложенная пакетная запись сообщений: рассылка не ждёт INSERT
+CHAT_WRITE_BEHIND = {
+    'enabled': False,
+    'batch_size': 200,
+    'flush_interval': 0.05,  # секунды
+    'max_pending': 10000,  # при заполненной очереди новые сообщения отклоняются
+}
+
+# Лимиты частоты команд чата (токен-бакеты); shared — общие для воркеров через Redis
+CHAT_RATE_LIMIT = {
+    'shared': False,
+    'limits': {
+        'user': {'rate': 5, 'burst': 20},  # команд в секунду на пользователя
+        'room': {'rate': 50, 'burst': 200},  # команд в секунду на комнату
+    },
+}
+
+# Отставание соединения в кадрах (очередь плюс не подтверждённые клиентом через ack):
+# при shed_threshold пропускаются эфемерные события (отметки о прочтении), при
+# max_queue медленный клиент отключается. Подключение к чату требует ?acks=1:
+# daphne принимает кадры без ожидания сети, так что ни очередь, ни время send
+# отставания не показывают. Клиент шлёт {'type': 'ack', 'received': n} примерно
+# раз в 25 кадров, поэтому оба порога должны быть заметно больше 25.
+CHAT_OUTBOX = {
+    'shed_threshold': 100,
+    'max_queue': 1000,
+}
+
+# Эфемерные события (набор текста, просмотр): склейка в одну пачку за window секунд
+CHAT_EPHEMERAL = {
+    'window': 0.25,
+}
+
+# Журнал событий комнаты для досылки пропущенного после переподключения (?since_seq=)
+CHAT_EVENT_LOG = {
+    'size': 500,  # событий на комнату; при большем разрыве клиент получает полную страницу
+    'ttl': 24 * 60 * 60,
+}
+
+# Позиции прочтения: пишутся в Redis, в Room_users.last_read_id сбрасываются пачками
+CHAT_READ_RECEIPTS = {
+    'flush_interval': 5.0,  # секунды
+    'batch_size': 500,
+    'ttl': 7 * 24 * 60 * 60,
+    'claim_timeout': 60,  # секунды: после этого пачку упавшего воркера запишет другой
+}
+
 # settings.py
 REDIS_CONFIG = {
     'host': 'localhost',
     'port': 6379,
     'db': 0,
+    'max_connections': 50,  # на пул воркера
+}
+
+# manage.py test работает с отдельной базой Redis: тесты очищают её целиком
+if len(sys.argv) > 1 and sys.argv[1] == 'test':
+    REDIS_CONFIG['db'] = 15
+
+# Сколько живёт запись "пользователь -> каналы" для адресных сигналов звонков, секунды
+VIDEO_CALL_CHANNEL_TTL = 60 * 60
+
+# Время жизни подписанного билета для подключения к WebSocket, секунды
+WS_TICKET_TTL = 15 * 60
+
+# Доступ к /metrics: заголовок Authorization: Bearer <token> или адрес из allowed_ips;
+# без токена и адресов эндпоинт закрыт
+METRICS = {
+    'token': os.getenv('METRICS_TOKEN', ''),
+    'allowed_ips': [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',') if ip],
+}
+
+# Кэш профилей (username, avatar_url) в памяти воркера
+PROFILE_CACHE = {
+    'max_size': 10000,
+    'ttl': 300,
+}
+
+# Кэш участников комнат в памяти воркера (проверка доступа к чату)
+CHAT_MEMBERSHIP_CACHE = {
+    'max_size': 10000,
+    'ttl': 60,
+}
+
+# Репозиторий чата: 'sync' — запросы через соединение Django в потоке БД (database_sync_to_async),
+# 'async' — асинхронный psycopg прямо из event loop, подготовленные запросы, пул CHAT_ASYNC_DB
+CHAT_REPOSITORY = os.getenv('CHAT_REPOSITORY', 'sync')
+
+# Пул соединений асинхронного репозитория (на event loop воркера)
+CHAT_ASYNC_DB = {
+    'max_size': 10,
+    'timeout': 5.0,  # секунды ожидания свободного соединения
+}
+
+# Сколько пользователей можно добавить или удалить одним запросом
+CHAT_MEMBERS_BULK_LIMIT = 500
+
+# Превью аватарок: загрузка кладётся в spool_dir и обрабатывается в фоне;
+# превью (sizes x formats, первый формат — основной) пишутся в storage
+AVATARS = {
+    'storage': 'storages.backends.s3boto3.S3Boto3Storage',
+    'options': {'querystring_auth': False},  # постоянные URL: превью кэшируются клиентами
+    'prefix': 'avatars',
+    'sizes': [32, 64, 128, 256],
+    'formats': ['webp', 'jpeg'],
+    'chat_size': 64,  # размер аватарки в сообщениях чата
+    # Локальный каталог машины: process_avatars нужно запускать на каждой машине
+    'spool_dir': os.path.join(PROJECT_DIR, 'avatar_uploads'),
+    'max_upload_size': 10 * 1024 * 1024,
+    # False — превью рисует отдельный процесс process_avatars --interval N, а не воркер ASGI:
+    # кодирование картинок держит GIL и задерживает event loop со всеми сокетами.
+    # True — пул из workers потоков в самом воркере (удобно для разработки)
+    'in_process': os.getenv('AVATARS_IN_PROCESS', '') == '1',
+    'workers': 2,
+}
+
+# Присутствие в комнатах чата и звонках: heartbeat раз в heartbeat_interval, запись живёт ttl секунд
+PRESENCE = {
+    'ttl': 60,
+    'heartbeat_interval': 20,
+}
+
+# Помесячные партиции сообщений: сколько месяцев вперёд создавать заранее
+CHAT_PARTITIONS_MONTHS_AHEAD = 3
+
+# Выгрузка истории в NDJSON: сообщений на один кусок ответа (и на одну выборку курсора)
+CHAT_EXPORT = {
+    'batch_size': 2000,
+}
+
+# Вложения сообщений: загрузка частями по chunk_size байт, файлы в storage
+CHAT_ATTACHMENTS = {
+    'storage': 'storages.backends.s3boto3.S3Boto3Storage',
+    'options': {},
+    'prefix': 'attachments',
+    'chunk_size': 5 * 1024 * 1024,
+    'max_size': 100 * 1024 * 1024,
+    'max_per_message': 10,
+    'abandoned_after': 24 * 60 * 60,  # секунды; незавершённые загрузки старше удаляет purge_attachment_uploads
+}
+
+# Архив старых партиций: сжатые сегменты в хранилище Django (для S3 —
+# 'storages.backends.s3boto3.S3Boto3Storage' с опциями бакета)
+CHAT_ARCHIVE = {
+    'storage': 'django.core.files.storage.FileSystemStorage',
+    'options': {'location': os.path.join(PROJECT_DIR, 'archive')},
+    'prefix': 'messages',
+    'keep_months': 12,
+    'index': {'max_size': 10000, 'ttl': 300},  # список сегментов комнат в памяти воркера
+    'segment_cache_bytes': 64 * 1024 * 1024,  # сжатые сегменты в памяти воркера
 }
@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase, override_settings
+
+from config.metrics import MetricsMiddleware
+
+
+async def not_found(scope, receive, send):
+    raise AssertionError('/metrics не должен доходить до приложения')
+
+
+@override_settings(METRICS={'token': 'secret', 'allowed_ips': ['10.0.0.5']})
+class MetricsAccessTests(SimpleTestCase):
+    async def get(self, client='192.0.2.1', headers=()):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'path': '/metrics', 'client': (client, 50000), 'headers': list(headers)}
+        await MetricsMiddleware(not_found)(scope, None, send)
+        return sent[0]['status'], sent[1]['body']
+
+    async def test_anonymous_scrape_is_forbidden(self):
+        self.assertEqual(await self.get(), (403, b'Forbidden'))
+        self.assertEqual((await self.get(headers=[(b'authorization', b'Bearer wrong')]))[0], 403)
+
+    async def test_token_or_allowed_address_gets_metrics(self):
+        status, body = await self.get(headers=[(b'authorization', b'Bearer secret')])
+        self.assertEqual(status, 200)
+        self.assertIn(b'ws_open_sockets', body)
+        self.assertEqual((await self.get(client='10.0.0.5'))[0], 200)
+
+    @override_settings(METRICS={'token': '', 'allowed_ips': []})
+    async def test_endpoint_is_closed_without_configuration(self):
+        self.assertEqual((await self.get(client='127.0.0.1', headers=[(b'authorization', b'Bearer ')]))[0], 403)
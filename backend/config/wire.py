@@ -0,0 +1,88 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # бинарный формат необязателен
+    msgpack = None
+
+
+# Подпротокол WebSocket, которым клиент запрашивает бинарный формат
+BINARY_SUBPROTOCOL = 'msgpack.v1'
+
+# Код закрытия для кадра, который не удалось разобрать (1002 серверу отправлять нельзя)
+PROTOCOL_ERROR_CLOSE_CODE = 4002
+
+# Короткие ключи для статичных полей конверта кадров чата и звонков.
+# Сокращаются только ключи верхнего уровня: вложенные данные (сообщения
+# истории, поля SDP/ICE) передаются как есть.
+SHORT_KEYS = {
+    'type': 't',
+    'id': 'i',
+    'message': 'm',
+    'messages': 'ms',
+    'message_id': 'mi',
+    'new_text': 'n',
+    'user': 'u',
+    'datetime': 'd',
+    'avatar_url': 'a',
+    'edited': 'e',
+    'has_more': 'h',
+    'before_id': 'b',
+    'error': 'x',
+    'target': 'tg',
+    'from': 'f',
+    'callId': 'c',
+    'user_id': 'ui',
+    'seq': 's',
+    'events': 'ev',
+    'retry_after': 'ra',
+    'attachments': 'at',
+    'kind': 'k',
+    'active': 'ac',
+    'received': 'rc',
+}
+LONG_KEYS = {short: key for key, short in SHORT_KEYS.items()}
+
+
+def _rename(frame, keys):
+    return {keys.get(key, key): value for key, value in frame.items()}
+
+
+class WireCodec:
+    """Кодирование кадров WebSocket: JSON по умолчанию или MessagePack с короткими ключами."""
+
+    def __init__(self, binary=False):
+        self.binary = binary
+
+    @classmethod
+    def negotiate(cls, scope):
+        """Выбирает формат по подпротоколам, предложенным клиентом при подключении."""
+        binary = msgpack is not None and BINARY_SUBPROTOCOL in scope.get('subprotocols', [])
+        return cls(binary)
+
+    @property
+    def subprotocol(self):
+        return BINARY_SUBPROTOCOL if self.binary else None
+
+    def encode(self, data):
+        """Аргументы для AsyncWebsocketConsumer.send()."""
+        if self.binary:
+            return {'bytes_data': msgpack.packb(_rename(data, SHORT_KEYS))}
+        return {'text_data': json.dumps(data)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        """Кадр клиента как dict; ValueError, если кадр не разбирается или не объект."""
+        if bytes_data is not None:
+            if not self.binary:
+                raise ValueError('binary frame on a JSON connection')
+            try:
+                frame = msgpack.unpackb(bytes_data)
+            except Exception as error:
+                raise ValueError(f'malformed MessagePack frame: {error}') from error
+            if not isinstance(frame, dict):
+                raise ValueError('frame is not an object')
+            return _rename(frame, LONG_KEYS)
+        frame = json.loads(text_data)
+        if not isinstance(frame, dict):
+            raise ValueError('frame is not an object')
+        return frame
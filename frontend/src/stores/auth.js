@@ -12,6 +12,14 @@ const api = axios.create({
   }
 });
 
+// Short-lived signed ticket for opening a WebSocket: the auth token itself never goes into a URL
+export async function fetchWsTicket() {
+  const response = await api.post('/ws/ticket/', null, {
+    headers: { Authorization: `Token ${localStorage.getItem('token')}` }
+  });
+  return response.data.ticket;
+}
+
 export const useAuthStore = defineStore('auth', {
   state: () => ({
     token: null,
@@ -134,8 +142,15 @@ export const useAuthStore = defineStore('auth', {
           }
         });
 
-        this.avatarUrl = response.data.avatar_url;
-        return response.data.avatar_url;
+        // Thumbnails are generated in the background; poll until they are ready
+        let profile = response.data;
+        for (let attempt = 0; profile.status === 'pending' && attempt < 10; attempt++) {
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          profile = (await api.get('/user/profile/')).data;
+        }
+
+        this.avatarUrl = profile.avatar_url;
+        return profile.avatar_url;
       } catch (err) {
         console.error('Failed to update avatar:', err);
         throw err;
@@ -1,6 +1,6 @@
 import { defineStore } from 'pinia';
 import { ref } from 'vue';
-import { useAuthStore } from './auth';
+import { fetchWsTicket, useAuthStore } from './auth';
 
 export const useCallStore = defineStore('call', {
   state: () => ({
@@ -17,12 +17,21 @@ export const useCallStore = defineStore('call', {
   }),
 
   actions: {
-    connectToCallSocket() {
+    async connectToCallSocket() {
       const authStore = useAuthStore();
       if (!authStore.token) return;
 
+      let ticket;
+      try {
+        ticket = await fetchWsTicket();
+      } catch (error) {
+        console.error('Failed to get a WebSocket ticket, retrying in 5 seconds:', error);
+        setTimeout(() => this.connectToCallSocket(), 5000);
+        return;
+      }
+
       this.socket = new WebSocket(
-          `ws://${window.location.hostname}:8000/ws/call/?token=${authStore.token}`
+          `ws://${window.location.hostname}:8000/ws/call/?ticket=${encodeURIComponent(ticket)}`
       );
 
       this.socket.onmessage = async (event) => {
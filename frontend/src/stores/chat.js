@@ -1,5 +1,6 @@
 import { defineStore } from 'pinia';
 import axios from 'axios';
+import { fetchWsTicket } from './auth';
 
 // Create axios instance with default config
 const api = axios.create({
@@ -16,11 +17,21 @@ if (token) {
   api.defaults.headers.common['Authorization'] = `Token ${token}`;
 }
 
+// Acknowledge received frames every ACK_EVERY frames (server CHAT_OUTBOX thresholds are well above it)
+const ACK_EVERY = 25;
+
 export const useChatStore = defineStore('chat', {
   state: () => ({
     chats: [],
     currentChat: null,
     messages: [],
+    hasMoreMessages: true,
+    readReceipts: {},
+    typingUsers: {},
+    lastTypingSentAt: 0,
+    lastSeq: null,
+    receivedFrames: 0,
+    lastReadId: 0,
     socket: null,
     error: null,
     isReconnecting: false
@@ -112,44 +123,57 @@ export const useChatStore = defineStore('chat', {
       }
     },
     
-    connectToChat(chatId) {
+    async connectToChat(chatId, resume = false) {
       const token = localStorage.getItem('token');
       if (!token) {
         this.error = 'Authentication required. Please log in.';
         return;
       }
 
-      this.disconnectFromChat();
-      
+      // On reconnect keep the loaded messages and ask only for missed events
+      const sinceSeq = resume ? this.lastSeq : null;
+      if (resume) {
+        this.socket = null;
+      } else {
+        this.disconnectFromChat();
+      }
+
       try {
+        const ticket = await fetchWsTicket();
+        const query = sinceSeq !== null ? `&since_seq=${sinceSeq}` : '';
+        this.receivedFrames = 0;
         this.socket = new WebSocket(
-          `ws://${window.location.hostname}:8000/ws/chat/${chatId}/?token=${token}`
+          `ws://${window.location.hostname}:8000/ws/chat/${chatId}/?ticket=${encodeURIComponent(ticket)}&acks=1${query}`
         );
         
         this.socket.onmessage = (event) => {
           const message = JSON.parse(event.data);
+          // Tell the server how far we got so it can spot a lagging connection
+          this.receivedFrames += 1;
+          if (this.receivedFrames % ACK_EVERY === 0) {
+            this.socket.send(JSON.stringify({ type: 'ack', received: this.receivedFrames }));
+          }
           // Handle different message types
-          if (message.type === 'delete') {
-            this.messages = this.messages.filter(m => m.id !== message.message_id);
-          } else if (message.type === 'edit') {
-            const index = this.messages.findIndex(m => m.id === message.message_id);
-            if (index !== -1) {
-              this.messages[index] = {
-                ...this.messages[index],
-                message: message.new_text,
-                edited: true
-              };
+          if (message.type === 'history') {
+            if (message.seq !== undefined) {
+              // Newest page: on connect or when the missed gap was too large to replay
+              this.messages = message.messages;
+              this.lastSeq = message.seq;
+            } else {
+              // Older page requested via load_more
+              this.messages = [...message.messages, ...this.messages];
             }
+            this.hasMoreMessages = message.has_more;
+          } else if (message.type === 'sync') {
+            message.events.forEach(roomEvent => this.applyEvent(roomEvent));
+          } else if (message.type === 'error' && message.error === 'rate_limited') {
+            this.error = 'You are sending messages too fast. Please slow down.';
+          } else if (message.type === 'read_receipt') {
+            this.readReceipts = { ...this.readReceipts, [message.user]: message.message_id };
+          } else if (message.type === 'ephemeral') {
+            message.events.forEach(ephemeralEvent => this.applyEphemeral(ephemeralEvent));
           } else {
-            // Regular message
-            this.messages.push({
-              id: message.id || Date.now(), // Fallback to timestamp if no ID
-              message: message.message || '',
-              user: message.user || 'Unknown',
-              datetime: message.datetime || new Date().toISOString(),
-              avatar_url: message.avatar_url || null,
-              edited: message.edited || false
-            });
+            this.applyEvent(message);
           }
         };
 
@@ -160,14 +184,19 @@ export const useChatStore = defineStore('chat', {
           });
         };
 
-        this.socket.onclose = () => {
+        this.socket.onclose = (event) => {
+          if (event.code === 4003) {
+            // not a member of this chat: reconnecting would be rejected again
+            this.error = 'You are not a member of this chat.';
+            return;
+          }
           if (!this.isReconnecting) {
             this.error = 'Connection lost. Attempting to reconnect...';
             this.isReconnecting = true;
             // Attempt to reconnect after 5 seconds
             setTimeout(() => {
               if (this.error === 'Connection lost. Attempting to reconnect...') {
-                this.connectToChat(chatId);
+                this.connectToChat(chatId, this.lastSeq !== null);
               }
               this.isReconnecting = false;
             }, 5000);
@@ -186,17 +215,90 @@ export const useChatStore = defineStore('chat', {
       }
     },
     
-    sendMessage(message) {
+    applyEvent(message) {
+      // Replayed and live events may overlap right after a reconnect
+      if (message.seq) {
+        if (this.lastSeq !== null && message.seq <= this.lastSeq) {
+          return;
+        }
+        this.lastSeq = message.seq;
+      }
+      if (message.type === 'delete') {
+        this.messages = this.messages.filter(m => m.id !== message.message_id);
+      } else if (message.type === 'edit') {
+        const index = this.messages.findIndex(m => m.id === message.message_id);
+        if (index !== -1) {
+          this.messages[index] = {
+            ...this.messages[index],
+            message: message.new_text,
+            edited: true
+          };
+        }
+      } else if (message.type === 'chat_message') {
+        if (this.messages.some(m => m.id === message.id)) {
+          return;
+        }
+        this.messages.push({
+          id: message.id || Date.now(), // Fallback to timestamp if no ID
+          message: message.message || '',
+          user: message.user || 'Unknown',
+          datetime: message.datetime || new Date().toISOString(),
+          avatar_url: message.avatar_url || null,
+          edited: message.edited || false,
+          attachments: message.attachments || []
+        });
+      }
+    },
+
+    sendMessage(message, attachments = []) {
       if (this.socket?.readyState === WebSocket.OPEN) {
         this.socket.send(JSON.stringify({ 
           type: 'message',
-          message 
+          message,
+          attachments
         }));
       } else {
         this.error = 'Unable to send message. Please check your connection.';
       }
     },
 
+    async uploadAttachment(file, chatId) {
+      // Chunked upload: after a failure only the chunks the server lacks are re-sent
+      try {
+        let session = (await api.post('/chat/attachments/', {
+          room_id: chatId,
+          file_name: file.name,
+          content_type: file.type,
+          size: file.size
+        })).data;
+        for (let attempt = 0; attempt < 3 && session.received.length < session.chunk_count; attempt++) {
+          for (let index = 0; index < session.chunk_count; index++) {
+            if (session.received.includes(index)) {
+              continue;
+            }
+            const chunk = file.slice(index * session.chunk_size, (index + 1) * session.chunk_size);
+            try {
+              await api.put(`/chat/attachments/${session.id}/chunks/${index}/`, chunk, {
+                headers: { 'Content-Type': 'application/octet-stream' },
+                timeout: 60000
+              });
+            } catch (err) {
+              console.error('Chunk upload failed, will retry:', err.message);
+            }
+          }
+          session = (await api.get(`/chat/attachments/${session.id}/`)).data;
+        }
+        return (await api.post(`/chat/attachments/${session.id}/complete/`)).data;
+      } catch (err) {
+        this.error = 'Failed to upload the file. Please try again.';
+        console.error('Failed to upload attachment:', {
+          message: err.message,
+          status: err.response?.status
+        });
+        return null;
+      }
+    },
+
     editMessage(messageId, newText) {
       if (this.socket?.readyState === WebSocket.OPEN) {
         this.socket.send(JSON.stringify({
@@ -209,6 +311,62 @@ export const useChatStore = defineStore('chat', {
       }
     },
 
+    loadMoreMessages() {
+      if (!this.hasMoreMessages || this.messages.length === 0) {
+        return;
+      }
+      if (this.socket?.readyState === WebSocket.OPEN) {
+        this.socket.send(JSON.stringify({
+          type: 'load_more',
+          before_id: this.messages[0].id
+        }));
+      }
+    },
+
+    markRead(messageId) {
+      // The server ignores positions that do not move forward, so skip them here too
+      if (messageId <= this.lastReadId) {
+        return;
+      }
+      if (this.socket?.readyState === WebSocket.OPEN) {
+        this.lastReadId = messageId;
+        this.socket.send(JSON.stringify({
+          type: 'read',
+          message_id: messageId
+        }));
+      }
+    },
+
+    sendTyping(active = true) {
+      // Keystrokes are throttled here; the server batches the rest per room
+      const now = Date.now();
+      if (active && now - this.lastTypingSentAt < 2000) {
+        return;
+      }
+      if (this.socket?.readyState === WebSocket.OPEN) {
+        this.lastTypingSentAt = active ? now : 0;
+        this.socket.send(JSON.stringify({
+          type: 'typing',
+          active
+        }));
+      }
+    },
+
+    applyEphemeral(ephemeralEvent) {
+      if (ephemeralEvent.kind !== 'typing') {
+        return;
+      }
+      const { [ephemeralEvent.user]: previous, ...others } = this.typingUsers;
+      clearTimeout(previous);
+      if (ephemeralEvent.active) {
+        // Forget the indicator if no refresh arrives (the user left or stopped typing)
+        const timer = setTimeout(() => this.applyEphemeral({ ...ephemeralEvent, active: false }), 5000);
+        this.typingUsers = { ...others, [ephemeralEvent.user]: timer };
+      } else {
+        this.typingUsers = others;
+      }
+    },
+
     deleteMessage(messageId) {
       if (this.socket?.readyState === WebSocket.OPEN) {
         this.socket.send(JSON.stringify({
@@ -222,9 +380,17 @@ export const useChatStore = defineStore('chat', {
     
     disconnectFromChat() {
       if (this.socket) {
+        this.socket.onclose = null; // a deliberate close must not trigger a reconnect
         this.socket.close();
         this.socket = null;
         this.messages = [];
+        this.hasMoreMessages = true;
+        this.readReceipts = {};
+        Object.values(this.typingUsers).forEach(clearTimeout);
+        this.typingUsers = {};
+        this.lastTypingSentAt = 0;
+        this.lastReadId = 0;
+        this.lastSeq = null;
         this.error = null;
         this.isReconnecting = false;
       }